@@ -0,0 +1,352 @@
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote
+
+log = logging.getLogger(__name__)
+
+# Hop-by-hop and length headers are set by the server, not copied from the app
+_SERVER_HEADERS = {'connection', 'content-length', 'keep-alive', 'transfer-encoding'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Request:
+    """One parsed HTTP request; header names are lower case"""
+
+    __slots__ = ('method', 'target', 'path', 'query_string', 'version', 'headers', 'body', 'peer')
+
+    def __init__(self, method, target, version, headers, peer):
+        self.method = method
+        self.target = target
+        path, _, self.query_string = target.partition('?')
+        self.path = unquote(path)
+        self.version = version
+        self.headers = headers
+        self.body = b''
+        self.peer = peer
+
+    @property
+    def query(self):
+        return dict(parse_qsl(self.query_string))
+
+    @property
+    def mimetype(self):
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+
+class AsyncHTTPServer:
+    """Asyncio HTTP/1.1 server for many slow, mostly idle device connections.
+
+    Every connection is a coroutine, not a thread, so thousands of open
+    keep-alive sockets cost a little memory each. Each connection gets:
+    ``idle_timeout`` seconds to start its next request,
+    ``header_timeout`` to finish sending the headers once it has started,
+    ``body_timeout`` for the body and ``write_timeout`` to take the response.
+    Beyond ``max_connections`` new connections get 503 straight away.
+
+    ``routes`` maps ``(method, path)`` to ``async handler(request)``
+    returning ``(status, headers, body)``. ``body`` is bytes, or an async
+    iterator of bytes that is streamed until it ends (the connection is then
+    closed). Everything else goes to ``wsgi_app`` on a pool of
+    ``wsgi_workers`` threads, so the Flask routes are served unchanged. A
+    handler can also do its waiting on the loop and then pass the request
+    to ``wsgi()``, so a long wait never holds one of those threads.
+    """
+
+    def __init__(self, wsgi_app, routes=None, host='0.0.0.0', port=5000, max_connections=10000,
+                 idle_timeout=15.0, header_timeout=5.0, body_timeout=10.0, write_timeout=10.0,
+                 max_header_bytes=16 * 1024, max_body_bytes=1024 * 1024, wsgi_workers=32):
+        self.wsgi_app = wsgi_app
+        self.routes = dict(routes or {})
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.write_timeout = write_timeout
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.wsgi_workers = wsgi_workers
+        self.active = 0
+        self.requests = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._executor = None
+        self._server = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    async def start(self):
+        self._executor = ThreadPoolExecutor(self.wsgi_workers, thread_name_prefix='wsgi')
+        self._server = await asyncio.start_server(
+            self._connection, self.host, self.port,
+            limit=self.max_header_bytes, backlog=1024, reuse_address=True
+        )
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        """Serve until interrupted (blocking; KeyboardInterrupt propagates)"""
+        try:
+            asyncio.run(self.serve_forever())
+        finally:
+            self.close()
+
+    # ------------------------------------------------------------------
+    # Connections
+    # ------------------------------------------------------------------
+    async def _connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        if self.active >= self.max_connections:
+            self.rejected += 1
+            await self._send_error(writer, 503, 'Too many connections')
+            return
+
+        self.active += 1
+        try:
+            first = True
+            while True:
+                try:
+                    request = await self._read_request(reader, writer, peer, first)
+                except HttpError as e:
+                    await self._send_error(writer, e.status, str(e))
+                    break
+                if request is None:
+                    break
+                first = False
+                self.requests += 1
+
+                try:
+                    status, headers, body = await self._dispatch(request)
+                except Exception:
+                    log.exception("Unhandled error serving %s %s", request.method, request.path)
+                    status, headers, body = 500, [('Content-Type', 'text/plain')], b'Internal Server Error'
+
+                streaming = not isinstance(body, (bytes, bytearray))
+                keep_alive = request.keep_alive and not streaming
+                await self._respond(writer, request, status, headers, body, keep_alive)
+                if not keep_alive:
+                    break
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _read_request(self, reader, writer, peer, first):
+        """Next request on the connection, or None once the client is done"""
+        try:
+            start = await asyncio.wait_for(reader.readexactly(1), self.idle_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None  # Idle keep-alive connection or client closed it
+        try:
+            head = start + await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.header_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HttpError(408)
+        except asyncio.LimitOverrunError:
+            raise HttpError(431)
+        except asyncio.IncompleteReadError:
+            return None
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HttpError(400, 'Bad request line')
+        if version not in ('HTTP/1.0', 'HTTP/1.1'):
+            raise HttpError(505)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise HttpError(400, 'Bad header')
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+        request = Request(method, target, version, headers, peer)
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        try:
+            request.body = await asyncio.wait_for(self._read_body(reader, headers), self.body_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HttpError(408)
+        return request
+
+    async def _read_body(self, reader, headers):
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            try:
+                return await self._read_chunked(reader)
+            except (asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+                raise HttpError(400, 'Bad chunked body')
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, 'Bad Content-Length')
+        if length < 0:
+            raise HttpError(400, 'Bad Content-Length')
+        if length > self.max_body_bytes:
+            raise HttpError(413)
+        return await reader.readexactly(length) if length else b''
+
+    async def _read_chunked(self, reader):
+        chunks, size = [], 0
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            try:
+                length = int(line.split(b';')[0], 16)
+            except ValueError:
+                raise HttpError(400, 'Bad chunk')
+            if length < 0:
+                raise HttpError(400, 'Bad chunk')
+            if not length:
+                await reader.readuntil(b'\r\n')  # Trailers are not supported
+                return b''.join(chunks)
+            size += length
+            if size > self.max_body_bytes:
+                raise HttpError(413)
+            chunks.append(await reader.readexactly(length))
+            if await reader.readexactly(2) != b'\r\n':
+                raise HttpError(400, 'Bad chunk')
+
+    # ------------------------------------------------------------------
+    # Responses
+    # ------------------------------------------------------------------
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is not None:
+            status, headers, body = await handler(request)
+            return status, list(headers), body
+        return await self.wsgi(request)
+
+    async def wsgi(self, request):
+        """Serve ``request`` with ``wsgi_app`` on the thread pool; handlers may hand requests on"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call_wsgi, request)
+
+    async def _respond(self, writer, request, status, headers, body, keep_alive):
+        lines = [f'HTTP/1.1 {status} {_phrase(status)}']
+        lines.extend(f'{name}: {value}' for name, value in headers
+                     if name.lower() not in _SERVER_HEADERS)
+        streaming = not isinstance(body, (bytes, bytearray))
+        if not streaming:
+            lines.append(f'Content-Length: {len(body)}')
+        if keep_alive:
+            lines.append('Connection: keep-alive')
+            lines.append(f'Keep-Alive: timeout={int(self.idle_timeout)}')
+        else:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        if not streaming:
+            if request.method != 'HEAD':
+                writer.write(body)
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+            return
+        try:
+            async for chunk in body:
+                writer.write(chunk)
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
+        finally:
+            await body.aclose()
+
+    async def _send_error(self, writer, status, message):
+        body = f'{status} {message}\n'.encode('utf-8')
+        writer.write((f'HTTP/1.1 {status} {_phrase(status)}\r\n'
+                      f'Content-Type: text/plain; charset=utf-8\r\n'
+                      f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode('latin-1') + body)
+        try:
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        writer.close()
+
+    # ------------------------------------------------------------------
+    # WSGI bridge (runs on the thread pool)
+    # ------------------------------------------------------------------
+    def _call_wsgi(self, request):
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path,
+            'QUERY_STRING': request.query_string,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': request.version,
+            'REMOTE_ADDR': request.peer[0] if request.peer else '',
+            'CONTENT_TYPE': request.headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(request.body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(request.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in request.headers.items():
+            if name not in ('content-type', 'content-length'):
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        started = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'], started['headers'] = status, headers
+            return chunks.append
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(started['status'].split(' ', 1)[0]), started['headers'], b''.join(chunks)
+
+
+def _phrase(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ''
@@ -0,0 +1,355 @@
+from collections import deque, namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+# Alert codes; a reading's alerts are stored as a bitmask of these
+FRONT_DANGER = 0
+FRONT_WARNING = 1
+LEFT_WARNING = 2
+RIGHT_WARNING = 3
+GROUND_UNEVEN = 4
+HOLE = 5
+
+# code -> (type, location, field holding the triggering value)
+ALERT_KINDS = {
+    FRONT_DANGER: ('danger', 'front', 'front_distance'),
+    FRONT_WARNING: ('warning', 'front', 'front_distance'),
+    LEFT_WARNING: ('warning', 'left', 'left_distance'),
+    RIGHT_WARNING: ('warning', 'right', 'right_distance'),
+    GROUND_UNEVEN: ('info', 'bottom', 'ir_distance'),
+    HOLE: ('danger', 'bottom', 'ir_distance'),
+}
+
+MESSAGES = {
+    'vi': {
+        FRONT_DANGER: '⚠️ CHƯỚNG NGẠI VẬT PHÍA TRƯỚC: {value}cm',
+        FRONT_WARNING: '⚠️ Cảnh báo phía trước: {value}cm',
+        LEFT_WARNING: '⚠️ Có vật thể bên trái: {value}cm',
+        RIGHT_WARNING: '⚠️ Có vật thể bên phải: {value}cm',
+        GROUND_UNEVEN: '⚠️ Mặt đất không bằng phẳng',
+        HOLE: '⚠️ CÓ HỐ/BẬC THỀM: {value}cm',
+    },
+    'en': {
+        FRONT_DANGER: '⚠️ OBSTACLE AHEAD: {value}cm',
+        FRONT_WARNING: '⚠️ Object ahead: {value}cm',
+        LEFT_WARNING: '⚠️ Object on the left: {value}cm',
+        RIGHT_WARNING: '⚠️ Object on the right: {value}cm',
+        GROUND_UNEVEN: '⚠️ Uneven ground',
+        HOLE: '⚠️ HOLE/STEP AHEAD: {value}cm',
+    },
+}
+DEFAULT_LANG = 'vi'
+
+# Compact alert record: code, triggering value, epoch timestamp of the reading
+Alert = namedtuple('Alert', ['code', 'value', 'ts'])
+
+_LEGACY_CODES = {(kind[0], kind[1]): code for code, kind in ALERT_KINDS.items()}
+
+
+def alert_mask(data, settings):
+    """Classify a reading against the thresholds, return the alert bitmask"""
+    mask = 0
+    front = data['front_distance']
+    if 0 < front < settings['danger_distance']:
+        mask |= 1 << FRONT_DANGER
+    elif settings['danger_distance'] <= front < settings['warn_distance']:
+        mask |= 1 << FRONT_WARNING
+
+    if 0 < data['left_distance'] < settings['warn_distance']:
+        mask |= 1 << LEFT_WARNING
+    if 0 < data['right_distance'] < settings['warn_distance']:
+        mask |= 1 << RIGHT_WARNING
+
+    if data['ir_distance'] < settings['ir_ground']:
+        mask |= 1 << GROUND_UNEVEN
+    elif data['ir_distance'] > settings['ir_hole']:
+        mask |= 1 << HOLE
+    return mask
+
+
+def mask_count(mask):
+    return bin(mask).count('1')
+
+
+def mask_from_legacy(alerts):
+    """Bitmask for a list of alert dicts as stored by older versions"""
+    mask = 0
+    for alert in alerts or []:
+        code = _LEGACY_CODES.get((alert.get('type'), alert.get('location')))
+        if code is not None:
+            mask |= 1 << code
+    return mask
+
+
+def iter_alerts(mask, values, ts):
+    """Expand a bitmask into Alert records; ``values`` maps field -> value"""
+    code = 0
+    while mask:
+        if mask & 1:
+            yield Alert(code, values[ALERT_KINDS[code][2]], ts)
+        mask >>= 1
+        code += 1
+
+
+@lru_cache(maxsize=4096)
+def render_message(code, value, lang=DEFAULT_LANG):
+    templates = MESSAGES.get(lang, MESSAGES[DEFAULT_LANG])
+    return templates[code].format(value=value)
+
+
+@lru_cache(maxsize=256)
+def _render_timestamp(ts):
+    return datetime.fromtimestamp(ts).isoformat()
+
+
+def render_alert(alert, lang=DEFAULT_LANG):
+    """API dict for one Alert record"""
+    alert_type, location, _ = ALERT_KINDS[alert.code]
+    return {
+        'type': alert_type,
+        'message': render_message(alert.code, alert.value, lang),
+        'location': location,
+        'timestamp': _render_timestamp(alert.ts)
+    }
+
+
+def render_alerts(mask, values, ts, lang=DEFAULT_LANG):
+    return [render_alert(a, lang) for a in iter_alerts(mask, values, ts)]
+
+
+# ----------------------------------------------------------------------
+# Hysteresis / deduplication
+# ----------------------------------------------------------------------
+RAISE = 'raise'
+CLEAR = 'clear'
+RENOTIFY = 'renotify'
+LATE = 'late'  # Alert found in a reading older than the live state (e.g. an offline batch)
+
+CLEAR_PREFIX = {
+    'vi': '✅ Đã hết: ',
+    'en': '✅ Cleared: ',
+}
+
+SEVERITY = {'info': 0, 'warning': 1, 'danger': 2}
+
+LOCATION_CODES = {}
+for _code, (_type, _location, _field) in sorted(ALERT_KINDS.items()):
+    LOCATION_CODES.setdefault(_location, []).append(_code)
+
+# Alert state change: code, triggering value, epoch timestamp, RAISE/CLEAR/RENOTIFY/LATE
+AlertEvent = namedtuple('AlertEvent', ['code', 'value', 'ts', 'kind'])
+
+
+def widened_settings(settings, margin):
+    """Thresholds moved by ``margin`` in the direction that keeps alerts on"""
+    widened = dict(settings)
+    widened['danger_distance'] = settings['danger_distance'] + margin
+    widened['warn_distance'] = settings['warn_distance'] + margin
+    widened['ir_ground'] = settings['ir_ground'] + margin
+    widened['ir_hole'] = settings['ir_hole'] - margin
+    return widened
+
+
+class AlertTracker:
+    """Per-location alert state machine for one device.
+
+    An alert is raised as soon as a reading crosses its threshold. It is
+    cleared only once the reading is ``alert_clear_margin`` past the
+    threshold and the alert has been up for ``alert_min_hold`` seconds.
+    While it stays up, a RENOTIFY event is emitted every
+    ``alert_renotify_interval`` seconds (0 disables). Only these events are
+    recorded, so storage follows real state changes, not the sample rate.
+
+    A reading older than the last one fed in (e.g. uploaded from the
+    device's offline buffer) cannot move the live state any more. It is
+    checked against the state recorded in ``events`` at its own timestamp
+    instead: an alert that was not already up there, at the same or a
+    higher severity, gives a LATE event. LATE events leave ``active``
+    alone and need no CLEAR; one covers later late readings of its location
+    for ``alert_renotify_interval`` seconds (at least ``alert_min_hold``).
+    ``events`` stays sorted by timestamp; ``appended`` and ``edits`` count
+    events added at the end and other changes to it (as on HistoryBuffer).
+    """
+
+    def __init__(self, event_capacity):
+        self.active = {}  # location -> [code, raised_ts, notified_ts]
+        self.events = deque(maxlen=event_capacity)
+        self.last_ts = None
+        self.late_readings = 0
+        self.appended = 0
+        self.edits = 0
+
+    def update(self, values, ts, settings):
+        """Feed one reading, return the list of new AlertEvents"""
+        if self.last_ts is not None and ts < self.last_ts:
+            return self._update_late(values, ts, settings)
+        self.last_ts = ts
+
+        margin = settings.get('alert_clear_margin', 0)
+        min_hold = settings.get('alert_min_hold', 0)
+        renotify = settings.get('alert_renotify_interval', 0)
+        raw = alert_mask(values, settings)
+        wide = alert_mask(values, widened_settings(settings, margin)) if margin else raw
+
+        new_events = []
+        for location, codes in LOCATION_CODES.items():
+            raw_code = next((c for c in codes if raw >> c & 1), None)
+            state = self.active.get(location)
+            active_code = state[0] if state else None
+            value = values[ALERT_KINDS[codes[0]][2]]
+
+            desired = raw_code
+            if active_code is not None and raw_code != active_code:
+                held = ts - state[1] < min_hold
+                sticky = wide >> active_code & 1
+                weaker = raw_code is None or \
+                    SEVERITY[ALERT_KINDS[raw_code][0]] <= SEVERITY[ALERT_KINDS[active_code][0]]
+                if (held or sticky) and weaker:
+                    desired = active_code
+
+            if desired == active_code:
+                if state and renotify > 0 and ts - state[2] >= renotify:
+                    state[2] = ts
+                    new_events.append(AlertEvent(active_code, value, ts, RENOTIFY))
+                continue
+
+            if active_code is not None:
+                del self.active[location]
+                new_events.append(AlertEvent(active_code, value, ts, CLEAR))
+            if desired is not None:
+                self.active[location] = [desired, ts, ts]
+                new_events.append(AlertEvent(desired, value, ts, RAISE))
+
+        self.events.extend(new_events)
+        self.appended += len(new_events)
+        return new_events
+
+    def _update_late(self, values, ts, settings):
+        self.late_readings += 1
+        cover = max(settings.get('alert_renotify_interval', 0), settings.get('alert_min_hold', 0))
+        raw = alert_mask(values, settings)
+        if not raw:
+            return []
+
+        codes_then = self._codes_at(ts, cover)
+        new_events = []
+        for location, codes in LOCATION_CODES.items():
+            raw_code = next((c for c in codes if raw >> c & 1), None)
+            if raw_code is None:
+                continue
+            then = codes_then.get(location)
+            if then is not None and SEVERITY[ALERT_KINDS[then][0]] >= SEVERITY[ALERT_KINDS[raw_code][0]]:
+                continue
+            event = AlertEvent(raw_code, values[ALERT_KINDS[raw_code][2]], ts, LATE)
+            self._insert_event(event)
+            new_events.append(event)
+        return new_events
+
+    def _codes_at(self, ts, cover):
+        """location -> strongest alert code up at ``ts`` according to ``events``"""
+        state, late = {}, {}
+        for event in reversed(self.events):
+            if event.ts > ts:
+                continue
+            if len(state) == len(LOCATION_CODES) and ts - event.ts >= cover:
+                break
+            location = ALERT_KINDS[event.code][1]
+            if event.kind == LATE:
+                if ts - event.ts < cover:
+                    late.setdefault(location, []).append(event.code)
+            elif location not in state:
+                state[location] = None if event.kind == CLEAR else event.code
+
+        codes = {}
+        for location in LOCATION_CODES:
+            candidates = late.get(location, []) + [state.get(location)]
+            candidates = [code for code in candidates if code is not None]
+            if candidates:
+                codes[location] = max(candidates, key=lambda code: SEVERITY[ALERT_KINDS[code][0]])
+        return codes
+
+    def _insert_event(self, event):
+        """Insert an out-of-order event at its place in time"""
+        events = self.events
+        i = len(events)
+        while i and events[i - 1].ts > event.ts:
+            i -= 1
+        if i == len(events):
+            events.append(event)
+            self.appended += 1
+            return
+        if len(events) == events.maxlen:
+            if not i:
+                return  # Older than everything still kept
+            events.popleft()
+            i -= 1
+        events.insert(i, event)
+        self.edits += 1
+
+    def restore(self, event):
+        """Replay an event read back from the log"""
+        location = ALERT_KINDS[event.code][1]
+        if event.kind == LATE:
+            self._insert_event(event)  # Logged when it arrived, not in time order
+            return
+        if event.kind == RAISE:
+            self.active[location] = [event.code, event.ts, event.ts]
+        elif event.kind == CLEAR:
+            self.active.pop(location, None)
+        elif event.kind == RENOTIFY and location in self.active:
+            self.active[location][2] = event.ts
+        self.events.append(event)
+        self.appended += 1
+        self.last_ts = max(self.last_ts or event.ts, event.ts)
+
+    def drop_before(self, ts):
+        """Forget events older than ``ts`` (active alerts are kept)"""
+        if self.events and self.events[0].ts < ts:
+            self.edits += 1
+        while self.events and self.events[0].ts < ts:
+            self.events.popleft()
+
+    def active_alerts(self, values):
+        """Currently raised alerts as Alert records with the latest values"""
+        return [
+            Alert(code, values[ALERT_KINDS[code][2]], raised_ts)
+            for code, raised_ts, _ in sorted(self.active.values())
+        ]
+
+    def events_since(self, ts, limit=None):
+        """Most recent events newer than ``ts``, newest first"""
+        result = []
+        for event in reversed(self.events):
+            if event.ts <= ts or (limit is not None and len(result) >= limit):
+                break
+            result.append(event)
+        return result
+
+
+def render_event(event, lang=DEFAULT_LANG):
+    """API dict for one AlertEvent"""
+    rendered = render_alert(event, lang)
+    if event.kind == CLEAR:
+        prefix = CLEAR_PREFIX.get(lang, CLEAR_PREFIX[DEFAULT_LANG])
+        rendered['message'] = prefix + rendered['message']
+    rendered['event'] = event.kind
+    return rendered
+
+
+def event_record(event):
+    """Log record for an AlertEvent"""
+    return {
+        'event': event.kind,
+        'code': event.code,
+        'value': event.value,
+        'timestamp': datetime.fromtimestamp(event.ts).isoformat()
+    }
+
+
+def event_from_record(record):
+    return AlertEvent(
+        record['code'],
+        record['value'],
+        datetime.fromisoformat(record['timestamp']).timestamp(),
+        record['event']
+    )
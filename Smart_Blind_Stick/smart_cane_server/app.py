@@ -1,146 +1,592 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, redirect, render_template, jsonify, request
 from flask_cors import CORS
+from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
+import asyncio
+import atexit
 import json
+import logging
+import math
 import os
+import sys
 import threading
 import time
+from urllib.parse import parse_qsl, urlencode
+
+from backtest import ThresholdIndex, backtest, expand_grid, validate_candidate
+from alerts import (ALERT_KINDS, DEFAULT_LANG, LATE, RAISE, alert_mask, event_from_record,
+                    event_record, mask_count, render_alert, render_alerts, render_event)
+from codec import BINARY_CONTENT_TYPE, decode_readings
+from config import Config
+from cursors import decode_cursor, encode_cursor
+from devices import DEFAULT_DEVICE_ID, DeviceRegistry, new_current_data
+from history import DOWNSAMPLERS, downsample, to_epoch, to_iso
+from ingest import IngestCore
+from logs import queue_depth, setup_logging
+from metrics import Metrics
+from push import STREAM_CONTENT_TYPE, PushHub
+from respcache import ResponseCache
+from shared_state import SharedState, SharedStateFull
+from versions import VersionClock
+from storage import PartitionedLog
+from write_behind import BacklogFull
 
 app = Flask(__name__)
 CORS(app)  # Cho phép ESP32 kết nối
 
+# Kho SQL tùy chọn (models.py, routes.py), bật khi đặt DB_BACKEND=sqlite|mysql (xem config.py).
+# Log trên đĩa vẫn là nơi lưu chính; SQL nhận bản sao qua write-behind (routes.store_readings).
+db = SQLAlchemy()
+if Config.DB_ENABLED:
+    app.config['SQLALCHEMY_DATABASE_URI'] = Config.SQLALCHEMY_DATABASE_URI
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = Config.SQLALCHEMY_TRACK_MODIFICATIONS
+    db.init_app(app)
+sql_sink = None  # routes.store_readings(device_id, readings, events) khi bật kho SQL
+
+log = logging.getLogger('smart_cane')
+
+# Số liệu đo (xem /api/metrics): bộ đếm nhẹ trên đường nhận dữ liệu và xử lý request
+metrics = Metrics()
+METRIC_LABELS = {
+    'http_request_seconds': ('method', 'route', 'status'),
+    'ingest_readings': ('device',),
+    'alerts_raised': ('type', 'location'),
+    'late_readings': ('device',),
+    'history_size': ('device',),
+}
+
 # ============================================
 # BIẾN TOÀN CỤC
 # ============================================
-current_data = {
-    'front_distance': 0,
-    'left_distance': 0,
-    'right_distance': 0,
-    'ir_distance': 0,
-    'mode': 1,
-    'power_status': False,
-    'battery_level': 100,
-    'wifi_connected': False,
-    'last_update': None,
-    'alerts': []
-}
-
-data_history = []
+# Mỗi gậy (device_id) có trạng thái hiện tại, lịch sử và khóa riêng
+HISTORY_CAPACITY = 100000      # Số bản ghi tối đa giữ trong RAM cho mỗi thiết bị (log trên đĩa giữ toàn bộ)
+ALERT_EVENT_CAPACITY = 10000   # Số sự kiện cảnh báo giữ trong RAM cho mỗi thiết bị
+devices = DeviceRegistry(HISTORY_CAPACITY, ALERT_EVENT_CAPACITY)
 system_settings = {
     'danger_distance': 25,
     'warn_distance': 50,
     'safe_distance': 80,
     'ir_ground': 20,
-    'ir_hole': 40
+    'ir_hole': 40,
+    'alert_clear_margin': 5,         # cm vượt ngưỡng mới coi là hết cảnh báo
+    'alert_min_hold': 10,            # giây tối thiểu giữ một cảnh báo
+    'alert_renotify_interval': 60    # giây nhắc lại cảnh báo còn tồn tại (0 = tắt)
 }
 
+# Mọi thay đổi trạng thái (bản ghi, chế độ, cài đặt, xóa, hết hạn) do một thread writer duy nhất
+# thực hiện qua hàng đợi có giới hạn; request chỉ đọc snapshot bất biến (xem ingest.py)
+ingest_core = IngestCore(max_queue=10000, batch_size=256, put_timeout=0.5)
+INGEST_WAIT_TIMEOUT = 30  # giây chờ writer xử lý xong trước khi trả 503
+batch_records = []        # Bản ghi log của lô writer hiện tại, ghi một lần trong finish_batch()
+batch_touched = {}        # device_id -> (shard, sự kiện cảnh báo mới) đã đổi trong lô hiện tại
+
+# Chạy nhiều tiến trình: SHARED_STATE_ROLE=writer là tiến trình duy nhất nhận dữ liệu và ghi trạng thái
+# vào vùng nhớ chung; các tiến trình SHARED_STATE_ROLE=reader chỉ phục vụ đọc từ vùng nhớ đó
+# (POST được chuyển tới WRITER_URL). Không đặt = một tiến trình như trước.
+SHARED_STATE_ROLE = os.environ.get('SHARED_STATE_ROLE')
+SHARED_STATE_NAME = os.environ.get('SHARED_STATE_NAME', 'smart_cane_state')
+SHARED_STATE_DEVICES = Config.SHARED_STATE_DEVICES            # Số thiết bị tối đa trong vùng nhớ chung
+SHARED_STATE_HISTORY_ROWS = Config.SHARED_STATE_HISTORY_ROWS  # Số bản ghi gần nhất mỗi thiết bị mà reader thấy được
+SHARED_STATE_EVENTS = Config.SHARED_STATE_EVENTS              # Số sự kiện cảnh báo gần nhất mỗi thiết bị
+shared_state_full = False  # Đã báo lỗi vùng nhớ chung đầy (chỉ log một lần)
+WRITER_URL = os.environ.get('WRITER_URL')
+shared_state = None
+if SHARED_STATE_ROLE == 'writer':
+    shared_state = SharedState(SHARED_STATE_NAME, SHARED_STATE_DEVICES, SHARED_STATE_HISTORY_ROWS,
+                               SHARED_STATE_EVENTS, create=True)
+    atexit.register(shared_state.close)
+elif SHARED_STATE_ROLE == 'reader':
+    shared_state = SharedState.attach(SHARED_STATE_NAME)
+is_reader = SHARED_STATE_ROLE == 'reader'
+
+# Kênh đẩy dữ liệu thời gian thực cho dashboard (SSE, xem push.py)
+push_hub = PushHub(max_queue=64, max_clients=256)
+socketio = push_hub  # routes.py gọi socketio.emit(...)
+STREAM_HEARTBEAT = 15  # giây giữa các gói giữ kết nối
+
+# Phiên bản trạng thái cho ETag và long-poll (?since=<version>&wait=<s>)
+state_clock = VersionClock()
+settings_version = 0
+LONG_POLL_DEFAULT = 25  # giây
+LONG_POLL_MAX = 60
+
+# Bộ đệm JSON đã mã hóa sẵn (và gzip) cho các endpoint đọc nhiều, theo phiên bản trạng thái
+response_cache = ResponseCache(lambda payload: (app.json.dumps(payload) + '\n').encode('utf-8'))
+ALERTS_CACHE_SECONDS = 5  # /api/alerts phụ thuộc cả thời gian (cửa sổ `hours`)
+
+MAX_BATCH_READINGS = 1000  # Số bản ghi tối đa trong một lô gửi bù
+MAX_CLOCK_SKEW = 300       # giây: bản ghi gửi bù có thời điểm đo muộn hơn giờ server quá mức này bị từ chối
+HISTORY_PAGE_SIZE = 100    # Số bản ghi mặc định mỗi trang /api/data/history
+HISTORY_PAGE_MAX = 1000
+HISTORY_POINTS_MAX = 5000  # Giới hạn ?points= khi lấy mẫu giảm
+BACKTEST_MAX_CANDIDATES = 10000  # Số bộ ngưỡng tối đa mỗi lần /api/settings/backtest
+BACKTEST_REPLAY_MAX = 300000     # Số bản ghi × (bộ ngưỡng + 1) tối đa để chạy lại qua AlertTracker
+
 # File lưu trữ
-DATA_FILE = 'data.json'
+DATA_FILE = 'data.json'          # Định dạng cũ, chỉ đọc để chuyển sang log
 SETTINGS_FILE = 'settings.json'
+LOG_DIR = 'data_log'
+LOG_SEGMENT_BYTES = 1024 * 1024  # Mỗi segment tối đa 1MB
+LOG_COMPACT_SEGMENTS = 8         # Gộp khi có từ 8 segment đã đóng
+LOG_FSYNC = False                # True: fsync sau mỗi lần ghi (chậm hơn, bền hơn)
+LOG_RETENTION_DAYS = Config.RETENTION_DAYS  # Giữ dữ liệu bao nhiêu ngày (0 = giữ mãi), như kho SQL
+
+# Log chia theo ngày: data_log/YYYY-MM-DD/seg-*.ndjson
+history_log = PartitionedLog(
+    LOG_DIR,
+    segment_max_bytes=LOG_SEGMENT_BYTES,
+    compact_min_segments=LOG_COMPACT_SEGMENTS,
+    fsync=LOG_FSYNC
+)
 
 # ============================================
 # HÀM TIỆN ÍCH
 # ============================================
 def load_data():
-    """Tải dữ liệu từ file"""
-    global data_history, system_settings
-    
+    """Tải dữ liệu từ log (chuyển data.json cũ sang log nếu cần), chạy trên writer"""
+    return ingest_core.call(load_state)
+
+def load_state():
     try:
-        if os.path.exists(DATA_FILE):
+        write_batch_records()
+        batch_touched.clear()
+        history_log.open()
+        devices.clear()
+        ingest_core.reset()
+        push_hub.forget()
+        response_cache.clear()
+        expire_old_data()  # Không đọc các ngày đã hết hạn
+        count = 0
+        for entry in history_log.read_all():
+            shard = devices.get(entry.get('device_id', DEFAULT_DEVICE_ID))
+            if 'event' in entry:
+                shard.alerts.restore(event_from_record(entry))
+                continue
+            shard.history.append(entry)
+            count += 1
+        
+        if not count and os.path.exists(DATA_FILE):
             with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data_history = json.load(f)
-                print(f"📂 Đã tải {len(data_history)} bản ghi từ file")
-    except Exception as e:
-        print(f"❌ Lỗi khi tải data.json: {e}")
-        data_history = []
+                legacy_history = json.load(f)
+            shard = devices.get(DEFAULT_DEVICE_ID)
+            for entry in legacy_history:
+                shard.history.append(entry)
+            history_log.append_many(shard.log_entries())
+            log.info("Đã chuyển %d bản ghi từ data.json sang log", len(legacy_history),
+                     extra={'records': len(legacy_history)})
+            # Bản ghi vừa chuyển cũng áp dụng thời hạn lưu ngay, không chờ lần chạy định kỳ
+            expire_old_data()
+            count = len(shard.history)
+        
+        log.info("Đã tải %d bản ghi của %d thiết bị từ log", count, len(devices),
+                 extra={'records': count, 'devices': len(devices)})
+    except Exception:
+        log.exception("Lỗi khi tải dữ liệu")
+        devices.clear()
     
     try:
         if os.path.exists(SETTINGS_FILE):
             with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
                 system_settings.update(json.load(f))
     except Exception as e:
-        print(f"❌ Lỗi khi tải settings.json: {e}")
-        pass
+        log.error("Lỗi khi tải settings.json: %s", e)
+    
+    if shared_state is not None and len(devices) > shared_state.max_devices:
+        # Log có nhiều thiết bị hơn số chỗ: không khởi động với một phần đội
+        raise SharedStateFull(f'{len(devices)} devices in the log but shared state has '
+                              f'{shared_state.max_devices} slots; raise SHARED_STATE_DEVICES')
+    for shard in devices.shards():
+        touch(shard)
+    publish_settings()
 
 def save_data():
-    """Lưu dữ liệu vào file"""
+    """Lưu cài đặt và đẩy log xuống đĩa (lịch sử đã được ghi nối từng bản ghi)"""
     try:
-        # Chỉ lưu 1000 bản ghi gần nhất
-        recent_history = data_history[-1000:] if len(data_history) > 1000 else data_history
+        with metrics.timer('save_data_seconds'):
+            save_settings_and_flush()
+    except Exception:
+        log.exception("Lỗi khi lưu dữ liệu")
+
+def save_settings_and_flush():
+    with metrics.timer('log_flush_seconds'):
+        history_log.flush()
         
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(recent_history, f, ensure_ascii=False, indent=2)
-            print(f"💾 Đã lưu {len(recent_history)} bản ghi vào data.json")
-            
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(system_settings, f, ensure_ascii=False, indent=2)
-            print("⚙️ Đã lưu cài đặt vào settings.json")
-            
-    except Exception as e:
-        print(f"❌ Lỗi khi lưu dữ liệu: {e}")
-
-def check_alerts(data):
-    """Kiểm tra cảnh báo từ dữ liệu sensor"""
-    alerts = []
-    
-    # Chướng ngại vật phía trước
-    if 0 < data['front_distance'] < system_settings['danger_distance']:
-        alerts.append({
-            'type': 'danger',
-            'message': f'⚠️ CHƯỚNG NGẠI VẬT PHÍA TRƯỚC: {data["front_distance"]}cm',
-            'location': 'front',
-            'timestamp': datetime.now().isoformat()
-        })
-    elif system_settings['danger_distance'] <= data['front_distance'] < system_settings['warn_distance']:
-        alerts.append({
-            'type': 'warning',
-            'message': f'⚠️ Cảnh báo phía trước: {data["front_distance"]}cm',
-            'location': 'front',
-            'timestamp': datetime.now().isoformat()
-        })
+            log.debug("Đã lưu cài đặt vào settings.json")
+
+def check_alerts(data, timestamp=None, lang=DEFAULT_LANG):
+    """Kiểm tra cảnh báo từ dữ liệu sensor (trả về danh sách đã render)"""
+    ts = to_epoch(timestamp) if timestamp else datetime.now().timestamp()
+    return render_alerts(alert_mask(data, system_settings), data, ts, lang)
+
+def request_lang():
+    """Ngôn ngữ hiển thị cảnh báo (?lang=vi|en)"""
+    return request.args.get('lang', DEFAULT_LANG)
+
+def mark_changed(shard):
+    """Tăng phiên bản trạng thái của thiết bị, công bố snapshot mới rồi mới đánh thức long-poll"""
+    def update(version):
+        with shard.lock:
+            shard.version = version
+            ingest_core.publish(shard.device_id, shard.snapshot())
+            if shared_state is not None:
+                shared_state.write_device(shard, version)
+    state_clock.tick(update)
+
+def reserve_device(device_id):
+    """Writer: giữ chỗ trong vùng nhớ chung trước khi nhận thiết bị mới
     
-    # Bên trái
-    if 0 < data['left_distance'] < system_settings['warn_distance']:
-        alerts.append({
-            'type': 'warning',
-            'message': f'⚠️ Có vật thể bên trái: {data["left_distance"]}cm',
-            'location': 'left',
-            'timestamp': datetime.now().isoformat()
-        })
+    Hết chỗ thì thiết bị mới bị từ chối (SharedStateFull) thay vì reader chỉ thấy một phần đội.
+    """
+    global shared_state_full
+    if shared_state is None:
+        return
+    try:
+        shared_state.reserve(device_id)
+    except SharedStateFull:
+        metrics.inc('shared_state_rejected')
+        if not shared_state_full:
+            shared_state_full = True
+            log.error("Vùng nhớ chung đã đầy (%d thiết bị): từ chối thiết bị mới, "
+                      "hãy tăng SHARED_STATE_DEVICES/FLEET_SIZE và khởi động lại",
+                      shared_state.max_devices, extra={'device_id': device_id})
+        raise
+
+def set_settings_version(version):
+    global settings_version
+    settings_version = version
+
+def publish_settings():
+    """Writer: công bố cài đặt hiện tại cho các tiến trình reader"""
+    if shared_state is not None and not is_reader:
+        shared_state.write_settings(system_settings, settings_version)
+
+def current_snapshot(device_id):
+    """Snapshot trạng thái hiện tại: từ writer trong tiến trình, hoặc từ vùng nhớ chung (reader)"""
+    if is_reader:
+        return shared_state.snapshot(device_id)
+    return ingest_core.snapshot(device_id)
+
+def current_snapshots():
+    return shared_state.snapshots() if is_reader else ingest_core.snapshots()
+
+def read_shard(device_id):
+    """Shard để đọc lịch sử/cảnh báo (reader: bản dựng lại từ vùng nhớ chung, chỉ các bản ghi gần nhất)"""
+    if is_reader:
+        return shared_state.view(device_id)
+    return devices.get(device_id, create=False)
+
+def device_version(device_id):
+    if is_reader:
+        return shared_state.version_of(device_id)
+    snapshot = ingest_core.snapshot(device_id)
+    return snapshot.version if snapshot is not None else 0
+
+def sync_from_writer():
+    """Reader: writer vừa công bố thay đổi, cập nhật cài đặt, dashboard và đánh thức long-poll"""
+    settings, version = shared_state.settings()
+    if version != settings_version:
+        system_settings.update(settings)
+        set_settings_version(version)
+    for snapshot in shared_state.snapshots():
+        push_hub.publish(snapshot.device_id, device_state(snapshot))
+    state_clock.advance_to(max(shared_state.state_version(), settings_version))
+
+def long_poll(version_of):
+    """?since=<version>&wait=<s>: chờ đến khi version_of() > since hoặc hết thời gian"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return
+    wait = min(request.args.get('wait', LONG_POLL_DEFAULT, type=float), LONG_POLL_MAX)
+    if wait > 0:
+        state_clock.wait(lambda: version_of() > since, wait)
+
+def current_version(device_id):
+    """Phiên bản mà /api/data/current của thiết bị long-poll theo (dữ liệu hoặc cài đặt)"""
+    return max(device_version(device_id), settings_version)
+
+def conditional_json(version, build, *variant):
+    """Trả 304 nếu client đã có phiên bản này (If-None-Match), nếu không gửi JSON đã mã hóa sẵn
     
-    # Bên phải
-    if 0 < data['right_distance'] < system_settings['warn_distance']:
-        alerts.append({
-            'type': 'warning',
-            'message': f'⚠️ Có vật thể bên phải: {data["right_distance"]}cm',
-            'location': 'right',
-            'timestamp': datetime.now().isoformat()
-        })
+    JSON chỉ được dựng và mã hóa một lần cho mỗi phiên bản (response_cache), nên thân
+    không chứa giờ server; giờ hiện tại đi theo từng phản hồi trong header Date.
+    """
+    tag = '-'.join(str(part) for part in (version,) + variant)
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+    else:
+        def build_versioned():
+            payload = build()
+            payload['version'] = version
+            return payload
+        
+        payload = response_cache.get((request.path, tag), build_versioned)
+        body, encoding = response_cache.body(payload, 'gzip' in request.accept_encodings)
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    response.set_etag(tag, weak=True)
+    response.date = time.time()
+    response.headers['X-State-Version'] = str(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def check_device_id(device_id):
+    """Mã thiết bị phải là chuỗi khác rỗng (ValueError nếu không)"""
+    if not isinstance(device_id, str) or not device_id:
+        raise ValueError('device_id must be a non-empty string')
+    return device_id
+
+def parse_reading(data):
+    """Chuẩn hóa một bản ghi JSON từ ESP32"""
+    if data.get('device_id') is not None:
+        check_device_id(data['device_id'])
+    return {
+        'front_distance': float(data.get('front_distance', 0)),
+        'left_distance': float(data.get('left_distance', 0)),
+        'right_distance': float(data.get('right_distance', 0)),
+        'ir_distance': float(data.get('ir_distance', 0)),
+        'mode': int(data.get('mode', 1)),
+        'power_status': bool(data.get('power_status', False)),
+        'battery_level': int(data.get('battery_level', 100)),
+        'wifi_connected': bool(data.get('wifi_connected', False))
+    }
+
+def parse_reading_time(data, now):
+    """Thời điểm đo (epoch) của bản ghi: ISO string hoặc số giây epoch, mặc định là `now`"""
+    timestamp = data.get('timestamp')
+    if timestamp is None:
+        return now
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        ts = float(timestamp)
+    elif isinstance(timestamp, str):
+        ts = to_epoch(timestamp)
+    else:
+        raise ValueError('timestamp must be an ISO string or epoch seconds')
+    return check_reading_time(ts, now)
+
+def check_reading_time(ts, now):
+    """Từ chối (ValueError) thời điểm đo ở tương lai quá MAX_CLOCK_SKEW hoặc cũ hơn thời hạn lưu
     
-    # Cảm biến IR
-    if data['ir_distance'] < system_settings['ir_ground']:
-        alerts.append({
-            'type': 'info',
-            'message': '⚠️ Mặt đất không bằng phẳng',
-            'location': 'bottom',
-            'timestamp': datetime.now().isoformat()
+    Một bản ghi với đồng hồ gậy sai sẽ thành bản ghi mới nhất của thiết bị (mọi bản ghi thật
+    sau đó bị coi là gửi bù) hoặc tạo một ngày log không bao giờ hết hạn.
+    """
+    if not math.isfinite(ts) or ts > now + MAX_CLOCK_SKEW:
+        raise ValueError(f'timestamp is more than {MAX_CLOCK_SKEW}s ahead of server time')
+    cutoff = retention_cutoff(datetime.fromtimestamp(now))
+    if cutoff is not None and ts < cutoff.timestamp():
+        raise ValueError(f'timestamp is older than the {LOG_RETENTION_DAYS}-day retention window')
+    return ts
+
+def request_device_id(data=None):
+    """Mã thiết bị: ?device=, header X-Device-Id, trường device_id hoặc mặc định"""
+    return check_device_id(request.args.get('device')
+                           or request.headers.get('X-Device-Id')
+                           or (data.get('device_id') if isinstance(data, dict) else None)
+                           or DEFAULT_DEVICE_ID)
+
+def device_state(snapshot, lang=DEFAULT_LANG):
+    """Trạng thái hiện tại của một thiết bị dạng JSON, dựng từ snapshot"""
+    data = dict(snapshot.current)
+    del data['alert_mask']
+    data['alerts'] = [render_alert(a, lang) for a in snapshot.active]
+    data['history_count'] = snapshot.history_count
+    return data
+
+def publish_device(shard, events=()):
+    """Đẩy trạng thái mới (chỉ phần thay đổi) và sự kiện cảnh báo tới dashboard"""
+    push_hub.publish(shard.device_id, device_state(current_snapshot(shard.device_id)))
+    if events:
+        push_hub.broadcast('alert_events', {
+            'device_id': shard.device_id,
+            'events': [render_event(e) for e in events]
         })
-    elif data['ir_distance'] > system_settings['ir_hole']:
-        alerts.append({
-            'type': 'danger',
-            'message': f'⚠️ CÓ HỐ/BẬC THỀM: {data["ir_distance"]}cm',
-            'location': 'bottom',
-            'timestamp': datetime.now().isoformat()
+
+def touch(shard, events=()):
+    """Ghi nhận shard đã đổi trong lô hiện tại (writer); finish_batch() công bố một lần"""
+    batch_touched.setdefault(shard.device_id, (shard, []))[1].extend(events)
+
+def write_batch_records():
+    """Ghi các bản ghi log đang chờ của lô hiện tại (writer)"""
+    if batch_records:
+        records = list(batch_records)
+        batch_records.clear()
+        history_log.append_many(records)
+
+def finish_batch():
+    """Sau mỗi lô của writer: một lần ghi log, tăng phiên bản, công bố snapshot và đẩy tới dashboard"""
+    try:
+        write_batch_records()
+    finally:
+        touched = list(batch_touched.values())
+        batch_touched.clear()
+        for shard, events in touched:
+            mark_changed(shard)
+            publish_device(shard, events)
+
+ingest_core.after_batch = finish_batch
+ingest_core.start()
+atexit.register(ingest_core.close)
+if is_reader:
+    sync_from_writer()
+    shared_state.watch(sync_from_writer)
+
+def ingest_readings(device_id, readings):
+    """Ghi một lô bản ghi (epoch, reading) của một thiết bị qua writer và chờ kết quả
+    
+    Trả về (history entry theo đúng thứ tự đầu vào, các sự kiện cảnh báo mới).
+    BacklogFull nếu hàng đợi đầy, TimeoutError nếu writer không kịp xử lý.
+    """
+    return ingest_core.call(apply_readings, device_id, readings, timeout=INGEST_WAIT_TIMEOUT)
+
+def apply_readings(device_id, readings):
+    """Phần chạy trên writer của ingest_readings(): cập nhật lịch sử, cảnh báo và trạng thái"""
+    reserve_device(device_id)
+    shard = devices.get(device_id)
+    entries = []
+    for ts, reading in readings:
+        timestamp = to_iso(ts)
+        entries.append({
+            'device_id': device_id,
+            'timestamp': timestamp,
+            'front_distance': reading['front_distance'],
+            'left_distance': reading['left_distance'],
+            'right_distance': reading['right_distance'],
+            'ir_distance': reading['ir_distance'],
+            'mode': reading['mode'],
+            'alert_mask': alert_mask(reading, system_settings)
         })
     
-    return alerts
+    order = sorted(range(len(readings)), key=lambda i: readings[i][0])
+    events = []
+    with shard.lock:
+        # Bản ghi cũ hơn bản ghi mới nhất (gửi bù) được xét cảnh báo theo trạng thái tại thời điểm đo
+        last_ts = shard.alerts.last_ts
+        late = sum(1 for ts, _ in readings if last_ts is not None and ts < last_ts)
+        # Thêm cả lô vào lịch sử một lần (bản ghi gửi bù được trộn vào đúng chỗ trong một lượt)
+        shard.history.extend_values([(
+            readings[i][0],
+            entries[i]['front_distance'],
+            entries[i]['left_distance'],
+            entries[i]['right_distance'],
+            entries[i]['ir_distance'],
+            entries[i]['mode'],
+            entries[i]['alert_mask']
+        ) for i in order])
+        # Xét cảnh báo theo thứ tự thời gian, chỉ ghi nhận khi đổi trạng thái
+        for i in order:
+            events.extend(shard.alerts.update(readings[i][1], readings[i][0], system_settings))
+        
+        # Cập nhật dữ liệu hiện tại bằng bản ghi mới nhất
+        if order:
+            newest = order[-1]
+            ts, reading = readings[newest]
+            current = shard.current
+            if current['last_update'] is None or ts >= to_epoch(current['last_update']):
+                current.update(reading)
+                current['last_update'] = entries[newest]['timestamp']
+                current['alert_mask'] = entries[newest]['alert_mask']
+    
+    # Log được ghi một lần cho cả lô writer (finish_batch)
+    batch_records.extend(entries[i] for i in order)
+    for event in events:
+        record = event_record(event)
+        record['device_id'] = device_id
+        batch_records.append(record)
+    touch(shard, events)
+    if sql_sink is not None:
+        sql_sink(device_id, [readings[i] for i in order], events)
+    
+    metrics.rate('ingest_readings', (device_id,)).add(len(readings))
+    if late:
+        metrics.inc('late_readings', (device_id,), late)
+    for event in events:
+        if event.kind in (RAISE, LATE):
+            alert_type, location, _ = ALERT_KINDS[event.code]
+            metrics.inc('alerts_raised', (alert_type, location))
+    
+    return entries, events
+
+def retention_cutoff(now=None):
+    """Đầu ngày cũ nhất còn được giữ (None = giữ mãi)"""
+    if not LOG_RETENTION_DAYS:
+        return None
+    now = now or datetime.now()
+    return datetime.combine(now.date() - timedelta(days=LOG_RETENTION_DAYS), datetime.min.time())
+
+def expire_old_data(now=None):
+    """Xóa các ngày cũ hơn LOG_RETENTION_DAYS: xóa cả thư mục ngày, không ghi lại log (writer)"""
+    cutoff = retention_cutoff(now)
+    if cutoff is None:
+        return []
+    expired = history_log.expire(cutoff.date().isoformat())
+    
+    cutoff_ts = cutoff.timestamp()
+    for shard in devices.shards():
+        with shard.lock:
+            shard.history.drop_before(cutoff_ts)
+            shard.alerts.drop_before(cutoff_ts)
+        touch(shard)
+    return expired
 
 def auto_save():
-    """Tự động lưu dữ liệu mỗi 5 phút"""
+    """Tự động đẩy log xuống đĩa, gộp segment và xóa ngày hết hạn mỗi 5 phút"""
     while True:
         time.sleep(300)  # 5 phút
-        if data_history:
-            save_data()
+        try:
+            with metrics.timer('log_flush_seconds'):
+                history_log.flush()
+            with metrics.timer('log_compact_seconds'):
+                compacted = history_log.compact()
+            if compacted:
+                log.info("Đã gộp log", extra={'segments': history_log.segment_count()})
+            expired = ingest_core.call(expire_old_data)
+            if expired:
+                log.info("Đã xóa dữ liệu hết hạn", extra={'days': expired})
+        except Exception:
+            log.exception("Lỗi khi gộp log")
+
+# ============================================
+# SỐ LIỆU ĐO
+# ============================================
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def forward_writes():
+    """Reader không ghi: chuyển POST tới tiến trình writer (307 giữ nguyên phương thức và body)"""
+    if is_reader and request.method == 'POST':
+        if WRITER_URL:
+            return redirect(WRITER_URL.rstrip('/') + request.full_path.rstrip('?'), code=307)
+        return jsonify({'success': False, 'error': 'Read-only worker, send writes to the writer'}), 503
+
+@app.after_request
+def record_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Nhãn theo mẫu route (không theo URL thật) để số chuỗi số liệu có giới hạn
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_seconds', time.perf_counter() - started,
+                        (request.method, route, str(response.status_code)))
+    return response
+
+def history_sizes():
+    return {snapshot.device_id: snapshot.history_count for snapshot in current_snapshots()}
+
+metrics.gauge('history_size', history_sizes)
+metrics.gauge('history_total', lambda: sum(history_sizes().values()))
+metrics.gauge('log_segments', lambda: history_log.segment_count())
+metrics.gauge('stream_clients', lambda: len(push_hub))
+metrics.gauge('stream_queued_frames', lambda: push_hub.queued_frames())
+metrics.gauge('log_queue_depth', queue_depth)
+metrics.gauge('ingest_queue_depth', ingest_core.backlog)
+metrics.gauge('ingest_batches', lambda: ingest_core.batches)
+metrics.gauge('response_cache_entries', lambda: len(response_cache))
+metrics.gauge('response_cache_hits', lambda: response_cache.hits)
+metrics.gauge('response_cache_misses', lambda: response_cache.misses)
 
 # ============================================
 # ROUTES - API
@@ -160,147 +606,471 @@ def test_api():
         'version': '1.0'
     })
 
-@app.route('/api/data/current', methods=['GET'])
-def get_current_data():
-    """Lấy dữ liệu hiện tại"""
+@app.route('/api/devices', methods=['GET'])
+def list_devices():
+    """Danh sách thiết bị đã gửi dữ liệu"""
+    result = [{
+        'device_id': snapshot.device_id,
+        'last_update': snapshot.current['last_update'],
+        'history_count': snapshot.history_count
+    } for snapshot in current_snapshots()]
+    
     return jsonify({
         'success': True,
-        'data': current_data,
-        'settings': system_settings,
-        'history_count': len(data_history),
-        'server_time': datetime.now().isoformat()
+        'count': len(result),
+        'devices': result
     })
 
+@app.route('/api/data/current', methods=['GET'])
+def get_current_data():
+    """Lấy dữ liệu hiện tại của một thiết bị (?device=...)
+    
+    Hỗ trợ ETag/If-None-Match (304) và long-poll ?since=<version>&wait=<giây>.
+    """
+    device_id = request_device_id()
+    long_poll(lambda: current_version(device_id))
+    lang = request_lang()
+    # Snapshot bất biến do writer công bố: không cần khóa, phiên bản khớp với dữ liệu
+    snapshot = current_snapshot(device_id)
+    version = max(snapshot.version if snapshot else 0, settings_version)
+    
+    def build():
+        if snapshot is None:
+            data, history_count, active = new_current_data(), 0, []
+        else:
+            data, history_count = dict(snapshot.current), snapshot.history_count
+            active = snapshot.active
+        
+        # Render cảnh báo đang bật khi được hỏi, không lưu sẵn chuỗi thông báo
+        del data['alert_mask']
+        data['alerts'] = [render_alert(a, lang) for a in active]
+        
+        return {
+            'success': True,
+            'device_id': device_id,
+            'data': data,
+            'settings': system_settings,
+            'history_count': history_count
+        }
+    
+    return conditional_json(version, build, device_id, lang)
+
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """Luồng Server-Sent Events: snapshot khi kết nối, sau đó chỉ gửi phần thay đổi
+    
+    ?device=<mã> chỉ nhận trạng thái của thiết bị đó; bỏ trống để nhận cả đội.
+    """
+    client = push_hub.subscribe(request.args.get('device') or None)
+    if client is None:
+        return jsonify({'success': False, 'error': 'Too many stream clients'}), 503
+    
+    response = Response(push_hub.stream(client, STREAM_HEARTBEAT), mimetype=STREAM_CONTENT_TYPE)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Không để proxy gom bộ đệm
+    return response
+
 @app.route('/api/data/receive', methods=['POST'])
 def receive_data():
     """Nhận dữ liệu từ ESP32"""
     try:
-        print(f"\n{'='*60}")
-        print(f"📥 [{datetime.now().strftime('%H:%M:%S')}] NHẬN DỮ LIỆU TỪ ESP32")
-        print(f"{'='*60}")
+        try:
+            device_id, readings = parse_receive(
+                request.mimetype, request.get_data(),
+                request.args.get('device') or request.headers.get('X-Device-Id'),
+                datetime.now().timestamp()
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        if not request.is_json:
-            print("❌ Không phải JSON format")
-            print(f"Raw data: {request.data}")
-            return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
+        # Cập nhật dữ liệu hiện tại và thêm vào lịch sử (qua writer)
+        try:
+            entries, events = ingest_readings(device_id, readings)
+        except (BacklogFull, TimeoutError) as e:
+            log.warning("Hàng đợi ghi quá tải", extra={'device_id': device_id, 'error': str(e)})
+            return jsonify({'success': False, 'error': 'Server busy, retry later'}), 503
+        except SharedStateFull as e:
+            return jsonify({'success': False, 'error': str(e)}), 507
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        data = request.get_json()
-        print(f"📊 Dữ liệu nhận được:")
-        print(json.dumps(data, indent=2))
+        return jsonify(receive_result(device_id, readings, entries, events))
         
-        # Cập nhật dữ liệu hiện tại
-        current_data.update({
-            'front_distance': float(data.get('front_distance', 0)),
-            'left_distance': float(data.get('left_distance', 0)),
-            'right_distance': float(data.get('right_distance', 0)),
-            'ir_distance': float(data.get('ir_distance', 0)),
-            'mode': int(data.get('mode', 1)),
-            'power_status': bool(data.get('power_status', False)),
-            'battery_level': int(data.get('battery_level', 100)),
-            'wifi_connected': bool(data.get('wifi_connected', False)),
-            'last_update': datetime.now().isoformat()
+    except Exception as e:
+        log.exception("Lỗi khi nhận dữ liệu")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def parse_receive(mimetype, body, device_hint, now):
+    """Đọc body của /api/data/receive: trả về (device_id, [(epoch, reading)]) hoặc ValueError
+    
+    `device_hint` là ?device= hoặc header X-Device-Id (ưu tiên hơn trường device_id).
+    """
+    if mimetype == BINARY_CONTENT_TYPE:
+        # Bản ghi nhị phân cố định (xem codec.py)
+        readings = decode_readings(body, now)
+        if len(readings) != 1:
+            raise ValueError('Expected one record')
+        return device_hint or DEFAULT_DEVICE_ID, readings
+    
+    if not (mimetype == 'application/json'
+            or (mimetype.startswith('application/') and mimetype.endswith('+json'))):
+        log.warning("Dữ liệu không phải JSON", extra={'content_type': mimetype})
+        raise ValueError('Invalid JSON')
+    try:
+        data = json.loads(body)
+        readings = [(now, parse_reading(data))]
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Invalid JSON')
+    return device_hint or data.get('device_id') or DEFAULT_DEVICE_ID, readings
+
+def receive_result(device_id, readings, entries, events):
+    """Nội dung trả lời của /api/data/receive sau khi writer đã ghi bản ghi"""
+    entry = entries[0]
+    
+    # Dòng debug cho từng bản ghi chỉ được lấy mẫu (LOG_SAMPLE_RATE)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Đã nhận bản ghi", extra={
+            'sample': True,
+            'device_id': device_id,
+            'reading': readings[0][1],
+            'alerts': mask_count(entry['alert_mask']),
+            'alert_events': len(events)
         })
+    
+    return {
+        'success': True,
+        'message': 'Dữ liệu đã nhận',
+        'device_id': device_id,
+        'alerts': mask_count(entry['alert_mask']),
+        'alert_events': len(events),
+        'timestamp': entry['timestamp']
+    }
+
+async def receive_data_async(request):
+    """/api/data/receive cho chế độ asyncio (aioserver.py)
+    
+    Cùng parse_receive/apply_readings/receive_result với route Flask, nhưng chờ writer
+    bằng callback thay vì giữ một thread, nên hàng nghìn gậy có thể gửi cùng lúc.
+    """
+    started = time.perf_counter()
+    try:
+        device_id, readings = parse_receive(
+            request.mimetype, request.body,
+            request.query.get('device') or request.headers.get('x-device-id'),
+            datetime.now().timestamp()
+        )
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
         
-        # Kiểm tra cảnh báo
-        current_data['alerts'] = check_alerts(current_data)
+        def finished(job):
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(job))
         
-        # Thêm vào lịch sử
-        history_entry = {
-            'timestamp': current_data['last_update'],
-            'front_distance': current_data['front_distance'],
-            'left_distance': current_data['left_distance'],
-            'right_distance': current_data['right_distance'],
-            'ir_distance': current_data['ir_distance'],
-            'mode': current_data['mode'],
-            'alerts': current_data['alerts']
-        }
+        ingest_core.submit(apply_readings, device_id, readings, on_done=finished, block=False)
+        job = await asyncio.wait_for(done, INGEST_WAIT_TIMEOUT)
+        entries, events = job.wait(0)
+        status, payload = 200, receive_result(device_id, readings, entries, events)
+    except ValueError as e:
+        status, payload = 400, {'success': False, 'error': str(e)}
+    except (BacklogFull, asyncio.TimeoutError) as e:
+        log.warning("Hàng đợi ghi quá tải", extra={'error': str(e)})
+        status, payload = 503, {'success': False, 'error': 'Server busy, retry later'}
+    except SharedStateFull as e:
+        status, payload = 507, {'success': False, 'error': str(e)}
+    except Exception as e:
+        log.exception("Lỗi khi nhận dữ liệu")
+        status, payload = 500, {'success': False, 'error': str(e)}
+    
+    metrics.observe('http_request_seconds', time.perf_counter() - started,
+                    (request.method, '/api/data/receive', str(status)))
+    return status, [('Content-Type', 'application/json')], (app.json.dumps(payload) + '\n').encode('utf-8')
+
+async def stream_async(request):
+    """/api/stream cho chế độ asyncio: mỗi client là một coroutine, không giữ thread"""
+    client = push_hub.subscribe(request.query.get('device') or None)
+    if client is None:
+        body = app.json.dumps({'success': False, 'error': 'Too many stream clients'}) + '\n'
+        return 503, [('Content-Type', 'application/json')], body.encode('utf-8')
+    headers = [('Content-Type', STREAM_CONTENT_TYPE), ('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')]
+    return 200, headers, push_hub.astream(client, STREAM_HEARTBEAT)
+
+# Route GET có long-poll -> phiên bản mà long_poll() của route chờ, tính từ request aioserver
+LONG_POLL_VERSIONS = {
+    '/api/data/current': lambda request: current_version(
+        request.query.get('device') or request.headers.get('x-device-id') or DEFAULT_DEVICE_ID),
+    '/api/settings': lambda request: settings_version,
+    '/api/system/info': lambda request: state_clock.value,
+}
+
+def long_poll_handler(version_of, forward):
+    """Handler aioserver cho một route GET có long-poll (xem LONG_POLL_VERSIONS)
+    
+    Chờ ?since=<version>&wait=<s> trên event loop (state_clock.wait_async) thay vì giữ một
+    thread WSGI, rồi chuyển request cho Flask qua `forward` với wait=0 để route không chờ lại.
+    """
+    async def handler(request):
+        query = parse_qsl(request.query_string, keep_blank_values=True)
+        args = dict(query)
+        try:
+            since = int(args['since'])
+        except (KeyError, ValueError):
+            return await forward(request)
+        try:
+            wait = min(float(args.get('wait', LONG_POLL_DEFAULT)), LONG_POLL_MAX)
+        except ValueError:
+            wait = LONG_POLL_DEFAULT
+        if wait > 0:
+            await state_clock.wait_async(lambda: version_of(request) > since, wait)
+        request.query_string = urlencode([(k, v) for k, v in query if k != 'wait'] + [('wait', '0')])
+        return await forward(request)
+    return handler
+
+@app.route('/api/data/receive/batch', methods=['POST'])
+def receive_batch():
+    """Nhận nhiều bản ghi cùng lúc (ESP32 gửi bù dữ liệu lưu khi mất WiFi)
+    
+    Body: mảng JSON, {"readings": [...]}, NDJSON (application/x-ndjson)
+    hoặc nhiều bản ghi nhị phân nối liền (xem codec.py).
+    Mỗi bản ghi JSON có thể kèm 'timestamp' (ISO hoặc epoch giây) và 'device_id'.
+    """
+    try:
+        now = datetime.now().timestamp()
+        try:
+            batch_device_id = request_device_id()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if request.mimetype == BINARY_CONTENT_TYPE:
+            try:
+                items = decode_readings(request.get_data(), now)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        elif request.mimetype == 'application/x-ndjson':
+            try:
+                items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Invalid NDJSON'}), 400
+        elif request.is_json:
+            items = request.get_json()
+            if isinstance(items, dict):
+                try:
+                    batch_device_id = request_device_id(items)
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                items = items.get('readings', [])
+        else:
+            return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
         
-        data_history.append(history_entry)
+        if not isinstance(items, list):
+            return jsonify({'success': False, 'error': 'Invalid batch'}), 400
+        if len(items) > MAX_BATCH_READINGS:
+            return jsonify({
+                'success': False,
+                'error': f'Tối đa {MAX_BATCH_READINGS} bản ghi mỗi lô'
+            }), 413
+        
+        # Kiểm tra từng bản ghi, bản ghi lỗi không làm hỏng cả lô
+        results = [None] * len(items)
+        by_device = {}  # device_id -> (readings, positions)
+        for i, item in enumerate(items):
+            try:
+                if isinstance(item, tuple):
+                    # Bản ghi nhị phân đã được giải mã sẵn
+                    device_id, reading = batch_device_id, (check_reading_time(item[0], now), item[1])
+                else:
+                    device_id = item.get('device_id') or batch_device_id
+                    reading = (parse_reading_time(item, now), parse_reading(item))
+            except (AttributeError, OverflowError, TypeError, ValueError) as e:
+                results[i] = {'index': i, 'success': False, 'error': str(e)}
+                continue
+            readings, positions = by_device.setdefault(device_id, ([], []))
+            readings.append(reading)
+            positions.append(i)
         
-        print(f"\n✅ Đã cập nhật:")
-        print(f"   📏 Trước: {current_data['front_distance']}cm")
-        print(f"   📏 Trái: {current_data['left_distance']}cm")
-        print(f"   📏 Phải: {current_data['right_distance']}cm")
-        print(f"   📏 IR: {current_data['ir_distance']}cm")
-        print(f"   ⚙️ Chế độ: {current_data['mode']}")
-        print(f"   🔌 Nguồn: {'BẬT' if current_data['power_status'] else 'TẮT'}")
-        print(f"   📶 WiFi: {'KẾT NỐI' if current_data['wifi_connected'] else 'MẤT KẾT NỐI'}")
-        print(f"   ⚠️ Cảnh báo: {len(current_data['alerts'])}")
-        print(f"{'='*60}")
+        def fail(device_id, positions, error):
+            for i in positions:
+                results[i] = {'index': i, 'success': False, 'device_id': device_id, 'error': error}
         
-        # Tự động lưu sau 10 bản ghi
-        if len(data_history) % 10 == 0:
-            save_data()
+        # Gửi mọi thiết bị cho writer trước rồi mới chờ, để chúng rơi vào cùng một lô ghi.
+        # Từ đây lỗi chỉ làm hỏng bản ghi của thiết bị đó: các thiết bị khác có thể đã được ghi,
+        # trả lỗi cho cả lô sẽ khiến client gửi lại và lưu chúng hai lần.
+        jobs = []
+        for device_id, (readings, positions) in by_device.items():
+            try:
+                jobs.append((device_id, positions, ingest_core.submit(apply_readings, device_id, readings)))
+            except BacklogFull as e:
+                log.warning("Hàng đợi ghi quá tải", extra={'device_id': device_id, 'error': str(e)})
+                fail(device_id, positions, 'Server busy, retry later')
+        if by_device and not jobs:
+            # Chưa có gì được ghi: client có thể gửi lại cả lô
+            return jsonify({'success': False, 'error': 'Server busy, retry later'}), 503
+        
+        done = []
+        for device_id, positions, job in jobs:
+            try:
+                done.append((device_id, positions, job.wait(INGEST_WAIT_TIMEOUT)))
+            except (SharedStateFull, ValueError) as e:
+                # Thiết bị bị từ chối (vùng nhớ chung đầy, mã quá dài)
+                fail(device_id, positions, str(e))
+            except TimeoutError as e:
+                log.warning("Hàng đợi ghi quá tải", extra={'device_id': device_id, 'error': str(e)})
+                fail(device_id, positions, 'Server busy, retry later')
+            except Exception as e:
+                log.exception("Lỗi khi ghi bản ghi của thiết bị", extra={'device_id': device_id})
+                fail(device_id, positions, str(e))
+        
+        accepted = 0
+        alert_events = 0
+        for device_id, positions, (entries, events) in done:
+            accepted += len(entries)
+            alert_events += len(events)
+            for i, entry in zip(positions, entries):
+                results[i] = {
+                    'index': i,
+                    'success': True,
+                    'device_id': device_id,
+                    'alerts': mask_count(entry['alert_mask']),
+                    'timestamp': entry['timestamp']
+                }
+        
+        log.info("Đã nhận lô bản ghi", extra={
+            'accepted': accepted,
+            'total': len(items),
+            'devices': len(by_device)
+        })
         
         return jsonify({
             'success': True,
             'message': 'Dữ liệu đã nhận',
-            'alerts': len(current_data['alerts']),
-            'timestamp': current_data['last_update']
+            'accepted': accepted,
+            'rejected': len(items) - accepted,
+            'alert_events': alert_events,
+            'results': results
         })
         
     except Exception as e:
-        print(f"❌ LỖI: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Lỗi khi nhận dữ liệu")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/data/history', methods=['GET'])
 def get_history():
-    """Lấy lịch sử dữ liệu"""
+    """Lấy lịch sử dữ liệu, phân trang bằng ?cursor= (trang sau là dữ liệu cũ hơn)
+    
+    Với ?points=N (và ?method=lttb|minmax) trả về toàn bộ cửa sổ đã lấy mẫu giảm
+    còn khoảng N điểm cho mỗi kênh khoảng cách, để vẽ biểu đồ.
+    """
     hours = request.args.get('hours', 24, type=int)
+    limit = min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), HISTORY_PAGE_MAX)
     
-    if hours <= 0:
+    if hours <= 0 or limit <= 0:
         return jsonify({'success': False, 'message': 'Thời gian không hợp lệ'})
     
-    time_limit = datetime.now() - timedelta(hours=hours)
+    device_id = request_device_id()
+    if 'points' in request.args:
+        return get_history_downsampled(device_id, hours)
+    cursor = None
+    window_start = (datetime.now() - timedelta(hours=hours)).timestamp()
+    if request.args.get('cursor'):
+        try:
+            key = decode_cursor(request.args['cursor'])
+            window_start, cursor = key['from'], (key['ts'], key['skip'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Cursor không hợp lệ'}), 400
     
-    filtered_history = [
-        entry for entry in data_history 
-        if datetime.fromisoformat(entry['timestamp']) > time_limit
-    ]
+    # Tìm nhị phân theo cột thời gian, mỗi trang tối đa `limit` bản ghi
+    filtered_history, next_key = [], None
+    shard = read_shard(device_id)
+    if shard is not None:
+        with shard.lock:
+            filtered_history, next_key = shard.history.page_before(
+                window_start, limit, cursor, lang=request_lang()
+            )
     
-    filtered_history = filtered_history[-100:]  # Giới hạn 100 bản ghi
+    next_cursor = None
+    if next_key is not None:
+        next_cursor = encode_cursor({'from': window_start, 'ts': next_key[0], 'skip': next_key[1]})
     
     return jsonify({
         'success': True,
+        'device_id': device_id,
         'count': len(filtered_history),
-        'data': filtered_history
+        'data': filtered_history,
+        'next': next_cursor
     })
 
-@app.route('/api/alerts', methods=['GET'])
-def get_alerts():
-    """Lấy cảnh báo gần đây"""
-    hours = request.args.get('hours', 6, type=int)
-    time_limit = datetime.now() - timedelta(hours=hours)
-    
-    all_alerts = []
-    for entry in data_history:
-        if datetime.fromisoformat(entry['timestamp']) > time_limit:
-            all_alerts.extend(entry.get('alerts', []))
+def get_history_downsampled(device_id, hours):
+    """Lấy mẫu giảm cả cửa sổ `hours` giờ trên các cột mảng của lịch sử"""
+    points = request.args.get('points', type=int)
+    method = request.args.get('method', 'lttb')
+    if not points or points < 3 or method not in DOWNSAMPLERS:
+        return jsonify({
+            'success': False,
+            'message': f'points phải >= 3, method là một trong: {", ".join(DOWNSAMPLERS)}'
+        }), 400
+    points = min(points, HISTORY_POINTS_MAX)
     
-    all_alerts.sort(key=lambda x: x['timestamp'], reverse=True)
-    all_alerts = all_alerts[:50]
+    ts, columns = (), {}
+    window_start = (datetime.now() - timedelta(hours=hours)).timestamp()
+    shard = read_shard(device_id)
+    if shard is not None:
+        # Chỉ sao chép các cột dưới khóa; lấy mẫu giảm sau khi đã nhả khóa
+        with shard.lock:
+            ts, columns = shard.history.window(window_start)
+    count, series = len(ts), downsample(ts, columns, points, method)
     
     return jsonify({
         'success': True,
-        'count': len(all_alerts),
-        'alerts': all_alerts
+        'device_id': device_id,
+        'method': method,
+        'points': points,
+        'count': count,
+        'series': {
+            field: {'timestamps': [to_iso(t) for t in ts], 'values': list(values)}
+            for field, (ts, values) in series.items()
+        }
     })
 
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """Lấy cảnh báo gần đây (chỉ các lần bật/tắt/nhắc lại, không lặp theo từng bản ghi)"""
+    hours = request.args.get('hours', 6, type=int)
+    device_id = request_device_id()
+    lang = request_lang()
+    # Cửa sổ thời gian trôi theo đồng hồ: chỉ dùng lại bản mã hóa trong ALERTS_CACHE_SECONDS
+    time_slot = int(time.time() // ALERTS_CACHE_SECONDS)
+    
+    def build():
+        time_limit = datetime.now() - timedelta(hours=hours)
+        
+        # Duyệt ngược từ sự kiện mới nhất, tối đa 50 sự kiện
+        events = []
+        shard = read_shard(device_id)
+        if shard is not None:
+            with shard.lock:
+                events = shard.alerts.events_since(time_limit.timestamp(), limit=50)
+        
+        all_alerts = [render_event(e, lang) for e in events]
+        
+        return {
+            'success': True,
+            'device_id': device_id,
+            'count': len(all_alerts),
+            'alerts': all_alerts
+        }
+    
+    return conditional_json(device_version(device_id), build, device_id, lang, hours, time_slot)
+
 @app.route('/api/settings', methods=['GET', 'POST'])
 def settings():
     """Lấy/cập nhật cài đặt"""
     if request.method == 'POST':
         try:
             new_settings = request.json
-            system_settings.update(new_settings)
-            save_data()
+            saved = ingest_core.call(apply_settings, new_settings, timeout=INGEST_WAIT_TIMEOUT)
             
             return jsonify({
                 'success': True,
                 'message': 'Cài đặt đã lưu',
-                'settings': system_settings
+                'settings': saved
             })
         except Exception as e:
             return jsonify({
@@ -309,58 +1079,157 @@ def settings():
             }), 500
     
     # GET request
-    return jsonify({
+    long_poll(lambda: settings_version)
+    version = settings_version
+    return conditional_json(version, lambda: {
         'success': True,
         'settings': system_settings
     })
 
+def apply_settings(new_settings):
+    """Cập nhật cài đặt trên writer, để không lô bản ghi nào thấy ngưỡng đổi giữa chừng"""
+    system_settings.update(new_settings)
+    save_data()
+    state_clock.tick(set_settings_version)
+    publish_settings()
+    response_cache.clear()
+    return dict(system_settings)
+
+@app.route('/api/settings/backtest', methods=['POST'])
+def backtest_settings():
+    """Thử các bộ ngưỡng trên lịch sử đã lưu mà không đổi cài đặt đang dùng
+    
+    Body JSON: {"candidates": [{"danger_distance": 30, ...}, ...]} và/hoặc
+    {"grid": {"danger_distance": [20, 25, 30], "warn_distance": [40, 50]}} (tích Descartes),
+    tùy chọn "hours" (mặc định toàn bộ lịch sử) và "device" (mặc định tất cả thiết bị).
+    Bộ ngưỡng có thể đổi cả alert_clear_margin, alert_min_hold, alert_renotify_interval.
+    Mỗi bộ ngưỡng trả về số bản ghi vượt ngưỡng theo loại/vị trí, tỉ lệ và chênh lệch so với
+    cài đặt hiện tại, kèm "events": số cảnh báo thật sự bật/nhắc lại sau khi chạy lại lịch sử
+    qua AlertTracker (bỏ qua khi vượt BACKTEST_REPLAY_MAX: events_replayed false, hãy thu hẹp
+    "hours"/"device").
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'success': False, 'message': 'Cần body JSON'}), 400
+    try:
+        candidates = list(body.get('candidates') or [])
+        grid = body.get('grid')
+        if grid:
+            if not isinstance(grid, dict) or not all(isinstance(v, list) for v in grid.values()):
+                raise ValueError('grid phải là {tên ngưỡng: [giá trị, ...]}')
+            candidates.extend(expand_grid(grid))
+        if len(candidates) > BACKTEST_MAX_CANDIDATES:
+            raise ValueError(f'Tối đa {BACKTEST_MAX_CANDIDATES} bộ ngưỡng mỗi lần')
+        for candidate in candidates:
+            validate_candidate(candidate)
+        hours = body.get('hours')
+        if hours is not None and (not isinstance(hours, (int, float)) or hours <= 0):
+            raise ValueError('hours không hợp lệ')
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    device_id = body.get('device') or request.args.get('device')
+    if device_id:
+        shard = devices.get(device_id, create=False)
+        shards = [shard] if shard is not None else []
+    else:
+        shards = devices.shards()
+    window_start = (datetime.now() - timedelta(hours=hours)).timestamp() if hours else None
+    
+    # Sao chép các cột dưới khóa từng shard, sau đó sắp xếp, đếm và chạy lại không cần khóa
+    started = time.perf_counter()
+    series = []
+    for shard in shards:
+        with shard.lock:
+            series.append(shard.history.window(window_start or 0))
+    index = ThresholdIndex.from_columns(columns for _, columns in series)
+    replayed = index.size * (len(candidates) + 1) <= BACKTEST_REPLAY_MAX
+    current, results = backtest(index, candidates, system_settings, series if replayed else None)
+    metrics.observe('backtest_seconds', time.perf_counter() - started)
+    
+    return jsonify({
+        'success': True,
+        'device_id': device_id,
+        'readings': index.size,
+        'events_replayed': replayed,
+        'current': current,
+        'count': len(results),
+        'results': results
+    })
+
 @app.route('/api/device/mode', methods=['POST'])
 def set_mode():
     """Thay đổi chế độ"""
     try:
         data = request.json
         mode = data.get('mode', 1)
-        
-        current_data['mode'] = mode
+        device_id = request_device_id(data)
+        ingest_core.call(apply_mode, device_id, mode, timeout=INGEST_WAIT_TIMEOUT)
         
         return jsonify({
             'success': True,
             'message': f'Đã đổi sang chế độ {mode}',
+            'device_id': device_id,
             'mode': mode
         })
+    except SharedStateFull as e:
+        return jsonify({'success': False, 'message': str(e)}), 507
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'Lỗi: {str(e)}'
         }), 500
 
+def apply_mode(device_id, mode):
+    reserve_device(device_id)
+    shard = devices.get(device_id)
+    with shard.lock:
+        shard.current['mode'] = mode
+    touch(shard)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Số liệu đo: độ trễ theo route, tốc độ nhận theo thiết bị, cảnh báo, thời gian lưu, hàng đợi
+    
+    ?format=prometheus trả về dạng text cho Prometheus.
+    """
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.prometheus(METRIC_LABELS), mimetype='text/plain; version=0.0.4')
+    return jsonify({'success': True, 'metrics': metrics.snapshot()})
+
 @app.route('/api/system/info', methods=['GET'])
 def system_info():
-    """Thông tin hệ thống"""
-    return jsonify({
-        'success': True,
-        'system': {
-            'name': 'Gậy Thông Minh - Server',
-            'version': '1.0',
-            'data_points': len(data_history),
-            'last_update': current_data['last_update'],
-            'server_time': datetime.now().isoformat()
+    """Thông tin hệ thống (ETag theo phiên bản trạng thái chung, hỗ trợ long-poll)"""
+    long_poll(lambda: state_clock.value)
+    
+    def build():
+        snapshots = current_snapshots()
+        last_updates = [s.current['last_update'] for s in snapshots if s.current['last_update']]
+        return {
+            'success': True,
+            'system': {
+                'name': 'Gậy Thông Minh - Server',
+                'version': '1.0',
+                'devices': len(snapshots),
+                'data_points': sum(s.history_count for s in snapshots),
+                'last_update': max(last_updates) if last_updates else None
+            }
         }
-    })
+    
+    return conditional_json(state_clock.value, build)
 
 @app.route('/api/system/clear', methods=['POST'])
 def clear_data():
     """Xóa dữ liệu cũ"""
     try:
-        global data_history
-        data_history = data_history[-100:]  # Giữ 100 bản ghi gần nhất
-        
-        save_data()
+        remaining = ingest_core.call(keep_recent, 100, timeout=INGEST_WAIT_TIMEOUT)
         
         return jsonify({
             'success': True,
             'message': 'Đã xóa dữ liệu cũ, giữ lại 100 bản ghi gần nhất',
-            'remaining': len(data_history)
+            'remaining': remaining
         })
     except Exception as e:
         return jsonify({
@@ -368,23 +1237,50 @@ def clear_data():
             'message': f'Lỗi: {str(e)}'
         }), 500
 
+def keep_recent(n):
+    """Giữ `n` bản ghi gần nhất của mỗi thiết bị và ghi lại log (writer)"""
+    write_batch_records()
+    entries = []
+    remaining = 0
+    for shard in devices.shards():
+        with shard.lock:
+            shard.history.keep_last(n)
+            remaining += len(shard.history)
+            entries.extend(shard.log_entries())  # Gồm cả sự kiện cảnh báo, không tính vào `remaining`
+        touch(shard)
+    
+    history_log.rewrite(entries)
+    return remaining
+
+# ============================================
+# KHO SQL (TÙY CHỌN)
+# ============================================
+if Config.DB_ENABLED:
+    # routes.py dùng `from app import ...`; khi chạy `python app.py` đó phải là chính module này
+    sys.modules.setdefault('app', sys.modules[__name__])
+    import routes
+    sql_sink = routes.store_readings
+
 # ============================================
 # CHẠY SERVER
 # ============================================
 if __name__ == '__main__':
+    # Log có cấu trúc (JSON mỗi dòng), ghi bởi thread nền; cấu hình qua LOG_LEVEL/LOG_FORMAT/LOG_SAMPLE_RATE
+    setup_logging()
+    
     # Tải dữ liệu từ file
     load_data()
     
     print(f"\n{'='*60}")
     print(f"🚀 SERVER GẬY THÔNG MINH")
     print(f"{'='*60}")
-    print(f"📂 Dữ liệu: {len(data_history)} bản ghi")
+    print(f"📂 Dữ liệu: {sum(len(s.history) for s in devices.shards())} bản ghi, {len(devices)} thiết bị")
     print(f"⚙️ Ngưỡng nguy hiểm: {system_settings['danger_distance']}cm")
     print(f"⚙️ Ngưỡng cảnh báo: {system_settings['warn_distance']}cm")
     print(f"🌐 Địa chỉ local: http://localhost:5000")
     # print(f"🌐 Địa chỉ LAN: http://{get_local_ip()}:5000")
     print(f"📡 Chờ dữ liệu từ ESP32...")
-    print(f"💾 Tự động lưu: Mỗi 5 phút")
+    print(f"💾 Lưu trữ: Ghi nối vào {LOG_DIR}/<ngày>/, gộp segment mỗi 5 phút, giữ {LOG_RETENTION_DAYS} ngày")
     print(f"{'='*60}\n")
     
     # Khởi động thread tự động lưu
@@ -392,7 +1288,7 @@ if __name__ == '__main__':
     save_thread.start()
     
     # Chạy server
-    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+    app.run(host='0.0.0.0', port=5000, debug=Config.DEBUG, use_reloader=False)
 
 def get_local_ip():
     """Lấy IP local của máy"""
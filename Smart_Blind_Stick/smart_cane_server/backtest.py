@@ -0,0 +1,177 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import product
+
+from alerts import (ALERT_KINDS, FRONT_DANGER, FRONT_WARNING, GROUND_UNEVEN, HOLE,
+                    LEFT_WARNING, LOCATION_CODES, RAISE, RENOTIFY, RIGHT_WARNING, AlertTracker)
+from history import DISTANCE_FIELDS
+
+# Settings that change which readings alert_mask() flags
+THRESHOLD_KEYS = ('danger_distance', 'warn_distance', 'ir_ground', 'ir_hole')
+# Settings that only change how AlertTracker turns flagged readings into events
+HYSTERESIS_KEYS = ('alert_clear_margin', 'alert_min_hold', 'alert_renotify_interval')
+CANDIDATE_KEYS = THRESHOLD_KEYS + HYSTERESIS_KEYS
+
+# code -> 'type_location', the key used in results
+KIND_NAMES = {code: f'{kind[0]}_{kind[1]}' for code, kind in ALERT_KINDS.items()}
+
+
+class ThresholdIndex:
+    """Sorted copies of the distance columns of a set of readings.
+
+    Every alert in alert_mask() is a range test on a single column, so the
+    number of readings flagged with each alert code under any thresholds is
+    the difference of two binary searches. Sorting happens once; after that
+    each candidate settings set costs a few O(log n) lookups, independent
+    of how many readings there are.
+    """
+
+    def __init__(self, columns):
+        self.columns = {field: array('d', sorted(columns[field])) for field in DISTANCE_FIELDS}
+        self.size = len(self.columns[DISTANCE_FIELDS[0]])
+
+    @classmethod
+    def from_columns(cls, parts):
+        """Index several ``{field: column}`` dicts (e.g. one per device) together"""
+        merged = {field: array('d') for field in DISTANCE_FIELDS}
+        for columns in parts:
+            for field in DISTANCE_FIELDS:
+                merged[field].extend(columns[field])
+        return cls(merged)
+
+    def _below(self, field, value):
+        """Readings with ``field < value``"""
+        return bisect_left(self.columns[field], value)
+
+    def _at_most(self, field, value):
+        """Readings with ``field <= value``"""
+        return bisect_right(self.columns[field], value)
+
+    def _between(self, field, low, high):
+        """Readings with ``low <= field < high``"""
+        return max(self._below(field, high) - self._below(field, low), 0)
+
+    def counts(self, settings):
+        """Readings flagged with each alert code, mirroring alert_mask()"""
+        danger, warn = settings['danger_distance'], settings['warn_distance']
+        ground, hole = settings['ir_ground'], settings['ir_hole']
+        positive = {field: self._at_most(field, 0) for field in DISTANCE_FIELDS[:3]}
+
+        def positive_below(field, value):
+            # 0 < field < value
+            return max(self._below(field, value) - positive[field], 0)
+
+        ir_total = self.size
+        if hole >= ground:
+            holes = ir_total - self._at_most('ir_distance', hole)
+        else:
+            # ir > hole but only when not already uneven ground (ir >= ground)
+            holes = ir_total - self._below('ir_distance', ground)
+        return {
+            FRONT_DANGER: positive_below('front_distance', danger),
+            FRONT_WARNING: self._between('front_distance', danger, warn),
+            LEFT_WARNING: positive_below('left_distance', warn),
+            RIGHT_WARNING: positive_below('right_distance', warn),
+            GROUND_UNEVEN: self._below('ir_distance', ground),
+            HOLE: holes,
+        }
+
+    def summary(self, settings):
+        """Alert counts per kind and per location, with rates over all readings"""
+        counts = self.counts(settings)
+        by_location = {}
+        for location, codes in LOCATION_CODES.items():
+            count = sum(counts[code] for code in codes)
+            by_location[location] = {'count': count, 'rate': count / self.size if self.size else 0.0}
+        return {
+            'alerts': sum(counts.values()),
+            'by_kind': {KIND_NAMES[code]: count for code, count in sorted(counts.items())},
+            'by_location': by_location
+        }
+
+
+def replay_events(series, settings):
+    """Alert events the devices would have produced under ``settings``.
+
+    ``series`` holds one ``(ts, columns)`` pair per device in time order.
+    Each device's readings go through a fresh AlertTracker, so the clear
+    margin, minimum hold and renotify interval apply as they do live: this
+    counts the notifications a user would have received, where counts()
+    only counts the readings past a threshold.
+    """
+    raised = dict.fromkeys(sorted(ALERT_KINDS), 0)
+    renotified = 0
+    for ts, columns in series:
+        tracker = AlertTracker(0)  # Nothing is kept; events are only counted
+        rows = zip(ts, *(columns[field] for field in DISTANCE_FIELDS))
+        for t, *values in rows:
+            for event in tracker.update(dict(zip(DISTANCE_FIELDS, values)), t, settings):
+                if event.kind == RAISE:
+                    raised[event.code] += 1
+                elif event.kind == RENOTIFY:
+                    renotified += 1
+    return {
+        'raised': sum(raised.values()),
+        'renotified': renotified,
+        'by_kind': {KIND_NAMES[code]: count for code, count in raised.items()}
+    }
+
+
+def expand_grid(grid):
+    """Cartesian product of ``{key: [values]}`` as a list of candidate dicts"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in product(*(grid[k] for k in keys))]
+
+
+def validate_candidate(candidate):
+    """Threshold overrides of one candidate; raises ValueError on bad input"""
+    if not isinstance(candidate, dict):
+        raise ValueError('each candidate must be an object')
+    unknown = set(candidate) - set(CANDIDATE_KEYS)
+    if unknown:
+        raise ValueError(f'unknown settings: {", ".join(sorted(unknown))}')
+    for key, value in candidate.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{key} must be a number')
+    return candidate
+
+
+def backtest(index, candidates, current, series=None):
+    """Evaluate each candidate (overrides of ``current``) against ``index``.
+
+    Returns the summary under the current settings and, per candidate, its
+    full settings, summary and the difference from the current summary.
+    With ``series`` (see replay_events()) each summary also has ``events``,
+    the alerts actually raised once hysteresis is applied.
+    """
+    base_settings = {key: current[key] for key in THRESHOLD_KEYS}
+    base_settings.update({key: current.get(key, 0) for key in HYSTERESIS_KEYS})
+
+    def evaluate(settings):
+        summary = index.summary(settings)
+        if series is not None:
+            summary['events'] = replay_events(series, settings)
+        summary['settings'] = settings
+        return summary
+
+    baseline = evaluate(base_settings)
+    results = []
+    for candidate in candidates:
+        settings = dict(base_settings)
+        settings.update(candidate)
+        summary = evaluate(settings)
+        summary['diff'] = {
+            'alerts': summary['alerts'] - baseline['alerts'],
+            'by_kind': {kind: count - baseline['by_kind'][kind]
+                        for kind, count in summary['by_kind'].items()},
+            'by_location': {location: {
+                'count': value['count'] - baseline['by_location'][location]['count'],
+                'rate': value['rate'] - baseline['by_location'][location]['rate']
+            } for location, value in summary['by_location'].items()}
+        }
+        if series is not None:
+            summary['diff']['events'] = {
+                key: summary['events'][key] - baseline['events'][key] for key in ('raised', 'renotified')
+            }
+        results.append(summary)
+    return baseline, results
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Đo hiệu năng server gậy thông minh
+
+  python benchmark.py load  --clients 20 --rate 5 --duration 30
+  python benchmark.py load  --url http://192.168.1.10:5000 --clients 50
+  python benchmark.py micro --records 50000 --repeat 200
+  python benchmark.py all   --output results/today.json
+  python benchmark.py compare results/before.json results/after.json
+
+`load`: N gậy ảo (mỗi gậy một luồng, một device_id) gửi tới /api/data/receive
+với tốc độ cho trước; dữ liệu phát lại từ data.json hoặc sinh ngẫu nhiên quanh
+phân bố của data.json (--synthesize). Báo cáo thông lượng, độ trễ p50/p95/p99
+và mức tăng bộ nhớ của lịch sử.
+
+`micro`: đo riêng check_alerts, save_data, load_data và các endpoint
+lịch sử/cảnh báo trên một lịch sử nạp sẵn --records bản ghi.
+
+Không có --url thì server chạy ngay trong tiến trình (Flask test client) trong
+một thư mục tạm, không đụng tới data_log/ và settings.json thật.
+Kết quả ghi ra JSON (--output) để `compare` so sánh giữa các lần chạy.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILE = os.path.join(SERVER_DIR, 'data.json')
+SENSOR_FIELDS = ('front_distance', 'left_distance', 'right_distance', 'ir_distance')
+
+# Chỉ số dùng để phát hiện chậm đi khi so sánh; giá trị lớn hơn là tốt hơn với HIGHER_IS_BETTER
+COMPARED = ('throughput', 'ops_per_second', '.p50', '.p95', '.p99', 'median_seconds',
+            'p95_seconds', 'bytes_per_record')
+HIGHER_IS_BETTER = ('throughput', 'ops_per_second')
+
+
+# ============================================
+# DỮ LIỆU GỬI
+# ============================================
+def load_recorded(path=DATA_FILE):
+    """Các bản ghi sensor trong data.json (bỏ timestamp/alerts)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    readings = []
+    for entry in entries:
+        reading = {field: float(entry.get(field, 0)) for field in SENSOR_FIELDS}
+        reading['mode'] = int(entry.get('mode', 1))
+        readings.append(reading)
+    if not readings:
+        raise ValueError(f'{path} không có bản ghi nào')
+    return readings
+
+
+def replay_stream(recorded, offset):
+    """Phát lại data.json vòng tròn, mỗi gậy bắt đầu ở một vị trí khác nhau"""
+    i = offset
+    while True:
+        yield dict(recorded[i % len(recorded)])
+        i += 1
+
+
+def synthetic_stream(recorded, seed):
+    """Bước ngẫu nhiên quanh trung bình/độ lệch của từng kênh trong data.json"""
+    rng = random.Random(seed)
+    stats = {}
+    for field in SENSOR_FIELDS:
+        values = [r[field] for r in recorded]
+        stats[field] = (min(values), max(values), statistics.pstdev(values) or 1.0)
+    modes = sorted({r['mode'] for r in recorded})
+    current = dict(rng.choice(recorded))
+    battery = 100.0
+    while True:
+        for field, (low, high, spread) in stats.items():
+            step = rng.gauss(0, spread / 4)
+            current[field] = round(min(max(current[field] + step, low), high), 1)
+        if rng.random() < 0.01:
+            current['mode'] = rng.choice(modes)
+        battery = max(battery - 0.01, 0)
+        current['battery_level'] = int(battery)
+        yield dict(current)
+
+
+# ============================================
+# SERVER TRONG TIẾN TRÌNH
+# ============================================
+_server = None
+
+
+def local_server(workdir=None):
+    """Import app.py trong thư mục tạm (lần đầu) và trả về module"""
+    global _server
+    if _server is None:
+        workdir = workdir or tempfile.mkdtemp(prefix='smart_cane_bench_')
+        shutil.copy(DATA_FILE, os.path.join(workdir, 'data.json'))
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.chdir(workdir)
+        sys.path.insert(0, SERVER_DIR)
+        import app as server
+        server.load_data()
+        _server = server
+    return _server
+
+
+def history_memory(server):
+    """Số bản ghi và số byte của các cột lịch sử trong RAM, cộng cả sự kiện cảnh báo"""
+    records = nbytes = events = 0
+    for shard in server.devices.shards():
+        with shard.lock:
+            history = shard.history
+            records += len(history)
+            for column in [history.ts, history.mode, history.alert_mask, *history.columns.values()]:
+                nbytes += column.itemsize * len(column)
+            events += len(shard.alerts.events)
+    return {'records': records, 'column_bytes': nbytes, 'alert_events': events}
+
+
+def rss_bytes():
+    """Bộ nhớ thường trú của tiến trình (None nếu không đọc được)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+
+def preload(server, records, path=DATA_FILE, device_id='bench-preload', hours=24, batch=1000):
+    """Nạp sẵn `records` bản ghi (lấy từ file `path`) rải đều trong `hours` giờ vừa qua cho một thiết bị"""
+    recorded = load_recorded(path)
+    stream = replay_stream(recorded, 0)
+    now = time.time()
+    step = hours * 3600 / max(records, 1)
+    start = now - hours * 3600
+    for first in range(0, records, batch):
+        readings = [(start + i * step, server.parse_reading(next(stream)))
+                    for i in range(first, min(first + batch, records))]
+        server.ingest_readings(device_id, readings)
+    return device_id
+
+
+# ============================================
+# TẢI: N GẬY ĐỒNG THỜI
+# ============================================
+def percentiles(samples):
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None, 'mean': None}
+    ordered = sorted(samples)
+
+    def at(q):
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    return {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99),
+            'max': ordered[-1], 'mean': sum(ordered) / len(ordered)}
+
+
+class _HttpSender:
+    """Gửi qua mạng tới server thật (giữ kết nối bằng requests.Session)"""
+
+    def __init__(self, url, timeout):
+        import requests
+        self.session = requests.Session()
+        self.url = url.rstrip('/') + '/api/data/receive'
+        self.timeout = timeout
+
+    def send(self, device_id, payload):
+        response = self.session.post(self.url, json=payload, timeout=self.timeout,
+                                     headers={'X-Device-Id': device_id})
+        return response.status_code
+
+
+class _LocalSender:
+    """Gọi thẳng WSGI app trong tiến trình"""
+
+    def __init__(self, server):
+        self.client = server.app.test_client()
+
+    def send(self, device_id, payload):
+        response = self.client.post('/api/data/receive', json=payload,
+                                    headers={'X-Device-Id': device_id})
+        return response.status_code
+
+
+def run_load(args):
+    """Chạy N luồng gửi, mỗi luồng `rate` bản ghi/giây trong `duration` giây"""
+    recorded = load_recorded(args.data)
+    server = None if args.url else local_server()
+    before = history_memory(server) if server else None
+    rss_before = rss_bytes() if server else None
+
+    latencies = [[] for _ in range(args.clients)]
+    statuses = [{} for _ in range(args.clients)]
+    errors = [0] * args.clients
+    start_gate = threading.Barrier(args.clients + 1)
+    stop_at = [0.0]
+    measure_from = [0.0]  # Bỏ các request trong thời gian khởi động (--warmup)
+
+    def client(index):
+        device_id = f'{args.device_prefix}-{index:03d}'
+        sender = _HttpSender(args.url, args.timeout) if args.url else _LocalSender(server)
+        stream = (synthetic_stream(recorded, args.seed + index) if args.synthesize
+                  else replay_stream(recorded, index * 7))
+        interval = 1.0 / args.rate if args.rate > 0 else 0
+        start_gate.wait()
+        next_send = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at[0]:
+                break
+            if interval and now < next_send:
+                time.sleep(min(next_send - now, stop_at[0] - now))
+                continue
+            payload = next(stream)
+            started = time.perf_counter()
+            try:
+                status = sender.send(device_id, payload)
+            except Exception:
+                status = 'error'
+                if started >= measure_from[0]:
+                    errors[index] += 1
+            if started >= measure_from[0]:
+                latencies[index].append(time.perf_counter() - started)
+                statuses[index][status] = statuses[index].get(status, 0) + 1
+            # Lịch cố định: gửi bù nếu bị chậm, nhưng không dồn quá một giây
+            next_send = max(next_send + interval, time.perf_counter() - 1.0)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    measure_from[0] = time.perf_counter() + args.warmup
+    stop_at[0] = measure_from[0] + args.duration
+    start_gate.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - measure_from[0]
+
+    all_latencies = [x for samples in latencies for x in samples]
+    status_counts = {}
+    for counts in statuses:
+        for status, n in counts.items():
+            status_counts[str(status)] = status_counts.get(str(status), 0) + n
+    ok = status_counts.get('200', 0)
+
+    result = {
+        'mode': 'http' if args.url else 'in-process',
+        'url': args.url,
+        'payload': 'synthetic' if args.synthesize else 'replay',
+        'clients': args.clients,
+        'target_rate_per_client': args.rate,
+        'duration_seconds': elapsed,
+        'requests': len(all_latencies),
+        'requests_ok': ok,
+        'errors': sum(errors),
+        'status_counts': status_counts,
+        'throughput': ok / elapsed if elapsed else 0.0,
+        'latency_seconds': percentiles(all_latencies)
+    }
+    if server:
+        after = history_memory(server)
+        server.history_log.flush()
+        rss_after = rss_bytes()
+        result['memory'] = {
+            'history_records_added': after['records'] - before['records'],
+            'history_column_bytes_added': after['column_bytes'] - before['column_bytes'],
+            'history_bytes_per_record': ((after['column_bytes'] - before['column_bytes'])
+                                         / max(after['records'] - before['records'], 1)),
+            'alert_events_added': after['alert_events'] - before['alert_events'],
+            'rss_bytes_added': (rss_after - rss_before) if rss_before and rss_after else None,
+            'history_records_total': after['records'],
+            'history_column_bytes_total': after['column_bytes']
+        }
+    return result
+
+
+# ============================================
+# MICROBENCHMARK
+# ============================================
+def timeit(fn, repeat, warmup=3):
+    """Chạy `fn` `repeat` lần, trả về thống kê thời gian mỗi lần"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    median = statistics.median(samples)
+    return {
+        'repeat': repeat,
+        'min_seconds': min(samples),
+        'median_seconds': median,
+        'p95_seconds': percentiles(samples)['p95'],
+        'ops_per_second': 1 / median if median else None
+    }
+
+
+def run_micro(args):
+    server = local_server()
+    recorded = [server.parse_reading(r) for r in load_recorded(args.data)]
+    device_id = preload(server, args.records, args.data)
+    client = server.app.test_client()
+    query = f'?device={device_id}'
+    results = {'records': args.records}
+
+    def check_alerts():
+        for reading in recorded:
+            server.check_alerts(reading)
+
+    def get(path):
+        def request():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path}: HTTP {response.status_code}')
+        return request
+
+    def uncached(fn):
+        def request():
+            server.response_cache.clear()
+            fn()
+        return request
+
+    load_repeat = max(1, min(args.repeat, args.load_repeat))
+    cases = [
+        ('check_alerts', check_alerts, args.repeat, len(recorded)),
+        ('save_data', server.save_data, args.repeat, 1),
+        ('history_page', get(f'/api/data/history{query}&limit=100'), args.repeat, 1),
+        ('history_page_max', get(f'/api/data/history{query}&limit={server.HISTORY_PAGE_MAX}'),
+         args.repeat, 1),
+        ('history_points_lttb', get(f'/api/data/history{query}&points=500&method=lttb'),
+         args.repeat, 1),
+        ('history_points_minmax', get(f'/api/data/history{query}&points=500&method=minmax'),
+         args.repeat, 1),
+        ('alerts', get(f'/api/alerts{query}'), args.repeat, 1),
+        ('alerts_uncached', uncached(get(f'/api/alerts{query}')), args.repeat, 1),
+        ('current', get(f'/api/data/current{query}'), args.repeat, 1),
+        ('load_data', server.load_data, load_repeat, 1),
+    ]
+    selected = set(args.only) if args.only else None
+    for name, fn, repeat, per_call in cases:
+        if selected and name not in selected:
+            continue
+        stats = timeit(fn, repeat, warmup=1 if name == 'load_data' else 3)
+        if per_call > 1:
+            stats['items_per_call'] = per_call
+            stats['seconds_per_item'] = stats['median_seconds'] / per_call
+        results[name] = stats
+    return results
+
+
+# ============================================
+# SO SÁNH
+# ============================================
+def flatten(data, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1}, chỉ giữ số"""
+    flat = {}
+    for key, value in data.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(before, after, threshold):
+    """Các chỉ số đổi quá `threshold` (tỉ lệ); trả về (dòng báo cáo, có chậm đi không)"""
+    old = flatten({k: before.get(k, {}) for k in ('load', 'micro')})
+    new = flatten({k: after.get(k, {}) for k in ('load', 'micro')})
+    lines, regressed = [], False
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        if not a or a == b:
+            continue
+        change = (b - a) / abs(a)
+        if abs(change) < threshold:
+            continue
+        better = change > 0 if key.endswith(HIGHER_IS_BETTER) else change < 0
+        if not key.endswith(COMPARED):
+            verdict = ''
+        else:
+            verdict = 'tốt hơn' if better else 'CHẬM HƠN'
+            regressed = regressed or not better
+        lines.append(f'{key:60s} {a:14.6g} -> {b:14.6g}  {change:+7.1%}  {verdict}')
+    return lines, regressed
+
+
+# ============================================
+# CHẠY
+# ============================================
+def metadata(args):
+    return {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k != 'func'}
+    }
+
+
+def write_results(results, output):
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if output and output != '-':
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f'Đã ghi kết quả vào {output}', file=sys.stderr)
+    else:
+        print(text)
+
+
+def print_summary(results):
+    load = results.get('load')
+    if load:
+        latency = load['latency_seconds']
+        print(f"[load] {load['clients']} gậy, {load['requests']} request trong "
+              f"{load['duration_seconds']:.1f}s: {load['throughput']:.0f} req/s, "
+              f"p50={_ms(latency['p50'])} p95={_ms(latency['p95'])} p99={_ms(latency['p99'])}, "
+              f"lỗi={load['errors']}", file=sys.stderr)
+        if 'memory' in load:
+            memory = load['memory']
+            print(f"[load] lịch sử +{memory['history_records_added']} bản ghi, "
+                  f"+{memory['history_column_bytes_added'] / 1024:.0f} KiB cột "
+                  f"({memory['history_bytes_per_record']:.0f} B/bản ghi)", file=sys.stderr)
+    for name, stats in results.get('micro', {}).items():
+        if isinstance(stats, dict):
+            print(f"[micro] {name:24s} median={_ms(stats['median_seconds'])} "
+                  f"p95={_ms(stats['p95_seconds'])}", file=sys.stderr)
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.2f}ms'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Đo hiệu năng server gậy thông minh')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def common(p):
+        p.add_argument('--data', default=DATA_FILE, help='file bản ghi mẫu (mặc định data.json)')
+        p.add_argument('--output', '-o', default='-', help="file JSON kết quả ('-' = stdout)")
+
+    def load_options(p):
+        p.add_argument('--url', help='server thật, vd. http://localhost:5000 (mặc định: trong tiến trình)')
+        p.add_argument('--clients', type=int, default=10, help='số gậy gửi đồng thời')
+        p.add_argument('--rate', type=float, default=5.0,
+                       help='bản ghi/giây mỗi gậy (0 = gửi liên tục)')
+        p.add_argument('--duration', type=float, default=10.0, help='số giây đo')
+        p.add_argument('--warmup', type=float, default=0.0, help='số giây chạy trước khi đo')
+        p.add_argument('--synthesize', action='store_true',
+                       help='sinh dữ liệu ngẫu nhiên theo phân bố của data.json thay vì phát lại')
+        p.add_argument('--seed', type=int, default=1)
+        p.add_argument('--timeout', type=float, default=5.0, help='timeout mỗi request HTTP')
+        p.add_argument('--device-prefix', default='bench', help='tiền tố device_id của gậy ảo')
+
+    def micro_options(p):
+        p.add_argument('--records', type=int, default=20000, help='số bản ghi nạp sẵn')
+        p.add_argument('--repeat', type=int, default=100, help='số lần đo mỗi phép')
+        p.add_argument('--load-repeat', type=int, default=5, help='số lần đo load_data')
+        p.add_argument('--only', nargs='*', help='chỉ chạy các phép này')
+
+    p = commands.add_parser('load', help='N gậy gửi đồng thời tới /api/data/receive')
+    common(p)
+    load_options(p)
+    p = commands.add_parser('micro', help='microbenchmark các hàm và endpoint')
+    common(p)
+    micro_options(p)
+    p = commands.add_parser('all', help='micro rồi load (trong tiến trình)')
+    common(p)
+    load_options(p)
+    micro_options(p)
+    p = commands.add_parser('compare', help='so sánh hai file kết quả')
+    p.add_argument('before')
+    p.add_argument('after')
+    p.add_argument('--threshold', type=float, default=0.10, help='bỏ qua thay đổi nhỏ hơn (tỉ lệ)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        with open(args.before, encoding='utf-8') as f:
+            before = json.load(f)
+        with open(args.after, encoding='utf-8') as f:
+            after = json.load(f)
+        lines, regressed = compare(before, after, args.threshold)
+        print('\n'.join(lines) if lines else f'Không có thay đổi nào vượt {args.threshold:.0%}')
+        return 1 if regressed else 0
+
+    if args.data != DATA_FILE:
+        args.data = os.path.abspath(args.data)
+    if args.output not in (None, '-'):
+        args.output = os.path.abspath(args.output)
+
+    results = {'meta': metadata(args)}
+    if args.command in ('micro', 'all'):
+        results['micro'] = run_micro(args)
+    if args.command in ('load', 'all'):
+        results['load'] = run_load(args)
+    print_summary(results)
+    write_results(results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import struct
+
+BINARY_CONTENT_TYPE = 'application/vnd.smartcane.reading'
+
+# Version 1 record, little-endian, 16 bytes:
+#   B  version          (= 1)
+#   B  flags            bit0 power_status, bit1 wifi_connected
+#   B  mode
+#   B  battery_level    (%)
+#   H  front_distance   (0.1 cm)
+#   H  left_distance    (0.1 cm)
+#   H  right_distance   (0.1 cm)
+#   H  ir_distance      (0.1 cm)
+#   I  age_ms           how long before sending the reading was taken
+READING_V1 = struct.Struct('<BBBBHHHHI')
+VERSION_1 = 1
+
+FLAG_POWER = 0x01
+FLAG_WIFI = 0x02
+
+
+def decode_readings(payload, now):
+    """Decode one or more concatenated binary records.
+
+    Returns a list of ``(epoch, reading)`` tuples where ``reading`` has the
+    same keys as a parsed JSON reading. Raises ``ValueError`` on a bad
+    length or an unknown version byte.
+    """
+    if not payload or len(payload) % READING_V1.size:
+        raise ValueError(f'Payload length must be a multiple of {READING_V1.size} bytes')
+
+    readings = []
+    for version, flags, mode, battery, front, left, right, ir, age_ms in READING_V1.iter_unpack(payload):
+        if version != VERSION_1:
+            raise ValueError(f'Unsupported record version: {version}')
+        readings.append((now - age_ms / 1000.0, {
+            'front_distance': front / 10.0,
+            'left_distance': left / 10.0,
+            'right_distance': right / 10.0,
+            'ir_distance': ir / 10.0,
+            'mode': mode,
+            'power_status': bool(flags & FLAG_POWER),
+            'battery_level': battery,
+            'wifi_connected': bool(flags & FLAG_WIFI)
+        }))
+    return readings
+
+
+def encode_reading(reading, age_ms=0):
+    """Pack a reading dict into a version 1 record (for clients and tools)"""
+    flags = (FLAG_POWER if reading.get('power_status') else 0) | \
+        (FLAG_WIFI if reading.get('wifi_connected') else 0)
+    return READING_V1.pack(
+        VERSION_1,
+        flags,
+        int(reading.get('mode', 1)),
+        int(reading.get('battery_level', 100)),
+        int(round(reading.get('front_distance', 0) * 10)),
+        int(round(reading.get('left_distance', 0) * 10)),
+        int(round(reading.get('right_distance', 0) * 10)),
+        int(round(reading.get('ir_distance', 0) * 10)),
+        int(age_ms)
+    )
@@ -0,0 +1,17 @@
+import base64
+import json
+
+
+def encode_cursor(key):
+    """Opaque pagination token for a JSON-serializable keyset position"""
+    raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError on a malformed token"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        return json.loads(raw)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {e}')
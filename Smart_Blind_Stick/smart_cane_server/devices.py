@@ -0,0 +1,87 @@
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from alerts import AlertTracker, event_record
+from history import HistoryBuffer
+
+DEFAULT_DEVICE_ID = 'ESP32_001'
+
+# Read-only view of one device published after each change (see ingest.py)
+DeviceSnapshot = namedtuple('DeviceSnapshot', ['device_id', 'version', 'current', 'active', 'history_count'])
+
+
+def new_current_data():
+    """Initial state of a device that has not reported yet"""
+    return {
+        'front_distance': 0,
+        'left_distance': 0,
+        'right_distance': 0,
+        'ir_distance': 0,
+        'mode': 1,
+        'power_status': False,
+        'battery_level': 100,
+        'wifi_connected': False,
+        'last_update': None,
+        'alert_mask': 0
+    }
+
+
+class DeviceShard:
+    """Current state, history and alert state of one cane, guarded by its own lock"""
+
+    def __init__(self, device_id, history_capacity, event_capacity):
+        self.device_id = device_id
+        self.lock = threading.Lock()
+        self.current = new_current_data()
+        self.history = HistoryBuffer(history_capacity)
+        self.alerts = AlertTracker(event_capacity)
+        self.version = 0  # State version of the last change (see versions.py)
+
+    def snapshot(self):
+        """Immutable copy of the current state and active alerts (call with the lock held)"""
+        current = dict(self.current)
+        return DeviceSnapshot(self.device_id, self.version, MappingProxyType(current),
+                              tuple(self.alerts.active_alerts(current)), len(self.history))
+
+    def log_entries(self):
+        """History records tagged with the device id, as written to the log"""
+        records = self.history.records()
+        records.extend(event_record(e) for e in self.alerts.events)
+        for record in records:
+            record['device_id'] = self.device_id
+        return records
+
+
+class DeviceRegistry:
+    """Map of device id -> DeviceShard.
+
+    The registry lock is only taken when a new device shows up; readings and
+    queries for a known device only touch that device's shard.
+    """
+
+    def __init__(self, history_capacity, event_capacity):
+        self.history_capacity = history_capacity
+        self.event_capacity = event_capacity
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def get(self, device_id, create=True):
+        shard = self._shards.get(device_id)
+        if shard is None and create:
+            with self._lock:
+                shard = self._shards.get(device_id)
+                if shard is None:
+                    shard = DeviceShard(device_id, self.history_capacity, self.event_capacity)
+                    self._shards[device_id] = shard
+        return shard
+
+    def shards(self):
+        return list(self._shards.values())
+
+    def __len__(self):
+        return len(self._shards)
+
+    def clear(self):
+        with self._lock:
+            self._shards = {}
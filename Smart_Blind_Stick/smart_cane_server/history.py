@@ -0,0 +1,375 @@
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+
+from alerts import DEFAULT_LANG, iter_alerts, mask_from_legacy, render_alerts
+
+DISTANCE_FIELDS = ('front_distance', 'left_distance', 'right_distance', 'ir_distance')
+
+
+def to_epoch(timestamp):
+    """Convert an ISO timestamp string (or datetime) to epoch seconds"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.timestamp()
+
+
+def to_iso(epoch):
+    """Convert epoch seconds back to the ISO format used by the API"""
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+def lttb(xs, ys, n):
+    """Indices of ``n`` points chosen by Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last point; from each bucket in between it keeps
+    the point forming the largest triangle with the previously kept point
+    and the average of the next bucket, which preserves peaks and dips.
+    """
+    size = len(xs)
+    if n >= size or n < 3:
+        return list(range(size)) if n >= size else [0, size - 1][:max(n, 0)]
+
+    every = (size - 2) / (n - 2)
+    kept = [0]
+    a = 0
+    for i in range(n - 2):
+        start = int(i * every) + 1
+        stop = int((i + 1) * every) + 1
+        next_start, next_stop = stop, min(int((i + 2) * every) + 1, size)
+        if next_start >= next_stop:
+            next_start, next_stop = size - 1, size
+        avg_x = sum(xs[next_start:next_stop]) / (next_stop - next_start)
+        avg_y = sum(ys[next_start:next_stop]) / (next_stop - next_start)
+
+        ax, ay = xs[a], ys[a]
+        dx, dy = avg_x - ax, avg_y - ay
+        best, best_area = start, -1.0
+        for j in range(start, stop):
+            area = abs(dx * (ys[j] - ay) - dy * (xs[j] - ax))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(size - 1)
+    return kept
+
+
+def minmax(ys, n):
+    """Indices of the minimum and maximum of ``n // 2`` equal buckets, in order"""
+    size = len(ys)
+    buckets = max(n // 2, 1)
+    if 2 * buckets >= size:
+        return list(range(size))
+
+    kept = []
+    for i in range(buckets):
+        start, stop = i * size // buckets, (i + 1) * size // buckets
+        chunk = ys[start:stop]
+        low = start + chunk.index(min(chunk))
+        high = start + chunk.index(max(chunk))
+        kept.extend(sorted({low, high}))
+    return kept
+
+
+DOWNSAMPLERS = {
+    'lttb': lambda ts, ys, n: lttb(ts, ys, n),
+    'minmax': lambda ts, ys, n: minmax(ys, n),
+}
+
+
+def downsample(ts, columns, points, method='lttb'):
+    """Every column reduced to about ``points`` points; maps field -> (timestamps, values).
+
+    Works on copies (e.g. from ``HistoryBuffer.window``), so callers run it
+    after releasing the shard lock.
+    """
+    pick = DOWNSAMPLERS[method]
+    series = {}
+    for field, values in columns.items():
+        kept = pick(ts, values, points)
+        series[field] = ([ts[i] for i in kept], [values[i] for i in kept])
+    return series
+
+
+class HistoryBuffer:
+    """Fixed-capacity ring buffer of readings stored as typed columns.
+
+    Readings are kept sorted by timestamp, so time-window lookups are a
+    binary search on the ``ts`` column followed by a slice. Columns grow by
+    doubling up to ``capacity``; after that the oldest reading is overwritten.
+
+    ``appended`` counts readings added at the newest end and ``edits``
+    counts every other change (a late reading moved into place, a trim), so
+    a copy of the tail can be kept up to date by copying only new rows.
+    """
+
+    def __init__(self, capacity, initial_size=1024):
+        self.capacity = capacity
+        size = min(capacity, initial_size)
+        self.ts = array('d', bytes(8 * size))
+        self.columns = {field: array('d', bytes(8 * size)) for field in DISTANCE_FIELDS}
+        self.mode = array('h', bytes(2 * size))
+        self.alert_mask = array('B', bytes(size))
+        self._allocated = size
+        self._start = 0
+        self._size = 0
+        self.appended = 0
+        self.edits = 0
+
+    def _grow(self):
+        if self._start:
+            # Unwrap first (only after keep_last), so new slots go at the end
+            s = self._start
+            self.ts = self.ts[s:] + self.ts[:s]
+            for field, column in self.columns.items():
+                self.columns[field] = column[s:] + column[:s]
+            self.mode = self.mode[s:] + self.mode[:s]
+            self.alert_mask = self.alert_mask[s:] + self.alert_mask[:s]
+            self._start = 0
+
+        extra = min(max(self._allocated, 1), self.capacity - self._allocated)
+        self.ts.extend(array('d', bytes(8 * extra)))
+        for column in self.columns.values():
+            column.extend(array('d', bytes(8 * extra)))
+        self.mode.extend(array('h', bytes(2 * extra)))
+        self.alert_mask.extend(array('B', bytes(extra)))
+        self._allocated += extra
+
+    def __len__(self):
+        return self._size
+
+    def _phys(self, i):
+        return (self._start + i) % self._allocated
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def append(self, entry):
+        """Append a history entry dict (``timestamp`` as ISO string)"""
+        mask = entry.get('alert_mask')
+        if mask is None:
+            mask = mask_from_legacy(entry.get('alerts'))
+        self.append_values(
+            to_epoch(entry['timestamp']),
+            entry['front_distance'],
+            entry['left_distance'],
+            entry['right_distance'],
+            entry['ir_distance'],
+            entry.get('mode', 1),
+            mask
+        )
+
+    def append_values(self, ts, front, left, right, ir, mode, alert_mask):
+        self.extend_values(((ts, front, left, right, ir, mode, alert_mask),))
+
+    def extend_values(self, rows):
+        """Add ``(ts, front, left, right, ir, mode, alert_mask)`` rows in any order.
+
+        Rows at or after the newest reading are appended. Older ones (e.g.
+        buffered on the device) are merged into the tail they belong to in
+        one pass, a slice copy per column, however many of them there are.
+        """
+        rows = sorted(rows, key=lambda row: row[0])
+        newest = self.ts[self._phys(self._size - 1)] if self._size else None
+        late = 0
+        while newest is not None and late < len(rows) and rows[late][0] < newest:
+            late += 1
+        if late:
+            self._merge(rows[:late])
+            self.edits += 1
+        for row in rows[late:]:
+            self._append_row(row)
+
+    def _append_row(self, row):
+        if self._size == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+        elif self._size == self._allocated:
+            self._grow()
+        self._write_row(self._phys(self._size), row)
+        self._size += 1
+        self.appended += 1
+
+    def _merge(self, rows):
+        """Merge sorted rows older than the newest reading into place"""
+        first = self.index_after(rows[0][0])
+        tails = [self._slice(column, first, self._size) for column in self._stored()]
+        merged = [tail[:0] for tail in tails]
+        done = 0
+        for row in rows:
+            # After readings with the same timestamp, like an append would be
+            at = bisect_right(tails[0], row[0], done)
+            for out, tail, value in zip(merged, tails, row):
+                out.extend(tail[done:at])
+                out.append(value)
+            done = at
+        for out, tail in zip(merged, tails):
+            out.extend(tail[done:])
+
+        # Past capacity the oldest readings go, as with appends
+        count = len(merged[0])
+        drop = max(first + count - self.capacity, 0)
+        if drop > first:
+            merged = [out[drop - first:] for out in merged]
+            count -= drop - first
+            drop = first
+        self._start = self._phys(drop) if self._allocated else 0
+        self._size = first - drop
+        while self._allocated < self._size + count:
+            self._grow()
+
+        p = self._phys(self._size)
+        split = min(count, self._allocated - p)
+        for column, out in zip(self._stored(), merged):
+            column[p:p + split] = out[:split]
+            column[:count - split] = out[split:]
+        self._size += count
+
+    def _stored(self):
+        return (self.ts, *self.columns.values(), self.mode, self.alert_mask)
+
+    def _write_row(self, p, row):
+        c = self.columns
+        (self.ts[p], c['front_distance'][p], c['left_distance'][p],
+         c['right_distance'][p], c['ir_distance'][p], self.mode[p], self.alert_mask[p]) = row
+
+    def keep_last(self, n):
+        """Drop everything except the ``n`` most recent readings"""
+        if n < self._size:
+            self._start = self._phys(self._size - n)
+            self._size = n
+            self.edits += 1
+
+    def drop_before(self, ts):
+        """Drop readings older than ``ts``"""
+        self.keep_last(self._size - self.index_from(ts))
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def index_from(self, ts):
+        """Logical index of the first reading at or after ``ts``"""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._phys(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index_after(self, ts):
+        """Logical index of the first reading strictly newer than ``ts``"""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._phys(mid)] <= ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _values(self, p):
+        return {field: column[p] for field, column in self.columns.items()}
+
+    def entry(self, i, lang=DEFAULT_LANG):
+        """Rebuild the API dict for logical index ``i``, rendering its alerts"""
+        p = self._phys(i)
+        entry = self._values(p)
+        entry['timestamp'] = to_iso(self.ts[p])
+        entry['mode'] = self.mode[p]
+        entry['alerts'] = render_alerts(self.alert_mask[p], entry, self.ts[p], lang)
+        return entry
+
+    def record(self, i):
+        """Log record for logical index ``i`` (alerts kept as a bitmask)"""
+        p = self._phys(i)
+        record = self._values(p)
+        record['timestamp'] = to_iso(self.ts[p])
+        record['mode'] = self.mode[p]
+        record['alert_mask'] = self.alert_mask[p]
+        return record
+
+    def alerts_at(self, i):
+        """Compact Alert records of logical index ``i``"""
+        p = self._phys(i)
+        mask = self.alert_mask[p]
+        if not mask:
+            return []
+        return list(iter_alerts(mask, self._values(p), self.ts[p]))
+
+    def entries(self, start=0, stop=None, lang=DEFAULT_LANG):
+        stop = self._size if stop is None else min(stop, self._size)
+        return [self.entry(i, lang) for i in range(start, stop)]
+
+    def records(self):
+        return [self.record(i) for i in range(self._size)]
+
+    def since(self, ts, limit=None, lang=DEFAULT_LANG):
+        """Readings newer than ``ts``; with ``limit`` only the most recent ones"""
+        start = self.index_after(ts)
+        if limit is not None:
+            start = max(start, self._size - limit)
+        return self.entries(start, lang=lang)
+
+    def _slice(self, column, start, stop):
+        """Copy of logical rows [start, stop) of ``column`` as one contiguous array"""
+        if start >= stop:
+            return column[:0]
+        p, q = self._phys(start), self._phys(start) + (stop - start)
+        if q <= self._allocated:
+            return column[p:q]
+        return column[p:] + column[:q - self._allocated]
+
+    def tail(self, n):
+        """Contiguous copies of every column for the ``n`` most recent readings"""
+        start = max(self._size - n, 0)
+        columns = {field: self._slice(column, start, self._size) for field, column in self.columns.items()}
+        return (self._slice(self.ts, start, self._size), columns,
+                self._slice(self.mode, start, self._size), self._slice(self.alert_mask, start, self._size))
+
+    @classmethod
+    def from_columns(cls, capacity, ts, columns, mode, alert_mask):
+        """Buffer holding the given sorted columns as is (e.g. read from shared memory)"""
+        history = cls(capacity, initial_size=0)
+        history.ts = array('d', ts)
+        history.columns = {field: array('d', columns[field]) for field in DISTANCE_FIELDS}
+        history.mode = array('h', mode)
+        history.alert_mask = array('B', alert_mask)
+        history._allocated = history._size = len(history.ts)
+        return history
+
+    def columns_since(self, window_start=None):
+        """Contiguous copies of the distance columns for readings newer than ``window_start``"""
+        start = 0 if window_start is None else self.index_after(window_start)
+        return {field: self._slice(column, start, self._size) for field, column in self.columns.items()}
+
+    def window(self, window_start):
+        """Contiguous copies of ``ts`` and the distance columns for readings newer than ``window_start``"""
+        start = self.index_after(window_start)
+        return (self._slice(self.ts, start, self._size),
+                {field: self._slice(column, start, self._size) for field, column in self.columns.items()})
+
+    def page_before(self, window_start, limit, cursor=None, lang=DEFAULT_LANG):
+        """One page of readings newer than ``window_start``, walking backwards.
+
+        ``cursor`` is ``(ts, skip)``: the oldest timestamp already returned and
+        how many readings with exactly that timestamp were returned. Returns
+        ``(entries, next_cursor)``; ``next_cursor`` is None on the last page.
+        """
+        first = self.index_after(window_start)
+        if cursor is None:
+            end = self._size
+        else:
+            cursor_ts, skip = cursor
+            end = self.index_after(cursor_ts) - skip
+        start = max(first, end - limit)
+        if start >= end:
+            return [], None
+
+        next_cursor = None
+        if start > first:
+            oldest = self.ts[self._phys(start)]
+            next_cursor = (oldest, self.index_after(oldest) - start)
+        return self.entries(start, end, lang=lang), next_cursor
@@ -0,0 +1,168 @@
+import logging
+import queue
+import threading
+
+from write_behind import BacklogFull
+
+log = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'result', 'error', 'done', 'on_done')
+
+    def __init__(self, fn, args, on_done=None):
+        self.fn = fn
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.on_done = on_done  # on_done(job), called on the writer thread once done
+
+    def wait(self, timeout=None):
+        """Result of the job; re-raises its exception, TimeoutError if not done in time"""
+        if not self.done.wait(timeout):
+            raise TimeoutError('ingest job still queued')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class IngestCore:
+    """Single writer for all mutable server state.
+
+    Request handlers never mutate device state themselves: ``submit(fn,
+    *args)`` puts the call on a bounded queue and one writer thread runs the
+    calls in arrival order, so there are no writer/writer races and no lock
+    shared by all requests. The writer takes up to ``batch_size`` queued jobs
+    at a time and calls ``after_batch()`` once after running them (used to
+    group log writes); waiters are released only after that. A job that
+    raises only fails itself; a failing ``after_batch()`` fails the batch.
+
+    Readers use ``snapshot(key)``: immutable values the writer publishes with
+    ``publish(key, value)``. The table is replaced, never modified in place,
+    so a reader gets a consistent view without taking any lock.
+
+    When the queue stays full for ``put_timeout`` seconds (or at once with
+    ``block=False``) ``submit`` raises BacklogFull. Event loops pass
+    ``on_done`` instead of blocking in ``wait()``. Before ``start()``, and
+    when called from the writer thread itself, jobs run inline.
+    """
+
+    def __init__(self, after_batch=None, max_queue=10000, batch_size=256,
+                 put_timeout=0.5, name='ingest'):
+        self.after_batch = after_batch
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._snapshots = {}
+        self._thread = None
+        self._closed = False
+        self.batches = 0
+        self.jobs = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """Stop accepting jobs and finish the queued ones"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def in_writer(self):
+        return threading.current_thread() is self._thread
+
+    # ------------------------------------------------------------------
+    # Submitting work
+    # ------------------------------------------------------------------
+    def submit(self, fn, *args, on_done=None, block=True):
+        """Queue ``fn(*args)`` for the writer, return a job to ``wait()`` on"""
+        job = _Job(fn, args, on_done)
+        if self._thread is None or self.in_writer():
+            self._execute([job])
+            return job
+        if self._closed:
+            raise BacklogFull(f'{self.name} is closed')
+        try:
+            self._queue.put(job, block, self.put_timeout)
+        except queue.Full:
+            raise BacklogFull(f'{self.name} queue is full ({self._queue.maxsize} jobs)')
+        return job
+
+    def call(self, fn, *args, timeout=None):
+        """Run ``fn(*args)`` on the writer and return its result"""
+        return self.submit(fn, *args).wait(timeout)
+
+    # ------------------------------------------------------------------
+    # Published snapshots
+    # ------------------------------------------------------------------
+    def publish(self, key, value):
+        """Replace the snapshot of ``key`` (writer only)"""
+        snapshots = dict(self._snapshots)
+        snapshots[key] = value
+        self._snapshots = snapshots
+
+    def reset(self):
+        """Drop every snapshot (writer only)"""
+        self._snapshots = {}
+
+    def snapshot(self, key):
+        return self._snapshots.get(key)
+
+    def snapshots(self):
+        return list(self._snapshots.values())
+
+    # ------------------------------------------------------------------
+    # Writer thread
+    # ------------------------------------------------------------------
+    def _execute(self, jobs):
+        for job in jobs:
+            try:
+                job.result = job.fn(*job.args)
+            except Exception as e:
+                job.error = e
+        try:
+            if self.after_batch is not None:
+                self.after_batch()
+        except Exception as e:
+            log.exception("%s: after_batch failed", self.name)
+            for job in jobs:
+                if job.error is None:
+                    job.error = e
+        self.batches += 1
+        self.jobs += len(jobs)
+        for job in jobs:
+            job.done.set()
+            if job.on_done is not None:
+                try:
+                    job.on_done(job)
+                except Exception:
+                    log.exception("%s: on_done callback failed", self.name)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            job = self._queue.get()
+            if job is None:
+                break
+            jobs = [job]
+            while len(jobs) < self.batch_size:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+            self._execute(jobs)
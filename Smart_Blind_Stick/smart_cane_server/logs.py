@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per line: ts, level, logger, msg and the ``extra`` fields"""
+
+    def format(self, record):
+        line = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'sample':
+                line[key] = value
+        if record.exc_info:
+            line['exc'] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Let through only a fraction of records logged with ``extra={'sample': True}``"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sample', False):
+            return self.rate >= 1 or random.random() < self.rate
+        return True
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record as is: message formatting and tracebacks happen on the writer thread"""
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+_records = None
+
+
+def setup_logging(level=None, fmt=None, sample_rate=None, stream=None):
+    """Route the root logger through a queue to a background writer thread.
+
+    Request threads only enqueue the record; the QueueListener thread does
+    the message formatting, JSON encoding and the terminal I/O.
+    Settings default to the LOG_LEVEL, LOG_FORMAT ('json' or 'text') and
+    LOG_SAMPLE_RATE environment variables. Safe to call more than once.
+    """
+    global _listener, _records
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'json')
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    records = _records = queue.SimpleQueue()
+    handler = _InProcessQueueHandler(records)
+    handler.addFilter(SampleFilter(sample_rate))
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def queue_depth():
+    """Log records waiting for the writer thread"""
+    return _records.qsize() if _records is not None else 0
+
+
+def shutdown_logging():
+    """Flush queued records (registered with atexit)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
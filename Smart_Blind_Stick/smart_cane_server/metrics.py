@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds (upper bounds; +Inf is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+class Histogram:
+    """Cumulative-bucket histogram with sum and count"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (None if empty)"""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, value_sum = list(self.counts), self.count, self.sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            cumulative['+Inf' if bound == float('inf') else repr(bound)] = running
+        return {
+            'count': total,
+            'sum': value_sum,
+            'avg': value_sum / total if total else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': cumulative
+        }
+
+
+class RateMeter:
+    """Events per second over a sliding window of one-second slots"""
+
+    def __init__(self, window=60):
+        self.window = window
+        self.total = 0
+        self._slots = [0] * window
+        self._seconds = [0] * window
+        self._lock = threading.Lock()
+
+    def add(self, n=1, now=None):
+        second = int(now if now is not None else time.time())
+        i = second % self.window
+        with self._lock:
+            if self._seconds[i] != second:
+                self._seconds[i] = second
+                self._slots[i] = 0
+            self._slots[i] += n
+            self.total += n
+
+    def rate(self, now=None):
+        second = int(now if now is not None else time.time())
+        with self._lock:
+            recent = sum(n for s, n in zip(self._seconds, self._slots) if second - s < self.window)
+        return recent / self.window
+
+
+class Metrics:
+    """Registry of labelled counters, histograms, rate meters and gauges.
+
+    Labels are a tuple of strings; each series is created on first use, so
+    the hot path is one dict lookup plus an increment under a small lock.
+    Gauges are callables evaluated only when metrics are read.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._rates = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def _series(self, table, name, labels, factory):
+        key = (name, labels)
+        series = table.get(key)
+        if series is None:
+            with self._lock:
+                series = table.setdefault(key, factory())
+        return series
+
+    def inc(self, name, labels=(), n=1):
+        self._series(self._counters, name, labels, Counter).inc(n)
+
+    def histogram(self, name, labels=()):
+        return self._series(self._histograms, name, labels, Histogram)
+
+    def observe(self, name, value, labels=()):
+        self.histogram(name, labels).observe(value)
+
+    def rate(self, name, labels=()):
+        return self._series(self._rates, name, labels, RateMeter)
+
+    def gauge(self, name, fn):
+        """Register ``fn() -> number or {label: number}`` read at collection time"""
+        self._gauges[name] = fn
+
+    def timer(self, name, labels=()):
+        return _Timer(self.histogram(name, labels))
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _label_key(labels):
+        return ' '.join(labels) if labels else ''
+
+    def snapshot(self):
+        """Plain dict of every series, for the JSON endpoint"""
+        result = {'uptime_seconds': time.time() - self.started, 'counters': {},
+                  'histograms': {}, 'rates': {}, 'gauges': {}}
+        for (name, labels), counter in list(self._counters.items()):
+            result['counters'].setdefault(name, {})[self._label_key(labels)] = counter.value
+        for (name, labels), histogram in list(self._histograms.items()):
+            result['histograms'].setdefault(name, {})[self._label_key(labels)] = histogram.snapshot()
+        for (name, labels), meter in list(self._rates.items()):
+            result['rates'].setdefault(name, {})[self._label_key(labels)] = {
+                'per_second': meter.rate(),
+                'total': meter.total
+            }
+        for name, fn in list(self._gauges.items()):
+            try:
+                result['gauges'][name] = fn()
+            except Exception as e:
+                result['gauges'][name] = {'error': str(e)}
+        return result
+
+    def prometheus(self, label_names=None):
+        """Prometheus text exposition; ``label_names`` maps metric -> label names"""
+        label_names = label_names or {}
+        lines = []
+
+        def fmt(name, labels, extra=()):
+            names = label_names.get(name, ('label',) * len(labels))
+            pairs = list(zip(names, labels)) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        for (name, labels), counter in sorted(self._counters.items()):
+            lines.append(f'{name}{fmt(name, labels)} {counter.value}')
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            snap = histogram.snapshot()
+            for bound, count in snap['buckets'].items():
+                lines.append(f'{name}_bucket{fmt(name, labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_sum{fmt(name, labels)} {snap["sum"]}')
+            lines.append(f'{name}_count{fmt(name, labels)} {snap["count"]}')
+        for (name, labels), meter in sorted(self._rates.items()):
+            lines.append(f'{name}_per_second{fmt(name, labels)} {meter.rate()}')
+            lines.append(f'{name}_total{fmt(name, labels)} {meter.total}')
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                for label, v in value.items():
+                    lines.append(f'{name}{fmt(name, (label,))} {v}')
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
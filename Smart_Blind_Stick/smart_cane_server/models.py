@@ -1,11 +1,25 @@
 from datetime import datetime
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from app import db
+from config import Config
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL journaling for SQLite engines (no-op for other databases)"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}')
+        cursor.close()
 
 class SensorData(db.Model):
     __tablename__ = 'sensor_data'
     
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    device_id = db.Column(db.String(50), default='ESP32_001', index=True)
     front_distance = db.Column(db.Float)
     left_distance = db.Column(db.Float)
     right_distance = db.Column(db.Float)
@@ -17,6 +31,7 @@ class SensorData(db.Model):
         return {
             'id': self.id,
             'timestamp': self.timestamp.isoformat(),
+            'device_id': self.device_id,
             'front_distance': self.front_distance,
             'left_distance': self.left_distance,
             'right_distance': self.right_distance,
@@ -29,7 +44,8 @@ class AlertHistory(db.Model):
     __tablename__ = 'alert_history'
     
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    device_id = db.Column(db.String(50), default='ESP32_001', index=True)
     alert_type = db.Column(db.String(50))  # 'obstacle', 'hole', 'ground', 'low_battery'
     severity = db.Column(db.String(20))    # 'low', 'medium', 'high'
     distance = db.Column(db.Float)
@@ -40,6 +56,7 @@ class AlertHistory(db.Model):
         return {
             'id': self.id,
             'timestamp': self.timestamp.isoformat(),
+            'device_id': self.device_id,
             'alert_type': self.alert_type,
             'severity': self.severity,
             'distance': self.distance,
@@ -50,6 +67,8 @@ class AlertHistory(db.Model):
 class DeviceStatus(db.Model):
     __tablename__ = 'device_status'
     
+    __table_args__ = (db.Index('idx_status_device_timestamp', 'device_id', 'timestamp'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     device_id = db.Column(db.String(50), default='ESP32_001')
@@ -67,4 +86,65 @@ class DeviceStatus(db.Model):
             'battery_level': self.battery_level,
             'wifi_connected': self.wifi_connected,
             'last_seen': self.last_seen.isoformat() if self.last_seen else None
-        }
\ No newline at end of file
+        }
+
+class DeviceLatestStatus(db.Model):
+    """Latest status of each device, updated in place on every reading"""
+    __tablename__ = 'device_latest_status'
+    
+    device_id = db.Column(db.String(50), primary_key=True)
+    power_status = db.Column(db.Boolean, default=False)
+    battery_level = db.Column(db.Integer, default=100)
+    wifi_connected = db.Column(db.Boolean, default=False)
+    last_seen = db.Column(db.DateTime)
+    # Status as of the last device_status history row, to detect changes
+    logged_power_status = db.Column(db.Boolean)
+    logged_battery_level = db.Column(db.Integer)
+    logged_wifi_connected = db.Column(db.Boolean)
+    logged_at = db.Column(db.DateTime)
+    
+    def logged(self):
+        if self.logged_at is None:
+            return None
+        return {
+            'power_status': self.logged_power_status,
+            'battery_level': self.logged_battery_level,
+            'wifi_connected': self.logged_wifi_connected
+        }
+    
+    def to_dict(self):
+        return {
+            'device_id': self.device_id,
+            'power_status': self.power_status,
+            'battery_level': self.battery_level,
+            'wifi_connected': self.wifi_connected,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'changed_at': self.logged_at.isoformat() if self.logged_at else None
+        }
+
+class _SensorRollup:
+    """Columns shared by the per-minute and per-hour rollup tables"""
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), default='ESP32_001')
+    bucket = db.Column(db.DateTime, nullable=False)  # Start of the minute/hour
+    count = db.Column(db.Integer, default=0)
+    sum_front = db.Column(db.Float, default=0)
+    min_front = db.Column(db.Float)
+    max_front = db.Column(db.Float)
+    sum_left = db.Column(db.Float, default=0)
+    min_left = db.Column(db.Float)
+    max_left = db.Column(db.Float)
+    sum_right = db.Column(db.Float, default=0)
+    min_right = db.Column(db.Float)
+    max_right = db.Column(db.Float)
+    sum_ir = db.Column(db.Float, default=0)
+    min_ir = db.Column(db.Float)
+    max_ir = db.Column(db.Float)
+
+class SensorRollupMinute(_SensorRollup, db.Model):
+    __tablename__ = 'sensor_rollup_minute'
+    __table_args__ = (db.UniqueConstraint('device_id', 'bucket', name='uq_rollup_minute'),)
+
+class SensorRollupHour(_SensorRollup, db.Model):
+    __tablename__ = 'sensor_rollup_hour'
+    __table_args__ = (db.UniqueConstraint('device_id', 'bucket', name='uq_rollup_hour'),)
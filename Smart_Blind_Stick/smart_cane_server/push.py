@@ -0,0 +1,192 @@
+import asyncio
+import json
+import threading
+from collections import deque
+
+STREAM_CONTENT_TYPE = 'text/event-stream'
+
+
+def sse_frame(event, data, frame_id=None):
+    """One Server-Sent Events frame, serialized once and shared by all clients"""
+    head = f'id: {frame_id}\n' if frame_id is not None else ''
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'{head}event: {event}\ndata: {body}\n\n'.encode('utf-8')
+
+
+class _Client:
+    def __init__(self, max_queue, key=None):
+        self.max_queue = max_queue
+        self.key = key  # Only this key's deltas (None: every key)
+        self.frames = deque()
+        self.resync = True  # A new client starts from a snapshot
+        self.cond = threading.Condition()
+        self.wakeup = None  # Set by astream(): wakes its event loop from publishing threads
+
+    def notify(self):
+        """Wake whoever waits for this client (call with ``cond`` held)"""
+        self.cond.notify()
+        if self.wakeup is not None:
+            self.wakeup()
+
+
+class PushHub:
+    """Broadcast hub for dashboard streams.
+
+    ``publish(key, state)`` keeps the latest state per key (one per device)
+    and sends connected clients only the fields that changed, as a ``delta``
+    frame encoded once for everybody. Each client has a bounded queue; when
+    a slow client's queue overflows its pending frames are thrown away and
+    it gets a fresh ``snapshot`` of the latest states instead, so it skips
+    straight to the present rather than replaying stale updates.
+
+    ``subscribe(key)`` limits a client to one key: it only receives that
+    key's deltas (plus broadcasts) and its snapshot holds only that state.
+
+    ``emit(event, data)`` mirrors the Socket.IO call used by routes.py.
+    """
+
+    def __init__(self, max_queue=64, max_clients=256):
+        self.max_queue = max_queue
+        self.max_clients = max_clients
+        self.version = 0
+        self._states = {}
+        self._clients = set()
+        self._snapshot_frame = None  # (version, frame) shared by resyncing clients
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def queued_frames(self):
+        """Frames waiting in client queues, summed over clients"""
+        return sum(len(client.frames) for client in list(self._clients))
+
+    def _send(self, frame, key=None):
+        for client in list(self._clients):
+            if key is not None and client.key is not None and client.key != key:
+                continue
+            with client.cond:
+                if client.resync:
+                    continue  # Will get everything from the snapshot
+                if len(client.frames) >= client.max_queue:
+                    client.frames.clear()
+                    client.resync = True
+                else:
+                    client.frames.append(frame)
+                client.notify()
+
+    def publish(self, key, state):
+        """Record the latest ``state`` for ``key`` and push what changed"""
+        with self._lock:
+            previous = self._states.get(key, {})
+            changes = {k: v for k, v in state.items() if previous.get(k) != v}
+            if not changes:
+                return self.version
+            self.version += 1
+            self._states[key] = dict(state)
+            self._send(sse_frame('delta', {'key': key, 'v': self.version, 'changes': changes}, self.version), key)
+            return self.version
+
+    def broadcast(self, event, data):
+        """Push a one-off event (not kept for snapshots)"""
+        with self._lock:
+            self.version += 1
+            self._send(sse_frame(event, data, self.version))
+            return self.version
+
+    def emit(self, event, data):
+        if event == 'sensor_update' and 'device_id' in data:
+            return self.publish(data['device_id'], data)
+        return self.broadcast(event, data)
+
+    def forget(self, key=None):
+        """Drop stored state (all keys if ``key`` is None) and resync clients"""
+        with self._lock:
+            if key is None:
+                self._states.clear()
+            else:
+                self._states.pop(key, None)
+            self.version += 1
+            for client in list(self._clients):
+                with client.cond:
+                    client.frames.clear()
+                    client.resync = True
+                    client.notify()
+
+    def _snapshot(self, client):
+        """Snapshot frame for ``client``; called with the hub lock held"""
+        with client.cond:
+            client.frames.clear()
+            client.resync = False
+        if client.key is not None:
+            states = {client.key: self._states[client.key]} if client.key in self._states else {}
+            return sse_frame('snapshot', {'v': self.version, 'states': states}, self.version)
+        if self._snapshot_frame is None or self._snapshot_frame[0] != self.version:
+            frame = sse_frame('snapshot', {'v': self.version, 'states': self._states}, self.version)
+            self._snapshot_frame = (self.version, frame)
+        return self._snapshot_frame[1]
+
+    # ------------------------------------------------------------------
+    # Subscribers
+    # ------------------------------------------------------------------
+    def subscribe(self, key=None):
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                return None
+            client = _Client(self.max_queue, key)
+            self._clients.add(client)
+            return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def next_frames(self, client, timeout):
+        """Frames ready for ``client``; empty after ``timeout`` seconds idle"""
+        with client.cond:
+            client.cond.wait_for(lambda: client.resync or client.frames, timeout)
+            if not client.resync:
+                frames = list(client.frames)
+                client.frames.clear()
+                return frames
+        with self._lock:
+            return [self._snapshot(client)]
+
+    def stream(self, client, heartbeat=15):
+        """Generator of SSE bytes for ``client``, with keep-alive comments"""
+        try:
+            yield b'retry: 3000\n\n'
+            while True:
+                frames = self.next_frames(client, heartbeat)
+                yield b''.join(frames) if frames else b': ping\n\n'
+        finally:
+            self.unsubscribe(client)
+
+    async def astream(self, client, heartbeat=15):
+        """Async version of ``stream()`` for event loops: sleeps until a publisher wakes it"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def wakeup():
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass  # Loop already closed
+
+        client.wakeup = wakeup
+        try:
+            yield b'retry: 3000\n\n'
+            while True:
+                # Cleared before checking, so a frame queued after the check still sets it
+                ready.clear()
+                frames = self.next_frames(client, 0)
+                if frames:
+                    yield b''.join(frames)
+                    continue
+                try:
+                    await asyncio.wait_for(ready.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield b': ping\n\n'
+        finally:
+            client.wakeup = None
+            self.unsubscribe(client)
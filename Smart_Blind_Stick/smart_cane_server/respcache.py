@@ -0,0 +1,69 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+
+class EncodedPayload:
+    """A JSON body encoded once, plus its gzip form (compressed on first use)"""
+
+    __slots__ = ('body', '_gzipped')
+
+    def __init__(self, body):
+        self.body = body
+        self._gzipped = None
+
+    def gzipped(self, level):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=level, mtime=0)
+        return self._gzipped
+
+
+class ResponseCache:
+    """LRU of pre-encoded response bodies.
+
+    Keys carry the state version of the payload (see versions.py), so a
+    change in ingestion or settings makes the next request miss and
+    re-encode once; everyone after that gets the same bytes. ``clear()``
+    drops everything for changes that do not bump a version.
+    """
+
+    def __init__(self, encode, max_entries=256, gzip_min_bytes=1024, gzip_level=6):
+        self.encode = encode
+        self.max_entries = max_entries
+        self.gzip_min_bytes = gzip_min_bytes
+        self.gzip_level = gzip_level
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Encoded payload for ``key``, calling ``build()`` only on a miss"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+
+        payload = EncodedPayload(self.encode(build()))
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def body(self, payload, accept_gzip):
+        """``(bytes, content_encoding)`` to send for ``payload``"""
+        if accept_gzip and len(payload.body) >= self.gzip_min_bytes:
+            return payload.gzipped(self.gzip_level), 'gzip'
+        return payload.body, None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
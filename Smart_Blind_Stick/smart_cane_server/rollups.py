@@ -0,0 +1,100 @@
+from datetime import timedelta
+from sqlalchemy import func
+from app import db
+from models import SensorData, SensorRollupMinute, SensorRollupHour
+
+SENSORS = {
+    'front': 'front_distance',
+    'left': 'left_distance',
+    'right': 'right_distance',
+    'ir': 'ir_distance'
+}
+
+MINUTE = timedelta(minutes=1)
+HOUR = timedelta(hours=1)
+
+def floor_minute(ts):
+    return ts.replace(second=0, microsecond=0)
+
+def floor_hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def ceil_to(ts, floor, step):
+    start = floor(ts)
+    return start if start == ts else start + step
+
+def update_rollups(readings):
+    """Fold SensorData rows into the minute and hour rollups (no commit).
+
+    Readings are grouped per bucket first, so a batch touches each rollup
+    row once.
+    """
+    for model, floor in ((SensorRollupMinute, floor_minute), (SensorRollupHour, floor_hour)):
+        groups = {}
+        for reading in readings:
+            groups.setdefault((reading.device_id, floor(reading.timestamp)), []).append(reading)
+
+        for (device_id, bucket), rows in groups.items():
+            rollup = model.query.filter_by(device_id=device_id, bucket=bucket).first()
+            if rollup is None:
+                rollup = model(device_id=device_id, bucket=bucket, count=0)
+                for name in SENSORS:
+                    setattr(rollup, f'sum_{name}', 0)
+                db.session.add(rollup)
+
+            rollup.count += len(rows)
+            for name, field in SENSORS.items():
+                values = [getattr(r, field) or 0 for r in rows]
+                setattr(rollup, f'sum_{name}', getattr(rollup, f'sum_{name}') + sum(values))
+                low, high = getattr(rollup, f'min_{name}'), getattr(rollup, f'max_{name}')
+                setattr(rollup, f'min_{name}', min(values) if low is None else min(low, *values))
+                setattr(rollup, f'max_{name}', max(values) if high is None else max(high, *values))
+
+def _aggregate(model, time_column, start, end, device_id, raw=False):
+    """count/sum/min/max per sensor over [start, end) from one source"""
+    if raw:
+        columns = [func.count(model.id)]
+        for field in SENSORS.values():
+            column = getattr(model, field)
+            columns += [func.sum(column), func.min(column), func.max(column)]
+    else:
+        columns = [func.sum(model.count)]
+        for name in SENSORS:
+            columns += [
+                func.sum(getattr(model, f'sum_{name}')),
+                func.min(getattr(model, f'min_{name}')),
+                func.max(getattr(model, f'max_{name}'))
+            ]
+
+    query = db.session.query(*columns).filter(time_column >= start)
+    if end is not None:
+        query = query.filter(time_column < end)
+    if device_id is not None:
+        query = query.filter(model.device_id == device_id)
+    return query.one()
+
+def window_statistics(start, device_id=None):
+    """Statistics for readings since ``start``.
+
+    Whole hours come from the hour rollup, the partial first hour from the
+    minute rollup and only the partial first minute from raw rows.
+    """
+    first_minute = ceil_to(start, floor_minute, MINUTE)
+    first_hour = max(ceil_to(start, floor_hour, HOUR), first_minute)
+
+    parts = [
+        _aggregate(SensorData, SensorData.timestamp, start, first_minute, device_id, raw=True),
+        _aggregate(SensorRollupMinute, SensorRollupMinute.bucket, first_minute, first_hour, device_id),
+        _aggregate(SensorRollupHour, SensorRollupHour.bucket, first_hour, None, device_id),
+    ]
+
+    total = sum(part[0] or 0 for part in parts)
+    stats = {'count': total}
+    for i, name in enumerate(SENSORS):
+        sums = [part[1 + 3 * i] for part in parts if part[0]]
+        mins = [part[2 + 3 * i] for part in parts if part[0]]
+        maxs = [part[3 + 3 * i] for part in parts if part[0]]
+        stats[f'avg_{name}'] = sum(sums) / total if total else 0
+        stats[f'min_{name}'] = min(mins) if mins else None
+        stats[f'max_{name}'] = max(maxs) if maxs else None
+    return stats
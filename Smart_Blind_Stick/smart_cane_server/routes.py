@@ -1,79 +1,160 @@
+# SQL side of the server, loaded by app.py when DB_BACKEND is set. Ingested
+# readings are copied into the SQL tables by a write-behind writer
+# (store_readings, called by the ingest writer) and the routes below answer
+# from those tables. URLs app.py already serves (receive, mode, settings) are
+# only implemented there.
 from flask import jsonify, request
-from app import app, db, socketio
-from models import SensorData, AlertHistory, DeviceStatus
+from app import app, db, is_reader, metrics
+from models import SensorData, AlertHistory, DeviceStatus, DeviceLatestStatus
+from alerts import ALERT_KINDS, CLEAR
+from devices import DEFAULT_DEVICE_ID
+from rollups import update_rollups, window_statistics
+from status import status_changed
+from cursors import decode_cursor, encode_cursor
+from write_behind import WriteBehindQueue, BacklogFull
+from config import Config
+from database import db_instance
 from datetime import datetime, timedelta
-import json
-
-@app.route('/api/test', methods=['GET'])
-def test_api():
-    """Test API endpoint"""
-    return jsonify({
-        'status': 'success',
-        'message': 'Smart Cane API is working',
-        'timestamp': datetime.utcnow().isoformat()
-    })
-
-@app.route('/api/data/receive', methods=['POST'])
-def receive_data():
-    """Receive data from ESP32"""
+from sqlalchemy import and_, or_
+import atexit
+import heapq
+import logging
+
+log = logging.getLogger(__name__)
+
+# Severity stored in alert_history for each alert type
+ALERT_SEVERITY = {'danger': 'high', 'warning': 'medium', 'info': 'low'}
+
+with app.app_context():
     try:
-        data = request.json
-        
-        # Save sensor data
-        sensor_data = SensorData(
-            front_distance=data.get('front_distance', 0),
-            left_distance=data.get('left_distance', 0),
-            right_distance=data.get('right_distance', 0),
-            ir_distance=data.get('ir_distance', 0),
-            mode=data.get('mode', 1),
-            wifi_strength=data.get('wifi_strength', -50)
-        )
-        db.session.add(sensor_data)
-        
-        # Update device status
-        device_status = DeviceStatus(
-            power_status=data.get('power_status', False),
-            battery_level=data.get('battery_level', 100),
-            wifi_connected=data.get('wifi_connected', False),
-            last_seen=datetime.utcnow()
-        )
-        db.session.add(device_status)
-        
-        db.session.commit()
-        
-        # Prepare data for WebSocket
-        ws_data = {
-            'front_distance': sensor_data.front_distance,
-            'left_distance': sensor_data.left_distance,
-            'right_distance': sensor_data.right_distance,
-            'ir_distance': sensor_data.ir_distance,
-            'mode': sensor_data.mode,
-            'power_status': device_status.power_status,
-            'battery_level': device_status.battery_level,
-            'wifi_connected': device_status.wifi_connected,
-            'timestamp': sensor_data.timestamp.isoformat()
-        }
-        
-        # Emit to WebSocket clients
-        socketio.emit('sensor_update', ws_data)
-        
-        return jsonify({'status': 'success', 'message': 'Data received'})
-        
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        if Config.DB_BACKEND != 'sqlite' and not is_reader:
+            # Day-partitioned sensor_data/alert_history first: create_all() skips existing
+            # tables, but would create these two without partitions
+            db_instance.create_tables()
+        db.create_all()
+    except Exception:
+        log.exception("Could not create the SQL tables, SQL copies will fail until the database is up")
+
+def record_status(status):
+    """Update the device's latest-status row; append history only on change"""
+    latest = db.session.get(DeviceLatestStatus, status['device_id'])
+    if latest is None:
+        latest = DeviceLatestStatus(device_id=status['device_id'])
+        db.session.add(latest)
+    
+    latest.power_status = status['power_status']
+    latest.battery_level = status['battery_level']
+    latest.wifi_connected = status['wifi_connected']
+    latest.last_seen = status['last_seen']
+    
+    if status_changed(latest.logged(), status):
+        db.session.add(DeviceStatus(timestamp=status['last_seen'], **status))
+        latest.logged_power_status = status['power_status']
+        latest.logged_battery_level = status['battery_level']
+        latest.logged_wifi_connected = status['wifi_connected']
+        latest.logged_at = status['last_seen']
+
+def write_readings(items):
+    """Write a batch of buffered readings in one transaction"""
+    with app.app_context():
+        try:
+            readings = []
+            for item in items:
+                if 'alert' in item:
+                    db.session.add(AlertHistory(**item['alert']))
+                    continue
+                readings.append(SensorData(**item['sensor']))
+                record_status(item['status'])
+            db.session.add_all(readings)
+            
+            # Update minute/hour rollups in the same transaction
+            update_rollups(readings)
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+sensor_writer = WriteBehindQueue(
+    write_readings,
+    batch_size=Config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=Config.WRITE_BEHIND_FLUSH_INTERVAL,
+    max_backlog=Config.WRITE_BEHIND_MAX_BACKLOG,
+    put_timeout=0,  # Fed by the ingest writer, which must never wait for the database
+    name='sensor-writer',
+    on_flush=lambda seconds, count: metrics.observe('db_flush_seconds', seconds)
+).start()
+atexit.register(sensor_writer.close)
+metrics.gauge('db_write_backlog', sensor_writer.backlog)
+metrics.gauge('db_write_dropped', lambda: sensor_writer.dropped)
+
+# Drop expired day partitions and rows (same database as SQLALCHEMY_DATABASE_URI), in the writer process only
+retention_job = None if is_reader else db_instance.start_retention_job()
+
+def store_readings(device_id, readings, events=()):
+    """Queue ``(epoch, reading)`` pairs and their alert events for the SQL tables.
+
+    Runs on the ingest writer and never blocks: when the backlog is full
+    the rows are not copied (the on-disk log still has them) and counted.
+    Timestamps are stored as naive UTC like the rest of the SQL side.
+    """
+    items = []
+    for ts, reading in readings:
+        when = datetime.utcfromtimestamp(ts)
+        items.append({
+            'sensor': {
+                'device_id': device_id,
+                'timestamp': when,
+                'front_distance': reading['front_distance'],
+                'left_distance': reading['left_distance'],
+                'right_distance': reading['right_distance'],
+                'ir_distance': reading['ir_distance'],
+                'mode': reading['mode'],
+                'wifi_strength': reading.get('wifi_strength', -50)
+            },
+            'status': {
+                'device_id': device_id,
+                'power_status': reading['power_status'],
+                'battery_level': reading['battery_level'],
+                'wifi_connected': reading['wifi_connected'],
+                'last_seen': when
+            }
+        })
+    for event in events:
+        if event.kind == CLEAR:
+            continue
+        alert_type, location, _ = ALERT_KINDS[event.code]
+        items.append({'alert': {
+            'device_id': device_id,
+            'timestamp': datetime.utcfromtimestamp(event.ts),
+            'alert_type': alert_type,
+            'severity': ALERT_SEVERITY[alert_type],
+            'distance': event.value,
+            'location': location
+        }})
+    
+    for i, item in enumerate(items):
+        try:
+            sensor_writer.put(item)
+        except BacklogFull:
+            metrics.inc('db_write_rejected', n=len(items) - i)
+            log.warning("SQL write-behind backlog full, %d rows not copied", len(items) - i,
+                        extra={'device_id': device_id})
+            return
 
 @app.route('/api/data/statistics', methods=['GET'])
 def get_statistics():
     """Get statistics for dashboard"""
     hours = request.args.get('hours', 24, type=int)
+    device_id = request.args.get('device')
     time_limit = datetime.utcnow() - timedelta(hours=hours)
     
-    # Get data from database
-    data = SensorData.query.filter(
-        SensorData.timestamp >= time_limit
-    ).all()
+    # Combine pre-aggregated buckets, only the partial first minute is read raw
+    window = window_statistics(time_limit, device_id)
     
-    if not data:
+    if not window['count']:
         return jsonify({
             'avg_front': 0,
             'avg_left': 0,
@@ -82,95 +163,109 @@ def get_statistics():
             'total_readings': 0
         })
     
-    # Calculate statistics
+    # First/last reading are single index seeks on sensor_data.timestamp
+    readings = SensorData.query.filter(SensorData.timestamp >= time_limit)
+    if device_id:
+        readings = readings.filter(SensorData.device_id == device_id)
+    first = readings.order_by(SensorData.timestamp.asc()).first()
+    last = readings.order_by(SensorData.timestamp.desc()).first()
+    
     stats = {
-        'avg_front': sum(d.front_distance for d in data) / len(data),
-        'avg_left': sum(d.left_distance for d in data) / len(data),
-        'avg_right': sum(d.right_distance for d in data) / len(data),
-        'avg_ir': sum(d.ir_distance for d in data) / len(data),
-        'total_readings': len(data),
+        'avg_front': window['avg_front'],
+        'avg_left': window['avg_left'],
+        'avg_right': window['avg_right'],
+        'avg_ir': window['avg_ir'],
+        'min_front': window['min_front'],
+        'max_front': window['max_front'],
+        'total_readings': window['count'],
         'time_period_hours': hours,
-        'first_reading': data[0].timestamp.isoformat(),
-        'last_reading': data[-1].timestamp.isoformat()
+        'first_reading': first.timestamp.isoformat(),
+        'last_reading': last.timestamp.isoformat()
     }
     
     return jsonify(stats)
 
-@app.route('/api/device/mode', methods=['POST'])
-def set_device_mode():
-    """Set device operating mode"""
-    data = request.json
-    mode = data.get('mode', 1)
-    
-    # Here you would typically send this to the ESP32
-    # For now, we just log it
-    print(f"Setting device mode to: {mode}")
-    
-    # Update current data
-    from app import current_data
-    current_data['mode'] = mode
-    
-    # Emit mode change
-    socketio.emit('mode_change', {'mode': mode})
-    
-    return jsonify({'success': True, 'mode': mode})
+@app.route('/api/device/status', methods=['GET'])
+def get_device_status():
+    """Latest status of a device (primary-key lookup)"""
+    device_id = request.args.get('device', DEFAULT_DEVICE_ID)
+    latest = db.session.get(DeviceLatestStatus, device_id)
+    if latest is None:
+        return jsonify({'status': 'error', 'message': f'Unknown device: {device_id}'}), 404
+    return jsonify(latest.to_dict())
 
-@app.route('/api/settings', methods=['POST'])
-def save_settings():
-    """Save system settings"""
-    data = request.json
-    
-    # Save settings to database or file
-    settings = {
-        'danger_distance': data.get('danger_distance', 25),
-        'warn_distance': data.get('warn_distance', 50),
-        'safe_distance': data.get('safe_distance', 80),
-        'updated_at': datetime.utcnow().isoformat()
+# Merged log stream order: (timestamp, kind rank, id), newest first
+LOG_SOURCES = (
+    (0, 'sensor_data', SensorData),
+    (1, 'alert', AlertHistory)
+)
+LOG_PAGE_SIZE = 100
+LOG_PAGE_MAX = 500
+
+def _older_than(model, rank, cursor):
+    """Keyset condition: rows of ``model`` strictly after ``cursor`` in the stream"""
+    ts, cursor_rank, cursor_id = cursor
+    if rank < cursor_rank:
+        return model.timestamp <= ts
+    if rank > cursor_rank:
+        return model.timestamp < ts
+    return or_(model.timestamp < ts, and_(model.timestamp == ts, model.id < cursor_id))
+
+def _log_item(kind, row):
+    if kind == 'sensor_data':
+        message = f'Sensor data: F={row.front_distance}, L={row.left_distance}, R={row.right_distance}, IR={row.ir_distance}'
+    else:
+        message = f'Alert: {row.alert_type} ({row.severity}) at {row.location}'
+    return {
+        'type': kind,
+        'timestamp': row.timestamp.isoformat(),
+        'message': message,
+        'data': row.to_dict()
     }
-    
-    # Here you would typically save to database
-    # For now, we just return the settings
-    return jsonify({
-        'success': True,
-        'message': 'Settings saved',
-        'settings': settings
-    })
 
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    """Get system logs"""
+    """Get system logs, newest first.
+
+    Sensor rows and alerts are merged into one stream and paged with a
+    keyset cursor: pass the X-Next-Cursor response header back as ?cursor=.
+    """
     hours = request.args.get('hours', 24, type=int)
+    limit = min(request.args.get('limit', LOG_PAGE_SIZE, type=int), LOG_PAGE_MAX)
+    device_id = request.args.get('device')
     time_limit = datetime.utcnow() - timedelta(hours=hours)
     
-    logs = []
-    
-    # Get sensor data logs
-    sensor_data = SensorData.query.filter(
-        SensorData.timestamp >= time_limit
-    ).order_by(SensorData.timestamp.desc()).limit(100).all()
+    cursor = None
+    if request.args.get('cursor'):
+        try:
+            key = decode_cursor(request.args['cursor'])
+            time_limit = datetime.fromisoformat(key['from'])
+            cursor = (datetime.fromisoformat(key['ts']), key['rank'], key['id'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
     
-    for data in sensor_data:
-        logs.append({
-            'type': 'sensor_data',
-            'timestamp': data.timestamp.isoformat(),
-            'message': f'Sensor data: F={data.front_distance}, L={data.left_distance}, R={data.right_distance}, IR={data.ir_distance}',
-            'data': data.to_dict()
-        })
+    # One index-backed seek per table, at most limit + 1 rows each
+    streams = []
+    for rank, kind, model in LOG_SOURCES:
+        query = model.query.filter(model.timestamp >= time_limit)
+        if device_id:
+            query = query.filter(model.device_id == device_id)
+        if cursor is not None:
+            query = query.filter(_older_than(model, rank, cursor))
+        rows = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1).all()
+        streams.append([((row.timestamp, rank, row.id), kind, row) for row in rows])
     
-    # Get alert logs
-    alerts = AlertHistory.query.filter(
-        AlertHistory.timestamp >= time_limit
-    ).order_by(AlertHistory.timestamp.desc()).limit(50).all()
+    merged = list(heapq.merge(*streams, key=lambda item: item[0], reverse=True))
+    page = merged[:limit]
+    logs = [_log_item(kind, row) for _, kind, row in page]
     
-    for alert in alerts:
-        logs.append({
-            'type': 'alert',
-            'timestamp': alert.timestamp.isoformat(),
-            'message': f'Alert: {alert.alert_type} ({alert.severity}) at {alert.location}',
-            'data': alert.to_dict()
+    response = jsonify(logs)
+    if len(merged) > limit:
+        ts, rank, row_id = page[-1][0]
+        response.headers['X-Next-Cursor'] = encode_cursor({
+            'from': time_limit.isoformat(),
+            'ts': ts.isoformat(),
+            'rank': rank,
+            'id': row_id
         })
-    
-    # Sort logs by timestamp
-    logs.sort(key=lambda x: x['timestamp'], reverse=True)
-    
-    return jsonify(logs)
\ No newline at end of file
+    return response
\ No newline at end of file
@@ -2,33 +2,108 @@
 """
 File chạy server Flask
 Chạy: python run.py
+Nhiều tiến trình: python run.py --readers 3
+  (tiến trình này là writer ở cổng 5000, 3 reader ở cổng 5001-5003 đọc
+   trạng thái từ vùng nhớ chung; đặt một reverse proxy chia GET cho các reader)
+Chế độ asyncio: python run.py --async
+  (hàng nghìn kết nối keep-alive của gậy trên một lõi, xem aioserver.py)
+Chế độ debug của Flask (chỉ một tiến trình, không dùng khi mở ra mạng): FLASK_DEBUG=1 python run.py
 """
 
 import sys
 import os
+import argparse
+import subprocess
+import threading
 
 # Thêm thư mục hiện tại vào path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app
+parser = argparse.ArgumentParser(description='Server gậy thông minh')
+parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+parser.add_argument('--readers', type=int, default=0,
+                    help='số tiến trình chỉ đọc chạy kèm (dùng vùng nhớ chung)')
+parser.add_argument('--async', dest='use_async', action='store_true',
+                    help='phục vụ bằng asyncio (aioserver.py) thay cho server của Flask')
+parser.add_argument('--idle-timeout', type=float, default=15.0,
+                    help='giây giữ kết nối keep-alive rảnh (chế độ asyncio)')
+parser.add_argument('--max-connections', type=int, default=10000,
+                    help='số kết nối tối đa (chế độ asyncio)')
+args = parser.parse_args()
+
+if args.readers:
+    os.environ['SHARED_STATE_ROLE'] = 'writer'
+
+# Log có cấu trúc (JSON mỗi dòng), ghi bởi thread nền; cấu hình qua LOG_LEVEL/LOG_FORMAT/LOG_SAMPLE_RATE
+from logs import setup_logging
+setup_logging()
+
+from app import app, load_data, auto_save, is_reader
+from config import Config
+
+def start_readers(count, writer_port):
+    """Chạy `count` tiến trình reader ở các cổng ngay sau cổng writer"""
+    processes = []
+    for i in range(1, count + 1):
+        env = dict(os.environ, SHARED_STATE_ROLE='reader',
+                   WRITER_URL=f'http://localhost:{writer_port}')
+        command = [sys.executable, os.path.abspath(__file__), '--port', str(writer_port + i)]
+        if args.use_async:
+            command.append('--async')
+        processes.append(subprocess.Popen(command, env=env))
+    return processes
+
+def serve_async(port):
+    """Chạy server asyncio: nhận dữ liệu, SSE và chờ long-poll trên event loop, các route khác qua Flask"""
+    from aioserver import AsyncHTTPServer
+    from app import LONG_POLL_VERSIONS, long_poll_handler, metrics, receive_data_async, stream_async
+    
+    routes = {('GET', '/api/stream'): stream_async}
+    if not is_reader:
+        # Reader để Flask trả 307 về writer như chế độ thường
+        routes[('POST', '/api/data/receive')] = receive_data_async
+    server = AsyncHTTPServer(app, routes, port=port, idle_timeout=args.idle_timeout,
+                             max_connections=args.max_connections)
+    # Long-poll chờ trên event loop, chỉ chiếm thread WSGI khi đã có câu trả lời
+    for path, version_of in LONG_POLL_VERSIONS.items():
+        server.routes[('GET', path)] = long_poll_handler(version_of, server.wsgi)
+    metrics.gauge('aio_connections', lambda: server.active)
+    metrics.gauge('aio_timeouts', lambda: server.timeouts)
+    metrics.gauge('aio_rejected', lambda: server.rejected)
+    server.run()
 
 if __name__ == '__main__':
     print("=" * 60)
-    print("🚀 KHỞI ĐỘNG SERVER GẬY THÔNG MINH")
+    print("🚀 KHỞI ĐỘNG SERVER GẬY THÔNG MINH" + (" (reader)" if is_reader else ""))
     print("=" * 60)
     print("📌 Lưu ý:")
-    print("  • Server sẽ chạy tại: http://localhost:5000")
+    print(f"  • Server sẽ chạy tại: http://localhost:{args.port}")
     print("  • Để dừng server: Nhấn Ctrl+C")
     print("  • Đảm bảo ESP32 cùng mạng WiFi với máy này")
     print("=" * 60)
-    
+
+    readers = []
+    if not is_reader:
+        # Tải dữ liệu và khởi động thread gộp log (chỉ tiến trình writer)
+        load_data()
+        threading.Thread(target=auto_save, daemon=True).start()
+        readers = start_readers(args.readers, args.port)
+
     try:
-        app.run(
-            host='0.0.0.0',
-            port=5000,
-            debug=True,
-            use_reloader=False
-        )
+        if args.use_async:
+            serve_async(args.port)
+        else:
+            app.run(
+                host='0.0.0.0',
+                port=args.port,
+                # debug chỉ khi bật FLASK_DEBUG=1 và chạy một tiến trình
+                debug=Config.DEBUG and not (args.readers or is_reader),
+                use_reloader=False,
+                threaded=True
+            )
     except KeyboardInterrupt:
         print("\n👋 Đang tắt server...")
-        print("✅ Server đã dừng")
\ No newline at end of file
+        print("✅ Server đã dừng")
+    finally:
+        for process in readers:
+            process.terminate()
@@ -0,0 +1,415 @@
+import json
+import struct
+import threading
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+from alerts import CLEAR, LATE, RAISE, RENOTIFY, Alert, AlertEvent, AlertTracker
+from devices import DeviceSnapshot
+from history import DISTANCE_FIELDS, HistoryBuffer
+
+MAGIC = b'SCSS'
+LAYOUT_VERSION = 2
+
+# magic, layout, max_devices, history_rows, event_rows, device_count,
+# state_version, settings_seq, settings_version, settings_len
+_HEADER = struct.Struct('<4sIIIIIQQQI')
+SETTINGS_BYTES = 4096
+
+# seq, device_id, version, history_count, distances, mode, power_status,
+# battery_level, wifi_connected, last_update, alert_mask, active_count,
+# history_len, event_len, history_head, event_head
+_SLOT_HEAD = struct.Struct('<Q32sQQ4diBiB32sBBIIII')
+_ACTIVE = struct.Struct('<Bdd')  # code, value, raised ts
+MAX_ACTIVE = 4                   # one per alert location
+_HISTORY_WIDTHS = (8,) + (8,) * len(DISTANCE_FIELDS) + (2, 1)  # ts, distances, mode, alert mask
+_EVENT_WIDTHS = (1, 8, 8, 1)                                   # code, value, ts, kind
+_ROW_BYTES = sum(_HISTORY_WIDTHS)
+_EVENT_BYTES = sum(_EVENT_WIDTHS)
+_STATE_BYTES = _SLOT_HEAD.size + MAX_ACTIVE * _ACTIVE.size  # Slot prefix without history/events
+
+EVENT_KINDS = (RAISE, CLEAR, RENOTIFY, LATE)
+
+
+class SharedStateFull(Exception):
+    """Every device slot is taken; the segment must be recreated with more slots"""
+
+
+class SharedState:
+    """Latest state and recent history of every device in one shared memory segment.
+
+    The writer process (the one running the ingest core) owns the segment
+    and rewrites a device's fixed-size slot after each change; any number of
+    worker processes attach to it and serve reads. Each slot and the
+    settings block are guarded by a seqlock: the writer makes the sequence
+    number odd, writes, then makes it even again. A reader copies the slot,
+    and if the sequence number was odd or moved in the meantime it retries.
+    Readers never block the writer and never see a torn slot.
+
+    A slot holds the current reading, active alerts, the ``history_rows``
+    most recent readings and the ``event_rows`` most recent alert events.
+    Readings and events are rings with a head index: a write copies only
+    the rows and events appended since the slot's last write (counted by
+    ``HistoryBuffer.appended`` and ``AlertTracker.appended``) and rewrites
+    the whole ring only after anything else changed (a late insert, a trim).
+    The writer ``reserve()``s a slot before it accepts a new device's data
+    and keeps it for the segment's lifetime; once ``max_devices`` slots are
+    taken new devices get ``SharedStateFull`` rather than being left out of
+    what the readers serve.
+    """
+
+    def __init__(self, name, max_devices=64, history_rows=4096, event_rows=256, create=False):
+        self.name = name
+        self.history_rows = history_rows
+        self.event_rows = event_rows
+        self.max_devices = max_devices
+        self._slot_size = _STATE_BYTES + history_rows * _ROW_BYTES + event_rows * _EVENT_BYTES
+        self._slots_offset = _HEADER.size + SETTINGS_BYTES
+        self._slot_of = {}  # device_id -> slot index
+        self._written = {}  # Writer: slot index -> _RingState of each ring at its last write
+        self._views = {}    # device_id -> SharedDeviceView of the latest version read
+        self._lock = threading.Lock()
+        if create:
+            self._create()
+        else:
+            self._attach()
+        self._buf = self._shm.buf
+
+    def _create(self):
+        size = self._slots_offset + self.max_devices * self._slot_size
+        try:
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        self._owner = True
+        _HEADER.pack_into(self._shm.buf, 0, MAGIC, LAYOUT_VERSION, self.max_devices,
+                          self.history_rows, self.event_rows, 0, 0, 0, 0, 0)
+
+    def _attach(self):
+        self._shm = shared_memory.SharedMemory(self.name)
+        self._owner = False
+        # Only the writer may unlink the segment when it exits
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        magic, layout, self.max_devices, self.history_rows, self.event_rows = \
+            _HEADER.unpack_from(self._shm.buf, 0)[:5]
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            self._shm.close()
+            raise ValueError(f'{self.name} is not a compatible shared state segment')
+        self._slot_size = _STATE_BYTES + self.history_rows * _ROW_BYTES + self.event_rows * _EVENT_BYTES
+
+    @classmethod
+    def attach(cls, name, timeout=30.0):
+        """Attach to the writer's segment, waiting up to ``timeout`` seconds for it to appear"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return cls(name)
+            except FileNotFoundError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    # ------------------------------------------------------------------
+    # Header
+    # ------------------------------------------------------------------
+    def _header(self):
+        return _HEADER.unpack_from(self._buf, 0)
+
+    def _set_header(self, **fields):
+        values = dict(zip(('magic', 'layout', 'max_devices', 'history_rows', 'event_rows',
+                           'device_count', 'state_version', 'settings_seq', 'settings_version',
+                           'settings_len'), self._header()))
+        values.update(fields)
+        _HEADER.pack_into(self._buf, 0, *values.values())
+
+    def state_version(self):
+        """Version of the last change the writer published"""
+        return self._header()[6]
+
+    def device_count(self):
+        return self._header()[5]
+
+    # ------------------------------------------------------------------
+    # Writer side
+    # ------------------------------------------------------------------
+    def _slot_offset(self, index):
+        return self._slots_offset + index * self._slot_size
+
+    def reserve(self, device_id):
+        """Slot index of ``device_id``, assigning a free one on first use"""
+        index = self._slot_of.get(device_id)
+        if index is None:
+            if len(device_id.encode('utf-8')) > 32:
+                raise ValueError(f'device id too long for shared state: {device_id}')
+            index = len(self._slot_of)
+            if index >= self.max_devices:
+                raise SharedStateFull(f'shared state is full ({self.max_devices} devices)')
+            self._slot_of[device_id] = index
+        return index
+
+    def write_device(self, shard, state_version):
+        """Publish ``shard`` (call with its lock held) as of ``state_version``"""
+        index = self.reserve(shard.device_id)
+        device_id = shard.device_id.encode('utf-8')
+        offset = self._slot_offset(index)
+        buf = self._buf
+        seq = struct.unpack_from('<Q', buf, offset)[0]
+        struct.pack_into('<Q', buf, offset, seq + 1)  # Odd: write in progress
+
+        history_ring, event_ring = self._written.get(index) or (None, None)
+        history_ring = self._write_history(offset + _STATE_BYTES, shard.history, history_ring)
+        event_ring = self._write_events(offset + _STATE_BYTES + self.history_rows * _ROW_BYTES,
+                                        shard.alerts, event_ring)
+        self._written[index] = (history_ring, event_ring)
+
+        current = shard.current
+        active = shard.alerts.active_alerts(current)[:MAX_ACTIVE]
+        _SLOT_HEAD.pack_into(
+            buf, offset, seq + 1, device_id, shard.version, len(shard.history),
+            *(float(current[field]) for field in DISTANCE_FIELDS),
+            int(current['mode']), bool(current['power_status']), int(current['battery_level']),
+            bool(current['wifi_connected']), (current['last_update'] or '').encode('ascii'),
+            current['alert_mask'], len(active), history_ring.length, event_ring.length,
+            history_ring.head, event_ring.head
+        )
+        position = offset + _SLOT_HEAD.size
+        for alert in active:
+            _ACTIVE.pack_into(buf, position, alert.code, alert.value, alert.ts)
+            position += _ACTIVE.size
+
+        struct.pack_into('<Q', buf, offset, seq + 2)  # Even: consistent again
+        self._set_header(state_version=max(state_version, self.state_version()),
+                         device_count=max(index + 1, self.device_count()))
+
+    def _write_history(self, base, history, ring):
+        new = ring.new_rows(history, self.history_rows) if ring is not None else None
+        if new is None:
+            ring = _RingState(history)
+            new = min(len(history), self.history_rows)
+        ts, columns, mode, alert_mask = history.tail(new)
+        self._write_ring(base, self.history_rows, _HISTORY_WIDTHS, ring.head,
+                         [ts] + [columns[f] for f in DISTANCE_FIELDS] + [mode, alert_mask])
+        return ring.advance(history, new, self.history_rows, len(history))
+
+    def _write_events(self, base, alerts, ring):
+        new = ring.new_rows(alerts, self.event_rows) if ring is not None else None
+        if new is None:
+            ring = _RingState(alerts)
+            new = min(len(alerts.events), self.event_rows)
+        events = alerts.events
+        events = [events[i] for i in range(len(events) - new, len(events))]
+        self._write_ring(base, self.event_rows, _EVENT_WIDTHS, ring.head, [
+            array('B', [e.code for e in events]),
+            array('d', [e.value for e in events]),
+            array('d', [e.ts for e in events]),
+            array('B', [EVENT_KINDS.index(e.kind) for e in events]),
+        ])
+        return ring.advance(alerts, new, self.event_rows, len(alerts.events))
+
+    def _write_ring(self, base, rows, widths, head, columns):
+        """Write the same new rows of every column into its ring region, starting at ``head``"""
+        buf = self._buf
+        for column, width in zip(columns, widths):
+            data = column.tobytes()
+            first = min(len(column), rows - head) * width
+            start = base + head * width
+            buf[start:start + first] = data[:first]
+            buf[base:base + len(data) - first] = data[first:]
+            base += rows * width
+
+    def write_settings(self, settings, version):
+        data = json.dumps(settings, ensure_ascii=False).encode('utf-8')
+        if len(data) > SETTINGS_BYTES:
+            raise ValueError('settings too large for shared state')
+        seq = self._header()[7]
+        self._set_header(settings_seq=seq + 1)
+        self._buf[_HEADER.size:_HEADER.size + len(data)] = data
+        self._set_header(settings_seq=seq + 2, settings_version=version, settings_len=len(data))
+
+    # ------------------------------------------------------------------
+    # Reader side
+    # ------------------------------------------------------------------
+    def settings(self):
+        """(settings dict, settings version) under the seqlock"""
+        while True:
+            header = self._header()
+            seq, version, length = header[7], header[8], header[9]
+            data = bytes(self._buf[_HEADER.size:_HEADER.size + length])
+            if seq % 2 == 0 and self._header()[7] == seq:
+                return (json.loads(data) if data else {}), version
+            time.sleep(0)
+
+    def _find_slot(self, device_id):
+        index = self._slot_of.get(device_id)
+        if index is not None:
+            return index
+        target = device_id.encode('utf-8')
+        for index in range(self.device_count()):
+            offset = self._slot_offset(index) + 8
+            if bytes(self._buf[offset:offset + 32]).rstrip(b'\0') == target:
+                with self._lock:
+                    self._slot_of[device_id] = index
+                return index
+        return None
+
+    def _read_slot(self, index, size=None):
+        """Consistent copy of the first ``size`` bytes of slot ``index`` (retries while the writer is in it)"""
+        offset = self._slot_offset(index)
+        size = size or self._slot_size
+        while True:
+            seq = struct.unpack_from('<Q', self._buf, offset)[0]
+            if seq % 2 == 0:
+                data = bytes(self._buf[offset:offset + size])
+                if struct.unpack_from('<Q', self._buf, offset)[0] == seq:
+                    return data
+            time.sleep(0)
+
+    def _snapshot_from(self, data):
+        (_, device_id, version, history_count, front, left, right, ir, mode, power, battery,
+         wifi, last_update, mask, active_count, history_len, event_len,
+         history_head, event_head) = _SLOT_HEAD.unpack_from(data)
+        current = {
+            'front_distance': front, 'left_distance': left,
+            'right_distance': right, 'ir_distance': ir,
+            'mode': mode, 'power_status': bool(power), 'battery_level': battery,
+            'wifi_connected': bool(wifi),
+            'last_update': last_update.rstrip(b'\0').decode('ascii') or None,
+            'alert_mask': mask
+        }
+        active = tuple(Alert(*_ACTIVE.unpack_from(data, _SLOT_HEAD.size + i * _ACTIVE.size))
+                       for i in range(active_count))
+        snapshot = DeviceSnapshot(device_id.rstrip(b'\0').decode('utf-8'), version, current,
+                                  active, history_count)
+        return snapshot, history_len, event_len, history_head, event_head
+
+    def version_of(self, device_id):
+        """Published version of ``device_id`` (0 if unknown), without copying the slot"""
+        index = self._find_slot(device_id)
+        if index is None:
+            return 0
+        return struct.unpack_from('<Q', self._buf, self._slot_offset(index) + 8 + 32)[0]
+
+    def snapshot(self, device_id):
+        index = self._find_slot(device_id)
+        if index is None:
+            return None
+        return self._snapshot_from(self._read_slot(index, _STATE_BYTES))[0]
+
+    def snapshots(self):
+        snapshots = [self._snapshot_from(self._read_slot(i, _STATE_BYTES))[0]
+                     for i in range(self.device_count())]
+        return [s for s in snapshots if s.device_id]  # Reserved slots not yet written are empty
+
+    def view(self, device_id):
+        """Read-only shard-like view (history + alert events) of ``device_id``, cached per version"""
+        index = self._find_slot(device_id)
+        if index is None:
+            return None
+        cached = self._views.get(device_id)
+        if cached is not None and cached.version == self.version_of(device_id):
+            return cached
+        view = SharedDeviceView(self, self._read_slot(index))
+        with self._lock:
+            self._views[device_id] = view
+        return view
+
+    def watch(self, on_change, interval=0.05):
+        """Background thread calling ``on_change()`` whenever the writer publishes"""
+        def run():
+            seen = (self.state_version(), self._header()[8])
+            while self._buf is not None:
+                time.sleep(interval)
+                header = self._header()
+                now = (header[6], header[8])
+                if now != seen:
+                    seen = now
+                    on_change()
+
+        thread = threading.Thread(target=run, name='shared-state-watch', daemon=True)
+        thread.start()
+        return thread
+
+
+class _RingState:
+    """Writer-side record of one ring: what it was last filled from and where its head is"""
+
+    __slots__ = ('source', 'edits', 'appended', 'head', 'length')
+
+    def __init__(self, source):
+        self.source = source
+        self.edits = source.edits
+        self.appended = source.appended
+        self.head = 0
+        self.length = 0
+
+    def new_rows(self, source, rows):
+        """Rows appended to ``source`` since the last write, None if the ring must be rebuilt"""
+        if source is not self.source or source.edits != self.edits:
+            return None
+        new = source.appended - self.appended
+        return new if new <= rows else None
+
+    def advance(self, source, new, rows, size):
+        """Account for ``new`` rows written at the head; ``size`` is the source's current length"""
+        self.appended = source.appended
+        self.head = (self.head + new) % rows
+        self.length = min(self.length + new, rows, size)
+        return self
+
+
+class SharedDeviceView:
+    """Immutable device state rebuilt from a shared memory slot.
+
+    Has the attributes request handlers use on a DeviceShard: ``history``
+    (a HistoryBuffer of the recent rows), ``alerts`` (with the recent
+    events), ``current``, ``version`` and an uncontended ``lock``.
+    """
+
+    def __init__(self, state, data):
+        snapshot, history_len, event_len, history_head, event_head = state._snapshot_from(data)
+        self.snapshot = snapshot
+        self.device_id = snapshot.device_id
+        self.version = snapshot.version
+        self.current = dict(snapshot.current)
+        self.lock = threading.Lock()
+
+        position = _STATE_BYTES
+
+        def ring(rows, length, head, widths, typecodes):
+            """Columns of a ring region, unrolled oldest first"""
+            nonlocal position
+            start = (head - length) % rows
+            columns = []
+            for width, typecode in zip(widths, typecodes):
+                region = data[position:position + rows * width]
+                if start + length <= rows:
+                    chunk = region[start * width:(start + length) * width]
+                else:
+                    chunk = region[start * width:] + region[:head * width]
+                values = array(typecode)
+                values.frombytes(chunk)
+                columns.append(values)
+                position += rows * width
+            return columns
+
+        rows = state.history_rows
+        ts, *distances, mode, alert_mask = ring(rows, history_len, history_head, _HISTORY_WIDTHS,
+                                                'd' * (1 + len(DISTANCE_FIELDS)) + 'hB')
+        self.history = HistoryBuffer.from_columns(rows, ts, dict(zip(DISTANCE_FIELDS, distances)),
+                                                  mode, alert_mask)
+
+        events = state.event_rows
+        codes, values, times, kinds = ring(events, event_len, event_head, _EVENT_WIDTHS, 'BddB')
+        self.alerts = AlertTracker(events)
+        self.alerts.events.extend(AlertEvent(c, v, t, EVENT_KINDS[k])
+                                  for c, v, t, k in zip(codes, values, times, kinds))
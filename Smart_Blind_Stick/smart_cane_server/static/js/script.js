@@ -28,29 +28,50 @@ let chartData = {
     ]
 };
 
-// Initialize Socket.IO connection
+// Server-Sent Events stream: a snapshot on connect, then only changed fields.
+// The stream is per device (?device=), picked with #device-select or the page's ?device=
+const DEFAULT_DEVICE_ID = 'ESP32_001';
+let deviceId = new URLSearchParams(window.location.search).get('device') || DEFAULT_DEVICE_ID;
+let deviceState = null;
+
+function deviceQuery() {
+    return `device=${encodeURIComponent(deviceId)}`;
+}
+
+function applyState(data) {
+    updateSensorDisplay(data);
+    updateChart(data);
+    updateHistory(data);
+    updateAlerts(data.alerts || []);
+}
+
 function initSocket() {
-    socket = io();
+    if (socket) socket.close();
+    socket = new EventSource(`/api/stream?${deviceQuery()}`);
 
-    socket.on('connect', function () {
+    socket.onopen = function () {
         console.log('Connected to server');
         updateStatus('connected');
-    });
+    };
 
-    socket.on('sensor_update', function (data) {
-        updateSensorDisplay(data);
-        updateChart(data);
-        updateHistory(data);
+    socket.addEventListener('snapshot', function (event) {
+        const message = JSON.parse(event.data);
+        deviceState = message.states[deviceId] || null;
+        if (deviceState) applyState(deviceState);
     });
 
-    socket.on('alerts', function (alerts) {
-        updateAlerts(alerts);
+    socket.addEventListener('delta', function (event) {
+        const message = JSON.parse(event.data);
+        if (message.key !== deviceId) return;
+        deviceState = Object.assign(deviceState || {}, message.changes);
+        applyState(deviceState);
     });
 
-    socket.on('disconnect', function () {
+    socket.onerror = function () {
+        // EventSource reconnects by itself
         console.log('Disconnected from server');
         updateStatus('disconnected');
-    });
+    };
 }
 
 // Update sensor display
@@ -282,11 +303,53 @@ function updateStatus(status) {
     }
 }
 
+// Fill the device picker from the devices the server has seen
+async function loadDevices() {
+    const select = document.getElementById('device-select');
+    if (!select) return;
+    try {
+        const response = await fetch('/api/devices');
+        const result = await response.json();
+        const ids = result.devices.map(device => device.device_id);
+        if (!ids.includes(deviceId)) ids.unshift(deviceId);
+
+        select.innerHTML = '';
+        ids.forEach(id => {
+            const option = document.createElement('option');
+            option.value = id;
+            option.textContent = id;
+            option.selected = id === deviceId;
+            select.appendChild(option);
+        });
+    } catch (error) {
+        console.error('Error loading devices:', error);
+    }
+}
+
+// Switch the dashboard to another device
+function selectDevice(id) {
+    deviceId = id;
+    deviceState = null;
+    initSocket();
+    loadHistoryData();
+    loadCurrentData();
+}
+
+function loadCurrentData() {
+    fetch(`/api/data/current?${deviceQuery()}`)
+        .then(response => response.json())
+        .then(result => {
+            if (result.success) updateSensorDisplay(result.data);
+        })
+        .catch(error => console.error('Error loading initial data:', error));
+}
+
 // Load historical data
 async function loadHistoryData() {
     try {
-        const response = await fetch('/api/data/history?hours=1');
-        const data = await response.json();
+        const response = await fetch(`/api/data/history?hours=1&${deviceQuery()}`);
+        const result = await response.json();
+        const data = result.data || [];
 
         // Populate history table
         const table = document.getElementById('history-table');
@@ -327,11 +390,19 @@ function setupEventListeners() {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ mode: parseInt(mode) })
+                body: JSON.stringify({ mode: parseInt(mode), device_id: deviceId })
             });
         });
     });
 
+    // Device picker
+    const deviceSelect = document.getElementById('device-select');
+    if (deviceSelect) {
+        deviceSelect.addEventListener('change', function () {
+            selectDevice(this.value);
+        });
+    }
+
     // Save settings button
     document.getElementById('save-settings').addEventListener('click', function () {
         const dangerDist = document.getElementById('danger-dist').value;
@@ -360,6 +431,7 @@ function setupEventListeners() {
 document.addEventListener('DOMContentLoaded', function () {
     initSocket();
     initChart();
+    loadDevices();
     loadHistoryData();
     setupEventListeners();
 
@@ -367,8 +439,5 @@ document.addEventListener('DOMContentLoaded', function () {
     setInterval(updateCurrentTime, 1000);
 
     // Load initial data
-    fetch('/api/data/current')
-        .then(response => response.json())
-        .then(data => updateSensorDisplay(data))
-        .catch(error => console.error('Error loading initial data:', error));
+    loadCurrentData();
 });
\ No newline at end of file
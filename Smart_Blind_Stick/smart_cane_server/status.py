@@ -0,0 +1,25 @@
+# Battery levels (%) whose crossing is always recorded in the status history
+BATTERY_THRESHOLDS = (50, 20, 10, 5)
+# Otherwise a history row is written once the battery moved this much (%)
+BATTERY_STEP = 5
+
+STATUS_FLAGS = ('power_status', 'wifi_connected')
+
+
+def _band(level):
+    return sum(1 for threshold in BATTERY_THRESHOLDS if level <= threshold)
+
+
+def status_changed(logged, status):
+    """Whether ``status`` differs enough from the last logged status to record it.
+
+    ``logged`` is the last status written to the history (None if there is
+    none). Flag flips, battery threshold crossings and battery moves of at
+    least BATTERY_STEP count; the battery jitter between them does not.
+    """
+    if logged is None:
+        return True
+    if any(bool(logged[flag]) != bool(status[flag]) for flag in STATUS_FLAGS):
+        return True
+    old, new = logged['battery_level'], status['battery_level']
+    return _band(old) != _band(new) or abs(new - old) >= BATTERY_STEP
@@ -0,0 +1,395 @@
+import json
+import os
+import re
+import shutil
+import threading
+
+SEGMENT_PATTERN = re.compile(r'^seg-(\d{8})-(\d{8})\.ndjson$')
+DAY_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+MIGRATION_DIR = '.migrate'  # Staging area while flat segments move into day partitions
+
+
+def _write_synced(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SegmentedLog:
+    """Append-only newline-delimited JSON log split into rotating segments.
+
+    Each record is one line in the active segment. When the active segment
+    grows past ``segment_max_bytes`` it is sealed and a new one is opened.
+    Sealed segments are merged by ``compact()``; a merged file is named after
+    the range of segments it covers, so leftovers from an interrupted
+    compaction are detected and removed on the next ``open()``.
+
+    Merges are size-tiered: a file covering ``compact_min_segments ** n``
+    segments is at tier ``n``, and only a run of ``compact_min_segments``
+    files of the same tier is merged. Each record is rewritten once per
+    tier, not once per compaction.
+    """
+
+    def __init__(self, directory, segment_max_bytes=1024 * 1024,
+                 compact_min_segments=8, fsync=False):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_min_segments = compact_min_segments
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._maintenance_lock = threading.Lock()
+        self._segments = []  # [(first, last)] sorted, last one is active
+        self._active = None
+        self._active_size = 0
+
+    # ------------------------------------------------------------------
+    # Segment bookkeeping
+    # ------------------------------------------------------------------
+    def _path(self, first, last):
+        return os.path.join(self.directory, f'seg-{first:08d}-{last:08d}.ndjson')
+
+    def _scan(self):
+        """List segment ranges on disk, dropping ones covered by a merged file"""
+        ranges = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                ranges.append((int(match.group(1)), int(match.group(2))))
+            elif name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+        ranges.sort(key=lambda r: (r[0], -r[1]))
+        kept = []
+        for first, last in ranges:
+            if kept and last <= kept[-1][1]:
+                # Covered by a merged file: leftover of an interrupted compaction
+                os.remove(self._path(first, last))
+                continue
+            kept.append((first, last))
+        return kept
+
+    def _open_active(self, index):
+        self._segments.append((index, index))
+        path = self._path(index, index)
+        self._active = open(path, 'a', encoding='utf-8')
+        self._active_size = self._active.tell()
+
+    def open(self):
+        """Open the log directory and the active segment for appending"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._segments = self._scan()
+            if self._segments:
+                first, last = self._segments.pop()
+                if first == last:
+                    self._open_active(last)
+                else:
+                    self._segments.append((first, last))
+                    self._open_active(last + 1)
+            else:
+                self._open_active(1)
+
+    def close(self):
+        with self._lock:
+            if self._active:
+                self._sync()
+                self._active.close()
+                self._active = None
+
+    def _sync(self):
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+
+    def _rotate(self):
+        self._sync()
+        self._active.close()
+        self._open_active(self._segments[-1][1] + 1)
+
+    # ------------------------------------------------------------------
+    # Append / read
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def append(self, record):
+        """Append one record as a single line"""
+        self.append_many((record,))
+
+    def append_many(self, records):
+        """Append several records with one write"""
+        chunk = ''.join(self._encode(r) for r in records)
+        if not chunk:
+            return
+        with self._lock:
+            self._active.write(chunk)
+            self._sync()
+            self._active_size += len(chunk.encode('utf-8'))
+            if self._active_size >= self.segment_max_bytes:
+                self._rotate()
+
+    def flush(self):
+        with self._lock:
+            if self._active:
+                self._sync()
+
+    def read_all(self):
+        """Yield every record in append order"""
+        with self._lock:
+            if self._active:
+                self._active.flush()
+            paths = [self._path(first, last) for first, last in self._segments]
+
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # Torn last line from an unclean shutdown
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+
+    def segment_count(self):
+        with self._lock:
+            return len(self._segments)
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+    def _write_merged(self, first, last, lines):
+        tmp_path = self._path(first, last) + '.tmp'
+        _write_synced(tmp_path, lines)
+        os.replace(tmp_path, self._path(first, last))
+
+    def compact(self, force=False):
+        """Merge runs of same-tier sealed segments; ``force`` merges all of them"""
+        with self._maintenance_lock:
+            compacted = False
+            while self._compact(force):
+                compacted = True
+                if force:
+                    break
+            return compacted
+
+    def _tier(self, first, last):
+        """Tier of a file covering segments ``first..last``"""
+        base = max(self.compact_min_segments, 2)
+        span, tier = last - first + 1, 0
+        while span >= base:
+            span //= base
+            tier += 1
+        return tier
+
+    def _tier_run(self, sealed):
+        """Trailing run of sealed segments sharing the newest one's tier, if long enough"""
+        if not sealed:
+            return []
+        tier = self._tier(*sealed[-1])
+        start = len(sealed)
+        while start and self._tier(*sealed[start - 1]) == tier:
+            start -= 1
+        run = sealed[start:]
+        return run if len(run) >= max(self.compact_min_segments, 2) else []
+
+    def _compact(self, force):
+        with self._lock:
+            sealed = self._segments[:-1]
+        run = sealed if force else self._tier_run(sealed)
+        if len(run) < 2:
+            return False
+
+        first, last = run[0][0], run[-1][1]
+
+        def lines():
+            for seg_first, seg_last in run:
+                with open(self._path(seg_first, seg_last), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.endswith('\n') and line.strip():
+                            yield line
+
+        self._write_merged(first, last, lines())
+
+        with self._lock:
+            for seg in run:
+                if seg != (first, last):
+                    os.remove(self._path(*seg))
+            # Only rotation changes the list meanwhile, and it only appends
+            start = self._segments.index(run[0])
+            self._segments[start:start + len(run)] = [(first, last)]
+        return True
+
+    def rewrite(self, records):
+        """Replace the whole log content with ``records``"""
+        with self._maintenance_lock, self._lock:
+            self._rotate()
+            old = self._segments[:-1]
+            first, last = old[0][0], old[-1][1]
+            self._write_merged(first, last, (self._encode(r) for r in records))
+            for seg in old:
+                if seg != (first, last):
+                    os.remove(self._path(*seg))
+            self._segments = [(first, last)] + self._segments[len(old):]
+
+
+class PartitionedLog:
+    """SegmentedLog split into one directory per day (``YYYY-MM-DD``).
+
+    Records are routed by the date of their ISO ``timestamp`` field, so
+    ``expire()`` drops a whole day by deleting its directory instead of
+    rewriting the log, and readers can skip days outside their window.
+    Segments written by the unpartitioned layout are moved into day
+    partitions on ``open()``.
+    """
+
+    def __init__(self, directory, **segment_options):
+        self.directory = directory
+        self.segment_options = segment_options
+        self._partitions = {}  # day -> SegmentedLog
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def day_of(record):
+        return record['timestamp'][:10]
+
+    def _partition(self, day):
+        log = self._partitions.get(day)
+        if log is None:
+            log = SegmentedLog(os.path.join(self.directory, day), **self.segment_options)
+            log.open()
+            self._partitions[day] = log
+        return log
+
+    def _append_grouped(self, records):
+        groups = {}
+        for record in records:
+            groups.setdefault(self.day_of(record), []).append(record)
+        for day, chunk in groups.items():
+            self._partition(day).append_many(chunk)
+
+    def _migrate_flat(self):
+        """Move the records of flat segments into day partitions, safe against a crash.
+
+        Each day is first written to a staging directory; the ``COMPLETE``
+        marker commits the copy. Only then are the flat segments deleted and
+        the staged days renamed into place, so an interrupted migration is
+        either redone from scratch (no marker) or just finished (marker).
+        """
+        staging = os.path.join(self.directory, MIGRATION_DIR)
+        marker = os.path.join(staging, 'COMPLETE')
+        if not os.path.exists(marker):
+            shutil.rmtree(staging, ignore_errors=True)
+            names = os.listdir(self.directory)
+            if not any(SEGMENT_PATTERN.match(n) or n.endswith('.tmp') for n in names):
+                return
+
+            legacy = SegmentedLog(self.directory, **self.segment_options)
+            legacy.open()
+            groups = {}
+            for record in legacy.read_all():
+                groups.setdefault(self.day_of(record), []).append(record)
+            legacy.close()
+            for day, records in groups.items():
+                os.makedirs(os.path.join(staging, day))
+                _write_synced(os.path.join(staging, day, 'seg-00000001-00000001.ndjson'),
+                              (SegmentedLog._encode(r) for r in records))
+            os.makedirs(staging, exist_ok=True)
+            _write_synced(marker + '.tmp', ())
+            os.replace(marker + '.tmp', marker)
+
+        for name in os.listdir(self.directory):
+            if SEGMENT_PATTERN.match(name) or name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+        for day in os.listdir(staging):
+            if not DAY_PATTERN.match(day):
+                continue
+            source, target = os.path.join(staging, day), os.path.join(self.directory, day)
+            if not os.path.exists(target):
+                os.replace(source, target)
+                continue
+            # The day already has segments: add the staged one after them
+            last = max((int(m.group(2)) for m in map(SEGMENT_PATTERN.match, os.listdir(target)) if m),
+                       default=0)
+            os.replace(os.path.join(source, 'seg-00000001-00000001.ndjson'),
+                       os.path.join(target, f'seg-{last + 1:08d}-{last + 1:08d}.ndjson'))
+            os.rmdir(source)
+        shutil.rmtree(staging)
+
+    def open(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._migrate_flat()
+            self._partitions = {}
+            names = os.listdir(self.directory)
+            for name in names:
+                if DAY_PATTERN.match(name):
+                    self._partition(name)
+
+    def close(self):
+        with self._lock:
+            for log in self._partitions.values():
+                log.close()
+
+    def append(self, record):
+        self.append_many((record,))
+
+    def append_many(self, records):
+        with self._lock:
+            self._append_grouped(records)
+
+    def flush(self):
+        with self._lock:
+            for log in self._partitions.values():
+                log.flush()
+
+    def days(self):
+        with self._lock:
+            return sorted(self._partitions)
+
+    def read_all(self, first_day=None):
+        """Yield every record, day by day, skipping days before ``first_day``"""
+        with self._lock:
+            logs = sorted(self._partitions.items())
+        for day, log in logs:
+            if first_day is None or day >= first_day:
+                yield from log.read_all()
+
+    def segment_count(self):
+        with self._lock:
+            return sum(log.segment_count() for log in self._partitions.values())
+
+    def compact(self, force=False):
+        """Compact every day; past days are merged fully since they are done"""
+        with self._lock:
+            logs = sorted(self._partitions.items())
+        compacted = False
+        for i, (day, log) in enumerate(logs):
+            past = i < len(logs) - 1
+            compacted = log.compact(force or past) or compacted
+        return compacted
+
+    def _drop(self, day):
+        self._partitions.pop(day).close()
+        shutil.rmtree(os.path.join(self.directory, day), ignore_errors=True)
+
+    def expire(self, before_day):
+        """Delete whole partitions older than ``before_day``; return the dropped days"""
+        with self._lock:
+            expired = [day for day in self._partitions if day < before_day]
+            for day in expired:
+                self._drop(day)
+        return sorted(expired)
+
+    def rewrite(self, records):
+        """Replace the whole log content with ``records``"""
+        groups = {}
+        for record in records:
+            groups.setdefault(self.day_of(record), []).append(record)
+        with self._lock:
+            for day in [d for d in self._partitions if d not in groups]:
+                self._drop(day)
+            for day, chunk in groups.items():
+                self._partition(day).rewrite(chunk)
@@ -0,0 +1,32 @@
+import importlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The server modules are imported by name, as app.py and run.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app tests run with the SQL store (models.py, routes.py) on, in a scratch SQLite file.
+# Set before anything imports config.py, which reads the environment once.
+os.environ.setdefault('DB_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(prefix='smart_cane_test_'), 'smart_cane.db'))
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The app module, loaded once; it keeps its log and settings relative to the working directory"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('server'))
+    try:
+        app = importlib.import_module('app')
+        app.load_data()
+        yield app
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from aioserver import AsyncHTTPServer
+from versions import VersionClock
+
+
+async def echo(request):
+    body = b'%s %s %s' % (request.method.encode(), request.path.encode(), request.body)
+    return 200, [('Content-Type', 'text/plain'), ('X-Query', request.query_string)], body
+
+
+def wsgi_app(environ, start_response):
+    body = environ['wsgi.input'].read()
+    start_response('201 Created', [('Content-Type', 'text/plain')])
+    return [b'wsgi:', environ['PATH_INFO'].encode(), b':', body]
+
+
+def serve(test, **options):
+    """Run ``test(port, server)`` against a server on a free port"""
+    async def main():
+        server = AsyncHTTPServer(wsgi_app, {('POST', '/echo'): echo, ('GET', '/echo'): echo},
+                                 host='127.0.0.1', port=0, **options)
+        await server.start()
+        try:
+            return await test(server._server.sockets[0].getsockname()[1], server)
+        finally:
+            server.close()
+    return asyncio.run(main())
+
+
+async def exchange(port, data, eof=False):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(data)
+    if eof:
+        writer.write_eof()
+    response = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return response
+
+
+def status(response):
+    return int(response.split(b' ', 2)[1])
+
+
+def test_content_length_body():
+    async def test(port, server):
+        return await exchange(port, b'POST /echo?a=1 HTTP/1.1\r\nContent-Length: 5\r\n'
+                                    b'Connection: close\r\n\r\nhello')
+    response = serve(test)
+    assert status(response) == 200
+    assert b'X-Query: a=1' in response
+    assert response.endswith(b'POST /echo hello')
+
+
+def test_chunked_body():
+    async def test(port, server):
+        return await exchange(port, b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n'
+                                    b'Connection: close\r\n\r\n3\r\nabc\r\n2;ext=1\r\nde\r\n0\r\n\r\n')
+    response = serve(test)
+    assert status(response) == 200
+    assert response.endswith(b'abcde')
+
+
+def test_keep_alive_serves_several_requests():
+    async def test(port, server):
+        request = b'GET /echo HTTP/1.1\r\n\r\n'
+        return await exchange(port, request + request + b'GET /echo HTTP/1.1\r\nConnection: close\r\n\r\n')
+    response = serve(test)
+    assert response.count(b'HTTP/1.1 200 OK') == 3
+
+
+def test_other_routes_go_to_wsgi():
+    async def test(port, server):
+        return await exchange(port, b'POST /api/x HTTP/1.1\r\nContent-Length: 2\r\n'
+                                    b'Connection: close\r\n\r\nhi')
+    response = serve(test)
+    assert status(response) == 201
+    assert response.endswith(b'wsgi:/api/x:hi')
+
+
+@pytest.mark.parametrize('head, expected', [
+    (b'POST /echo HTTP/1.1\r\nContent-Length: -5\r\n\r\n', 400),
+    (b'POST /echo HTTP/1.1\r\nContent-Length: five\r\n\r\n', 400),
+    (b'POST /echo HTTP/1.1\r\nContent-Length: 999999999\r\n\r\n', 413),
+    (b'GET /echo HTTP/2.0\r\n\r\n', 505),
+    (b'GARBAGE\r\n\r\n', 400),
+    (b'GET /echo HTTP/1.1\r\nno colon here\r\n\r\n', 400),
+    (b'GET /echo HTTP/1.1\r\nX-Big: ' + b'a' * 20000 + b'\r\n\r\n', 431),
+])
+def test_bad_requests(head, expected):
+    async def test(port, server):
+        return await exchange(port, head)
+    assert status(serve(test)) == expected
+
+
+@pytest.mark.parametrize('body', [
+    b'zz\r\nabc\r\n0\r\n\r\n',           # Not hex
+    b'-3\r\nabc\r\n0\r\n\r\n',           # Negative size
+    b'3\r\nabcXY0\r\n\r\n',              # No CRLF after the chunk
+    b'1' * 20000 + b'\r\n',              # Size line over the stream limit
+])
+def test_bad_chunked_bodies(body):
+    async def test(port, server):
+        return await exchange(port, b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n' + body)
+    assert status(serve(test)) == 400
+
+
+def test_truncated_chunked_body():
+    async def test(port, server):
+        return await exchange(port, b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nab',
+                              eof=True)
+    assert status(serve(test)) == 400
+
+
+def test_chunked_body_over_limit():
+    async def test(port, server):
+        return await exchange(port, b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                    b'10\r\n' + b'a' * 16 + b'\r\n0\r\n\r\n')
+    assert status(serve(test, max_body_bytes=8)) == 413
+
+
+def test_slow_headers_time_out():
+    async def test(port, server):
+        response = await exchange(port, b'GET /echo HTTP/1.1\r\nX-Slow: ')
+        return response, server.timeouts
+    response, timeouts = serve(test, header_timeout=0.1)
+    assert status(response) == 408
+    assert timeouts == 1
+
+
+def test_slow_body_times_out():
+    async def test(port, server):
+        return await exchange(port, b'POST /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc')
+    assert status(serve(test, body_timeout=0.1)) == 408
+
+
+def test_idle_connection_is_closed():
+    async def test(port, server):
+        return await exchange(port, b'')
+    assert serve(test, idle_timeout=0.1) == b''
+
+
+def test_connections_over_limit_get_503():
+    async def test(port, server):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await asyncio.sleep(0.05)
+        response = await exchange(port, b'GET /echo HTTP/1.1\r\n\r\n')
+        writer.close()
+        return response, server.rejected
+    response, rejected = serve(test, max_connections=1)
+    assert status(response) == 503
+    assert rejected == 1
+
+
+def test_handler_can_hand_the_request_to_wsgi():
+    async def test(port, server):
+        async def later(request):
+            await asyncio.sleep(0.01)
+            return await server.wsgi(request)
+        server.routes[('GET', '/later')] = later
+        return await exchange(port, b'GET /later HTTP/1.1\r\nConnection: close\r\n\r\n')
+    response = serve(test)
+    assert status(response) == 201
+    assert response.endswith(b'wsgi:/later:')
+
+
+def test_version_clock_wakes_coroutines_from_other_threads():
+    clock = VersionClock()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, lambda: threading.Thread(target=clock.tick).start())
+        started = loop.time()
+        woken = await clock.wait_async(lambda: clock.value > 0, 5)
+        waited = loop.time() - started
+        timed_out = await clock.wait_async(lambda: clock.value > 1, 0.05)
+        return woken, waited, timed_out, len(clock._async_waiters)
+
+    woken, waited, timed_out, left = asyncio.run(main())
+    assert woken and waited < 2
+    assert not timed_out and left == 0
+
+
+def test_long_poll_waits_on_the_loop_not_a_wsgi_thread(server):
+    client = server.app.test_client()
+    reading = {'front_distance': 100, 'left_distance': 80, 'right_distance': 80, 'ir_distance': 30}
+    client.post('/api/data/receive?device=aio-cane', json=reading)
+    version = client.get('/api/data/current?device=aio-cane').get_json()['version']
+
+    async def main():
+        app_server = AsyncHTTPServer(server.app, {}, host='127.0.0.1', port=0, wsgi_workers=1)
+        for path, version_of in server.LONG_POLL_VERSIONS.items():
+            app_server.routes[('GET', path)] = server.long_poll_handler(version_of, app_server.wsgi)
+        await app_server.start()
+        port = app_server._server.sockets[0].getsockname()[1]
+        try:
+            poll = asyncio.create_task(exchange(
+                port, f'GET /api/data/current?device=aio-cane&since={version}&wait=10 HTTP/1.1\r\n'
+                      f'Connection: close\r\n\r\n'.encode()))
+            await asyncio.sleep(0.2)
+            # The only WSGI thread is free while the long-poll waits
+            other = await exchange(port, b'GET /api/system/info HTTP/1.1\r\nConnection: close\r\n\r\n')
+            assert not poll.done()
+            await asyncio.to_thread(client.post, '/api/data/receive?device=aio-cane',
+                                    json=dict(reading, front_distance=33))
+            return other, await asyncio.wait_for(poll, 5)
+        finally:
+            app_server.close()
+
+    other, response = asyncio.run(main())
+    assert status(other) == 200
+    body = json.loads(response.split(b'\r\n\r\n', 1)[1])
+    assert body['version'] > version
+    assert body['data']['front_distance'] == 33
@@ -0,0 +1,35 @@
+from alerts import (FRONT_DANGER, GROUND_UNEVEN, HOLE, LEFT_WARNING, Alert, alert_mask, iter_alerts,
+                    mask_count, mask_from_legacy, render_alert, render_alerts)
+
+SETTINGS = {'danger_distance': 25, 'warn_distance': 50, 'ir_ground': 20, 'ir_hole': 40}
+
+
+def reading(front=100.0, left=100.0, right=100.0, ir=30.0):
+    return {'front_distance': front, 'left_distance': left, 'right_distance': right, 'ir_distance': ir}
+
+
+def test_mask_classifies_each_sensor():
+    assert alert_mask(reading(), SETTINGS) == 0
+    assert alert_mask(reading(front=10, left=30, ir=50), SETTINGS) == \
+        (1 << FRONT_DANGER) | (1 << LEFT_WARNING) | (1 << HOLE)
+    # 0 means no echo, not an obstacle at 0 cm
+    assert alert_mask(reading(front=0, ir=10), SETTINGS) == 1 << GROUND_UNEVEN
+    assert mask_count(alert_mask(reading(front=10, left=30, ir=50), SETTINGS)) == 3
+
+
+def test_legacy_alert_dicts_map_to_codes():
+    legacy = [{'type': 'danger', 'location': 'front', 'message': '...'},
+              {'type': 'warning', 'location': 'left'}, {'type': 'unknown', 'location': 'up'}]
+    assert mask_from_legacy(legacy) == (1 << FRONT_DANGER) | (1 << LEFT_WARNING)
+    assert mask_from_legacy(None) == 0
+
+
+def test_render_on_read_in_each_language():
+    values = reading(front=12.5, left=30)
+    alerts = list(iter_alerts(alert_mask(values, SETTINGS), values, 0.0))
+    assert alerts == [Alert(FRONT_DANGER, 12.5, 0.0), Alert(LEFT_WARNING, 30, 0.0)]
+
+    rendered = render_alert(alerts[0], 'en')
+    assert (rendered['type'], rendered['location']) == ('danger', 'front')
+    assert '12.5' in rendered['message'] and 'OBSTACLE' in rendered['message']
+    assert render_alerts(1 << FRONT_DANGER, values, 0.0)[0]['message'] != rendered['message']
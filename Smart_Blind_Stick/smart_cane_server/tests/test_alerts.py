@@ -0,0 +1,126 @@
+import time
+
+from alerts import CLEAR, FRONT_DANGER, LATE, RAISE, RENOTIFY, AlertTracker
+
+SETTINGS = {
+    'danger_distance': 25,
+    'warn_distance': 50,
+    'safe_distance': 80,
+    'ir_ground': 20,
+    'ir_hole': 40,
+    'alert_clear_margin': 5,
+    'alert_min_hold': 10,
+    'alert_renotify_interval': 60,
+}
+
+
+def reading(front=100.0):
+    return {'front_distance': front, 'left_distance': 100.0, 'right_distance': 100.0, 'ir_distance': 30.0}
+
+
+def kinds(events):
+    return [(e.code, e.kind) for e in events]
+
+
+def test_raise_hold_and_clear():
+    tracker = AlertTracker(100)
+    assert kinds(tracker.update(reading(10), 0, SETTINGS)) == [(FRONT_DANGER, RAISE)]
+    # Back to safe, but still inside alert_min_hold
+    assert tracker.update(reading(100), 5, SETTINGS) == []
+    assert kinds(tracker.update(reading(100), 11, SETTINGS)) == [(FRONT_DANGER, CLEAR)]
+
+
+def test_renotify_while_up():
+    tracker = AlertTracker(100)
+    tracker.update(reading(10), 0, SETTINGS)
+    assert tracker.update(reading(10), 30, SETTINGS) == []
+    assert kinds(tracker.update(reading(10), 60, SETTINGS)) == [(FRONT_DANGER, RENOTIFY)]
+
+
+def test_late_reading_raises_late_event_without_touching_live_state():
+    tracker = AlertTracker(100)
+    tracker.update(reading(100), 100, SETTINGS)
+    events = tracker.update(reading(10), 50, SETTINGS)
+
+    assert kinds(events) == [(FRONT_DANGER, LATE)]
+    assert tracker.active == {}
+    assert tracker.late_readings == 1
+    assert [e.ts for e in tracker.events] == [50]
+
+
+def test_late_reading_covered_by_alert_up_at_its_time():
+    tracker = AlertTracker(100)
+    tracker.update(reading(10), 0, SETTINGS)
+    tracker.update(reading(100), 20, SETTINGS)
+    tracker.update(reading(100), 100, SETTINGS)
+
+    # The danger alert was up at t=5, so nothing new
+    assert tracker.update(reading(10), 5, SETTINGS) == []
+    # Cleared again at t=30: a new LATE event, inserted in time order
+    assert kinds(tracker.update(reading(10), 30, SETTINGS)) == [(FRONT_DANGER, LATE)]
+    assert [e.ts for e in tracker.events] == [0, 20, 30]
+    # A second late reading close by is covered by that LATE event
+    assert tracker.update(reading(10), 35, SETTINGS) == []
+
+
+def test_late_event_counts_as_edit_unless_newest():
+    tracker = AlertTracker(100)
+    tracker.update(reading(10), 0, SETTINGS)
+    tracker.update(reading(100), 20, SETTINGS)
+    appended = tracker.appended
+
+    # Newer than every recorded event: a plain append
+    tracker.update(reading(100), 100, SETTINGS)
+    tracker.update(reading(10), 50, SETTINGS)
+    assert (tracker.appended, tracker.edits) == (appended + 1, 0)
+
+    tracker.update(reading(10), 200, SETTINGS)
+    tracker.update(reading(40), 150, SETTINGS)
+    assert [e.kind for e in tracker.events][-2:] == [LATE, RAISE]
+    assert tracker.edits == 1
+
+
+def test_restore_replays_log():
+    live = AlertTracker(100)
+    live.update(reading(10), 0, SETTINGS)
+    live.update(reading(100), 20, SETTINGS)
+    live.update(reading(10), 100, SETTINGS)
+    live.update(reading(10), 50, SETTINGS)
+    logged = [live.events[0], live.events[1], live.events[3], live.events[2]]  # LATE logged on arrival
+    assert logged[-1].kind == LATE
+
+    restored = AlertTracker(100)
+    for event in logged:
+        restored.restore(event)
+    assert list(restored.events) == list(live.events)
+    assert restored.last_ts == 100
+    assert restored.active == live.active
+
+
+def batch_reading(ts, front):
+    return {'timestamp': ts, 'front_distance': front, 'left_distance': 100,
+            'right_distance': 100, 'ir_distance': 30}
+
+
+def test_late_readings_raise_late_alerts(client):
+    now = time.time()
+    response = client.post('/api/data/receive/batch', json={
+        'device_id': 'late-cane', 'readings': [batch_reading(now, 100)]
+    })
+    assert response.get_json()['accepted'] == 1
+
+    # Uploaded later from the cane's offline buffer, older than the live reading
+    response = client.post('/api/data/receive/batch', json={
+        'device_id': 'late-cane', 'readings': [batch_reading(now - 120, 10), batch_reading(now - 119, 10)]
+    })
+    body = response.get_json()
+    assert body['accepted'] == 2
+    assert body['alert_events'] == 1
+
+    alerts = client.get('/api/alerts?device=late-cane').get_json()['alerts']
+    assert [a['event'] for a in alerts] == ['late']
+    current = client.get('/api/data/current?device=late-cane').get_json()
+    assert current['data']['alerts'] == []
+
+    counters = client.get('/api/metrics').get_json()['metrics']['counters']
+    assert counters['late_readings']['late-cane'] == 2
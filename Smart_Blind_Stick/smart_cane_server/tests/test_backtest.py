@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from alerts import ALERT_KINDS, alert_mask
+from backtest import ThresholdIndex, backtest, replay_events, validate_candidate
+from history import DISTANCE_FIELDS
+
+SETTINGS = {'danger_distance': 20, 'warn_distance': 50, 'ir_ground': 15, 'ir_hole': 40,
+            'alert_clear_margin': 5, 'alert_min_hold': 10, 'alert_renotify_interval': 60}
+
+
+def random_columns(rng, n):
+    # Integers so that readings land exactly on the thresholds too
+    columns = {field: [float(rng.randint(-5, 120)) for _ in range(n)] for field in DISTANCE_FIELDS[:3]}
+    columns['ir_distance'] = [float(rng.randint(0, 60)) for _ in range(n)]
+    return columns
+
+
+def mask_counts(columns, settings):
+    counts = dict.fromkeys(ALERT_KINDS, 0)
+    for values in zip(*(columns[field] for field in DISTANCE_FIELDS)):
+        mask = alert_mask(dict(zip(DISTANCE_FIELDS, values)), settings)
+        for code in ALERT_KINDS:
+            counts[code] += mask >> code & 1
+    return counts
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_index_counts_match_alert_mask(seed):
+    rng = random.Random(seed)
+    columns = random_columns(rng, 500)
+    index = ThresholdIndex(columns)
+    for _ in range(20):
+        settings = {'danger_distance': rng.randint(0, 60), 'warn_distance': rng.randint(0, 100),
+                    # Includes ir_hole < ir_ground, where uneven ground wins over hole
+                    'ir_ground': rng.randint(0, 40), 'ir_hole': rng.randint(0, 60)}
+        assert index.counts(settings) == mask_counts(columns, settings)
+
+
+def flapping(n=20):
+    # Front distance jumps across the warning threshold every reading
+    columns = {'front_distance': [45.0 if i % 2 else 52.0 for i in range(n)],
+               'left_distance': [100.0] * n, 'right_distance': [100.0] * n, 'ir_distance': [30.0] * n}
+    return [float(i) for i in range(n)], columns
+
+
+def test_replay_applies_hysteresis():
+    ts, columns = flapping()
+    hits = ThresholdIndex(columns).summary(SETTINGS)['by_kind']['warning_front']
+    events = replay_events([(ts, columns)], SETTINGS)
+
+    assert hits == 10
+    assert events['by_kind']['warning_front'] == 1
+    assert events['raised'] == 1 and events['renotified'] == 0
+
+    no_hold = dict(SETTINGS, alert_clear_margin=0, alert_min_hold=0)
+    assert replay_events([(ts, columns)], no_hold)['by_kind']['warning_front'] == 10
+
+
+def test_backtest_reports_events_next_to_hits():
+    ts, columns = flapping()
+    index = ThresholdIndex(columns)
+    current, (loose,) = backtest(index, [{'alert_min_hold': 0, 'alert_clear_margin': 0}], SETTINGS, [(ts, columns)])
+
+    assert loose['alerts'] == current['alerts']
+    assert loose['diff']['events'] == {'raised': 9, 'renotified': 0}
+    assert 'events' not in backtest(index, [], SETTINGS)[0]
+
+
+def test_candidate_validation():
+    assert validate_candidate({'alert_min_hold': 5}) == {'alert_min_hold': 5}
+    with pytest.raises(ValueError):
+        validate_candidate({'volume': 3})
+    with pytest.raises(ValueError):
+        validate_candidate({'danger_distance': True})
+
+
+def test_endpoint_replays_small_histories(client):
+    for front in (100, 10, 100):
+        client.post('/api/data/receive?device=backtest-cane',
+                    json={'front_distance': front, 'left_distance': 100, 'right_distance': 100, 'ir_distance': 30})
+    body = client.post('/api/settings/backtest',
+                       json={'device': 'backtest-cane', 'candidates': [{'danger_distance': 5, 'warn_distance': 5}]}).get_json()
+
+    assert body['events_replayed'] and body['readings'] == 3
+    assert body['current']['events']['by_kind']['danger_front'] == 1
+    assert body['results'][0]['diff']['events']['raised'] == -1
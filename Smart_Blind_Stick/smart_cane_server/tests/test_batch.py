@@ -0,0 +1,79 @@
+import time
+
+
+def reading(ts=None, front=100, **fields):
+    item = {'front_distance': front, 'left_distance': 100, 'right_distance': 100, 'ir_distance': 30}
+    if ts is not None:
+        item['timestamp'] = ts
+    item.update(fields)
+    return item
+
+
+def post(client, body):
+    response = client.post('/api/data/receive/batch', json=body)
+    return response.status_code, response.get_json()
+
+
+def test_results_are_per_item(client):
+    status, body = post(client, {'device_id': 'batch-cane', 'readings': [
+        reading(), 'not a reading', reading(front='far'), reading(device_id='batch-other')
+    ]})
+
+    assert status == 200
+    assert (body['accepted'], body['rejected']) == (2, 2)
+    assert [r['index'] for r in body['results']] == [0, 1, 2, 3]
+    assert [r['success'] for r in body['results']] == [True, False, False, True]
+    assert [r.get('device_id') for r in body['results'][::3]] == ['batch-cane', 'batch-other']
+
+
+def test_future_and_expired_timestamps_are_rejected(client, server):
+    now = time.time()
+    status, body = post(client, {'device_id': 'skewed-cane', 'readings': [
+        reading(now - 60), reading(now + 10 * 365 * 86400), reading(now - 400 * 86400)
+    ]})
+
+    assert status == 200
+    assert [r['success'] for r in body['results']] == [True, False, False]
+    assert 'ahead of server time' in body['results'][1]['error']
+    assert 'retention' in body['results'][2]['error']
+    assert all(day <= time.strftime('%Y-%m-%d', time.localtime(now + 86400))
+               for day in server.history_log.days())
+
+    # A live reading afterwards is current, not late
+    client.post('/api/data/receive?device=skewed-cane', json=reading(front=10))
+    current = client.get('/api/data/current?device=skewed-cane').get_json()['data']
+    assert current['front_distance'] == 10
+    assert current['alerts']
+
+
+def test_small_clock_skew_is_accepted(client, server):
+    status, body = post(client, {'device_id': 'fast-clock-cane',
+                                 'readings': [reading(time.time() + server.MAX_CLOCK_SKEW / 2)]})
+    assert body['accepted'] == 1
+
+
+def test_device_id_must_be_a_string(client):
+    status, body = post(client, {'device_id': 'typed-cane', 'readings': [reading(device_id=7), reading()]})
+    assert status == 200
+    assert [r['success'] for r in body['results']] == [False, True]
+
+    status, body = post(client, {'device_id': ['typed-cane'], 'readings': [reading()]})
+    assert status == 400
+
+
+def test_unexpected_job_error_fails_only_that_device(client, server, monkeypatch):
+    apply_readings = server.apply_readings
+
+    def flaky(device_id, readings):
+        if device_id == 'broken-cane':
+            raise RuntimeError('disk on fire')
+        return apply_readings(device_id, readings)
+
+    monkeypatch.setattr(server, 'apply_readings', flaky)
+    status, body = post(client, {'readings': [reading(device_id='fine-cane'), reading(device_id='broken-cane')]})
+
+    assert status == 200
+    assert body['accepted'] == 1
+    assert body['results'][0]['success']
+    assert body['results'][1] == {'index': 1, 'success': False, 'device_id': 'broken-cane',
+                                  'error': 'disk on fire'}
@@ -0,0 +1,58 @@
+import struct
+
+import pytest
+
+from codec import BINARY_CONTENT_TYPE, READING_V1, decode_readings, encode_reading
+
+READING = {
+    'front_distance': 123.4,
+    'left_distance': 56.7,
+    'right_distance': 0.0,
+    'ir_distance': 31.2,
+    'mode': 2,
+    'power_status': True,
+    'battery_level': 87,
+    'wifi_connected': False,
+}
+
+
+def test_round_trip():
+    [(ts, reading)] = decode_readings(encode_reading(READING, age_ms=1500), now=1000.0)
+
+    assert ts == pytest.approx(998.5)
+    assert reading == READING
+
+
+def test_concatenated_records_keep_their_order():
+    payload = b''.join(encode_reading(dict(READING, mode=m), age_ms=100 * m) for m in (3, 2, 1))
+    readings = decode_readings(payload, now=10.0)
+
+    assert [r['mode'] for _, r in readings] == [3, 2, 1]
+    assert [ts for ts, _ in readings] == pytest.approx([9.7, 9.8, 9.9])
+
+
+@pytest.mark.parametrize('payload', [b'', b'\x01' * (READING_V1.size - 1), encode_reading(READING) + b'\x01'])
+def test_bad_length_is_rejected(payload):
+    with pytest.raises(ValueError, match='multiple'):
+        decode_readings(payload, now=0.0)
+
+
+def test_unknown_version_is_rejected():
+    payload = bytearray(encode_reading(READING))
+    payload[0] = 2
+    with pytest.raises(ValueError, match='version'):
+        decode_readings(bytes(payload), now=0.0)
+
+
+def test_receive_endpoint_accepts_binary(client):
+    response = client.post('/api/data/receive?device=binary-cane', data=encode_reading(dict(READING, front_distance=12.5)),
+                           content_type=BINARY_CONTENT_TYPE)
+    assert response.status_code == 200
+    current = client.get('/api/data/current?device=binary-cane').get_json()['data']
+    assert current['front_distance'] == 12.5
+
+
+def test_receive_endpoint_rejects_bad_binary(client):
+    bad = struct.pack('<B', 9) + encode_reading(READING)[1:]
+    response = client.post('/api/data/receive', data=bad, content_type=BINARY_CONTENT_TYPE)
+    assert response.status_code == 400
@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+def reading(front=100):
+    return {'front_distance': front, 'left_distance': 100, 'right_distance': 100, 'ir_distance': 30}
+
+
+def test_etag_and_304_on_current(client):
+    client.post('/api/data/receive?device=etag-cane', json=reading())
+    first = client.get('/api/data/current?device=etag-cane')
+    etag = first.headers['ETag']
+    assert first.headers['X-State-Version'] == str(first.get_json()['version'])
+
+    again = client.get('/api/data/current?device=etag-cane', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    client.post('/api/data/receive?device=etag-cane', json=reading(front=60))
+    changed = client.get('/api/data/current?device=etag-cane', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['data']['front_distance'] == 60
+
+
+def test_long_poll_returns_on_change(client, server):
+    client.post('/api/data/receive?device=poll-cane', json=reading())
+    version = client.get('/api/data/current?device=poll-cane').get_json()['version']
+    answers = []
+
+    def poll():
+        started = time.monotonic()
+        response = server.app.test_client().get(f'/api/data/current?device=poll-cane&since={version}&wait=10')
+        answers.append((time.monotonic() - started, response.get_json()))
+
+    waiter = threading.Thread(target=poll)
+    waiter.start()
+    time.sleep(0.2)
+    assert not answers
+    client.post('/api/data/receive?device=poll-cane', json=reading(front=42))
+    waiter.join(5)
+
+    elapsed, body = answers[0]
+    assert elapsed < 5
+    assert body['version'] > version
+    assert body['data']['front_distance'] == 42
+
+
+def test_long_poll_times_out_with_the_same_version(client):
+    client.post('/api/data/receive?device=idle-cane', json=reading())
+    version = client.get('/api/data/current?device=idle-cane').get_json()['version']
+
+    started = time.monotonic()
+    body = client.get(f'/api/data/current?device=idle-cane&since={version}&wait=0.3').get_json()
+    assert 0.25 < time.monotonic() - started < 3
+    assert body['version'] == version
@@ -0,0 +1,66 @@
+import pytest
+
+from cursors import decode_cursor, encode_cursor
+from history import HistoryBuffer
+
+
+def test_round_trip():
+    key = {'from': 1700000000.5, 'ts': 1700000100.25, 'skip': 2}
+    token = encode_cursor(key)
+    assert '=' not in token
+    assert decode_cursor(token) == key
+
+
+@pytest.mark.parametrize('token', ['***', 'bm90IGpzb24', ''])
+def test_malformed_token(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def walk(history, window_start, limit):
+    """Every page through encoded cursors, as /api/data/history does"""
+    pages, cursor = [], None
+    while True:
+        entries, next_key = history.page_before(window_start, limit, cursor)
+        pages.append(entries)
+        if next_key is None:
+            return pages
+        key = decode_cursor(encode_cursor({'ts': next_key[0], 'skip': next_key[1]}))
+        cursor = (key['ts'], key['skip'])
+
+
+def test_keyset_paging_with_duplicate_timestamps():
+    history = HistoryBuffer(100)
+    # Groups of equal timestamps straddle page boundaries
+    stamps = [1000 + i // 3 for i in range(20)]
+    for n, ts in enumerate(stamps):
+        history.append_values(ts, float(n), 0.0, 0.0, 0.0, 1, 0)
+
+    pages = walk(history, 0, 4)
+    rows = [entry['front_distance'] for page in pages for entry in page]
+
+    assert all(len(page) == 4 for page in pages)
+    assert sorted(rows) == [float(n) for n in range(20)]
+    assert len(rows) == len(set(rows))
+
+
+def test_paging_stops_at_window_start():
+    history = HistoryBuffer(100)
+    for ts in range(1000, 1010):
+        history.append_values(ts, float(ts), 0.0, 0.0, 0.0, 1, 0)
+
+    pages = walk(history, 1004, 3)
+    rows = [entry['front_distance'] for page in pages for entry in page]
+    assert sorted(rows) == [float(ts) for ts in range(1005, 1010)]
+
+
+def test_rows_appended_while_paging_do_not_shift_pages():
+    history = HistoryBuffer(100)
+    for ts in range(1000, 1010):
+        history.append_values(ts, float(ts), 0.0, 0.0, 0.0, 1, 0)
+
+    first, next_key = history.page_before(0, 4)
+    history.append_values(1010, 1010.0, 0.0, 0.0, 0.0, 1, 0)
+    second, _ = history.page_before(0, 4, next_key)
+
+    assert [e['front_distance'] for e in second] == [1002.0, 1003.0, 1004.0, 1005.0]
@@ -0,0 +1,62 @@
+from history import DISTANCE_FIELDS, HistoryBuffer, downsample, lttb, minmax
+
+
+def add(history, ts, front=100.0):
+    history.append_values(ts, front, 50.0, 50.0, 30.0, 1, 0)
+
+
+def test_window_and_empty_buffer():
+    history = HistoryBuffer(10)
+    assert list(history.window(0)[0]) == []
+    for ts in range(5):
+        add(history, ts)
+
+    ts, columns = history.window(2)
+    assert list(ts) == [3, 4]
+    assert set(columns) == set(DISTANCE_FIELDS)
+
+
+def test_lttb_keeps_ends_and_peak():
+    xs = list(range(100))
+    ys = [0.0] * 100
+    ys[37] = 500.0
+    kept = lttb(xs, ys, 10)
+
+    assert len(kept) == 10
+    assert kept[0] == 0 and kept[-1] == 99
+    assert 37 in kept
+    assert kept == sorted(kept)
+
+
+def test_lttb_short_series_is_returned_whole():
+    assert lttb([0, 1, 2], [5, 6, 7], 10) == [0, 1, 2]
+
+
+def test_minmax_keeps_bucket_extremes():
+    ys = [5, 1, 9, 5, 5, 0, 7, 5]
+    assert minmax(ys, 4) == [1, 2, 5, 6]
+
+
+def test_downsample_every_column():
+    history = HistoryBuffer(1000)
+    for ts in range(500):
+        add(history, ts, front=ts % 17)
+    ts, columns = history.window(-1)
+    series = downsample(ts, columns, 20)
+
+    assert set(series) == set(DISTANCE_FIELDS)
+    times, values = series['front_distance']
+    assert len(times) == len(values) == 20
+    assert times[0] == 0 and times[-1] == 499
+
+
+def test_history_endpoint_downsamples_the_window(client):
+    for i in range(30):
+        client.post('/api/data/receive?device=down-cane',
+                    json={'front_distance': 100 + i, 'left_distance': 80, 'right_distance': 80, 'ir_distance': 30})
+    body = client.get('/api/data/history?device=down-cane&points=10&method=minmax').get_json()
+
+    assert body['count'] == 30 and body['method'] == 'minmax'
+    front = body['series']['front_distance']
+    assert len(front['timestamps']) == len(front['values']) <= 10
+    assert client.get('/api/data/history?device=down-cane&points=2').status_code == 400
@@ -0,0 +1,91 @@
+import random
+
+from history import HistoryBuffer
+
+
+def add(history, ts, front=100.0):
+    history.append_values(ts, front, 50.0, 50.0, 30.0, 1, 0)
+
+
+def timestamps(history):
+    return list(history.tail(len(history))[0])
+
+
+def test_ring_overwrites_oldest_at_capacity():
+    history = HistoryBuffer(5, initial_size=2)
+    for ts in range(8):
+        add(history, ts)
+
+    assert len(history) == 5
+    assert timestamps(history) == [3, 4, 5, 6, 7]
+    assert history.appended == 8 and history.edits == 0
+
+
+def test_late_reading_is_moved_into_place():
+    history = HistoryBuffer(10)
+    for ts in (1, 2, 4, 5):
+        add(history, ts, front=ts)
+    add(history, 3, front=3)
+
+    assert timestamps(history) == [1, 2, 3, 4, 5]
+    assert list(history.columns_since()['front_distance']) == [1, 2, 3, 4, 5]
+    assert history.edits == 1
+
+
+def test_late_reading_in_full_ring_keeps_newest_rows():
+    history = HistoryBuffer(4)
+    for ts in (1, 2, 4, 5, 6):
+        add(history, ts)
+    add(history, 3)
+
+    assert timestamps(history) == [3, 4, 5, 6]
+
+
+def test_keep_last_and_drop_before():
+    history = HistoryBuffer(10)
+    for ts in range(10):
+        add(history, ts)
+
+    history.keep_last(6)
+    assert timestamps(history) == [4, 5, 6, 7, 8, 9]
+    history.drop_before(7)
+    assert timestamps(history) == [7, 8, 9]
+    assert history.edits == 2
+    add(history, 10)
+    assert timestamps(history) == [7, 8, 9, 10]
+
+
+def test_late_batch_is_merged_in_one_edit():
+    history = HistoryBuffer(100)
+    for ts in range(0, 20, 2):
+        add(history, ts, front=ts)
+    history.extend_values([(ts, ts, 50.0, 50.0, 30.0, 1, 0) for ts in (15, 3, 30, 9, 3)])
+
+    assert timestamps(history) == [0, 2, 3, 3, 4, 6, 8, 9, 10, 12, 14, 15, 16, 18, 30]
+    assert list(history.columns_since()['front_distance']) == timestamps(history)
+    assert history.edits == 1
+    assert history.appended == 11
+
+
+def test_late_batch_past_capacity_keeps_newest_rows():
+    history = HistoryBuffer(5, initial_size=2)
+    for ts in (10, 20, 30, 40, 50, 60):
+        add(history, ts)
+    history.extend_values([(ts, 0.0, 0.0, 0.0, 0.0, 1, 0) for ts in (5, 25, 35, 45)])
+
+    assert timestamps(history) == [35, 40, 45, 50, 60]
+
+
+def test_random_order_matches_sorted_reference():
+    rng = random.Random(7)
+    history = HistoryBuffer(300, initial_size=4)
+    reference = []
+    for _ in range(200):
+        batch = [rng.uniform(0, 1000) for _ in range(rng.randint(1, 8))]
+        history.extend_values([(ts, ts, 0.0, 0.0, 0.0, 1, 0) for ts in batch])
+        reference = sorted(reference + batch)[-300:]
+        if rng.random() < 0.05:
+            history.keep_last(50)
+            reference = reference[-50:]
+        assert timestamps(history) == reference
+    assert list(history.columns_since()['front_distance']) == reference
@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from ingest import IngestCore
+from write_behind import BacklogFull
+
+
+@pytest.fixture
+def core():
+    core = IngestCore(batch_size=8)
+    yield core
+    core.close(timeout=5)
+
+
+def test_jobs_run_inline_before_start():
+    core = IngestCore()
+    assert core.call(lambda a, b: a + b, 2, 3) == 5
+    assert core.batches == 1
+
+
+def test_queued_jobs_share_a_batch(core):
+    batches = []
+    core.after_batch = lambda: batches.append(core.jobs)
+    started, gate = threading.Event(), threading.Event()
+    core.start()
+
+    def blocking():
+        started.set()
+        return gate.wait(5)
+
+    first = core.submit(blocking)
+    assert started.wait(5)
+    queued = [core.submit(lambda i=i: i * 2) for i in range(5)]
+    gate.set()
+
+    assert first.wait(5) is True
+    assert [job.wait(5) for job in queued] == [0, 2, 4, 6, 8]
+    # The blocking job ran alone, the five queued behind it in one batch
+    assert core.batches == 2
+    assert len(batches) == 2
+
+
+def test_failing_job_only_fails_itself(core):
+    core.start()
+
+    def boom():
+        raise KeyError('bad reading')
+
+    gate = threading.Event()
+    core.submit(gate.wait)
+    bad = core.submit(boom)
+    good = core.submit(lambda: 'ok')
+    gate.set()
+
+    with pytest.raises(KeyError):
+        bad.wait(5)
+    assert good.wait(5) == 'ok'
+
+
+def test_failing_after_batch_fails_the_batch(core):
+    def after_batch():
+        raise OSError('log write failed')
+
+    core.after_batch = after_batch
+    core.start()
+    with pytest.raises(OSError):
+        core.call(lambda: 'written', timeout=5)
+
+
+def test_on_done_runs_after_after_batch(core):
+    order = []
+    core.after_batch = lambda: order.append('after_batch')
+    core.start()
+    done = threading.Event()
+
+    def on_done(job):
+        order.append(('done', job.result))
+        done.set()
+
+    core.submit(lambda: 7, on_done=on_done)
+    assert done.wait(5)
+    assert order == ['after_batch', ('done', 7)]
+
+
+def test_full_queue_raises_backlog_full():
+    core = IngestCore(max_queue=1, put_timeout=0.01)
+    gate = threading.Event()
+    core.start()
+    try:
+        core.submit(gate.wait)
+        core.submit(lambda: None)  # Fills the queue while the writer is blocked
+        with pytest.raises(BacklogFull):
+            core.submit(lambda: None)
+        with pytest.raises(BacklogFull):
+            core.submit(lambda: None, block=False)
+    finally:
+        gate.set()
+        core.close(timeout=5)
+
+
+def test_wait_timeout_while_queued():
+    core = IngestCore()
+    gate = threading.Event()
+    core.start()
+    try:
+        core.submit(gate.wait)
+        with pytest.raises(TimeoutError):
+            core.submit(lambda: None).wait(0.01)
+    finally:
+        gate.set()
+        core.close(timeout=5)
+
+
+def test_snapshots_are_replaced_not_mutated(core):
+    core.publish('a', 1)
+    table = core._snapshots
+    core.publish('b', 2)
+    assert table == {'a': 1}
+    assert sorted(core.snapshots()) == [1, 2]
+    core.reset()
+    assert core.snapshot('a') is None
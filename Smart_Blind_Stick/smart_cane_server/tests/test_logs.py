@@ -0,0 +1,67 @@
+import io
+import json
+import logging
+import logging.handlers
+import sys
+
+import logs
+from logs import JsonFormatter, SampleFilter, setup_logging, shutdown_logging
+
+
+def make_record(msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('smart_cane', logging.WARNING, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_line_has_fields_and_extras():
+    line = json.loads(JsonFormatter().format(make_record(device_id='cane-1', count=3, sample=True)))
+
+    assert line['level'] == 'WARNING'
+    assert line['logger'] == 'smart_cane'
+    assert line['msg'] == 'hello world'
+    assert line['device_id'] == 'cane-1' and line['count'] == 3
+    assert 'sample' not in line and 'args' not in line
+    assert 'T' in line['ts']
+
+
+def test_json_line_carries_the_traceback():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record = logging.LogRecord('x', logging.ERROR, __file__, 1, 'failed', (), sys.exc_info())
+    line = json.loads(JsonFormatter().format(record))
+    assert 'ValueError: boom' in line['exc']
+
+
+def test_sample_filter_only_drops_sampled_records():
+    drop_all = SampleFilter(0)
+    assert drop_all.filter(make_record())
+    assert not drop_all.filter(make_record(sample=True))
+    assert SampleFilter(1).filter(make_record(sample=True))
+
+
+def test_importing_the_app_leaves_logging_alone(server):
+    root = logging.getLogger()
+    assert logs._listener is None
+    assert not any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers)
+
+
+def test_records_reach_the_stream_through_the_writer_thread():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    level = root.level
+    setup_logging(level='INFO', fmt='json', sample_rate=0, stream=stream)
+    try:
+        logging.getLogger('smart_cane').info('reading %d', 7, extra={'device_id': 'cane-2'})
+        logging.getLogger('smart_cane').info('sampled', extra={'sample': True})
+        shutdown_logging()  # Drains the queue
+    finally:
+        shutdown_logging()
+        for handler in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+            root.removeHandler(handler)
+        root.setLevel(level)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line['msg'], line['device_id']) for line in lines] == [('reading 7', 'cane-2')]
+    assert logs.queue_depth() == 0
@@ -0,0 +1,72 @@
+import threading
+
+from metrics import Histogram, Metrics, RateMeter
+
+
+def test_counters_are_per_label_and_thread_safe():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(1000):
+            metrics.inc('late_readings', ('cane-1',))
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.inc('late_readings', ('cane-2',), 5)
+
+    assert metrics.snapshot()['counters']['late_readings'] == {'cane-1': 4000, 'cane-2': 5}
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 3.0):
+        histogram.observe(value)
+    snap = histogram.snapshot()
+
+    assert snap['count'] == 4 and snap['sum'] == 3.6
+    assert snap['buckets'] == {'0.1': 2, '1.0': 3, '+Inf': 4}
+    assert snap['p50'] == 0.1 and snap['p95'] == float('inf')
+    assert Histogram().quantile(0.5) is None
+
+
+def test_rate_meter_forgets_slots_outside_the_window():
+    meter = RateMeter(window=10)
+    meter.add(20, now=100)
+    meter.add(10, now=105)
+    assert meter.rate(now=105) == 3.0
+    assert meter.rate(now=112) == 1.0
+    meter.add(1, now=110)  # Same slot as second 100: reset, not added to it
+    assert meter.rate(now=110) == 1.1
+    assert meter.total == 31
+
+
+def test_prometheus_text_uses_label_names_and_skips_broken_gauges():
+    metrics = Metrics()
+    metrics.inc('alerts_raised', ('danger', 'front'))
+    metrics.observe('http_request_seconds', 0.002, ('GET', '/x', '200'))
+    metrics.gauge('queue_depth', lambda: 3)
+    metrics.gauge('history_size', lambda: {'cane-1': 7})
+    metrics.gauge('broken', lambda: 1 / 0)
+    text = metrics.prometheus({'alerts_raised': ('type', 'location'), 'history_size': ('device',)})
+
+    assert 'alerts_raised{type="danger",location="front"} 1' in text
+    assert 'http_request_seconds_bucket{label="GET",label="/x",label="200",le="0.0025"} 1' in text
+    assert 'http_request_seconds_count{label="GET",label="/x",label="200"} 1' in text
+    assert 'queue_depth 3' in text
+    assert 'history_size{device="cane-1"} 7' in text
+    assert 'broken' not in text
+    assert metrics.snapshot()['gauges']['broken'] == {'error': 'division by zero'}
+
+
+def test_endpoint_counts_requests_and_readings(client):
+    client.post('/api/data/receive?device=metric-cane',
+                json={'front_distance': 100, 'left_distance': 80, 'right_distance': 80, 'ir_distance': 30})
+    snapshot = client.get('/api/metrics').get_json()['metrics']
+
+    assert snapshot['rates']['ingest_readings']['metric-cane']['total'] == 1
+    assert snapshot['histograms']['http_request_seconds']['POST /api/data/receive 200']['count'] >= 1
+    text = client.get('/api/metrics?format=prometheus').get_data(as_text=True)
+    assert 'ingest_readings_total{device="metric-cane"} 1' in text
@@ -0,0 +1,155 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import database
+from database import ConnectionPool, Database, InterfaceError, OperationalError
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def execute(self, query, params):
+        if self.connection.fail:
+            raise OperationalError(msg='Lost connection')
+        self.connection.queries.append((query, params))
+        self.rowcount = 1
+
+    def executemany(self, query, rows):
+        self.connection.queries.append((query, list(rows)))
+        self.rowcount = len(rows)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.healthy = True
+        self.closed = False
+        self.queries = []
+        self.commits = 0
+
+    def ping(self, reconnect=False):
+        if not self.healthy:
+            raise InterfaceError(msg='gone')
+
+    def cursor(self, **options):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def is_connected(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    connections = []
+
+    def connect(**config):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(database, 'mysql', SimpleNamespace(connector=SimpleNamespace(connect=connect)))
+    return connections
+
+
+def test_connections_are_created_lazily_and_reused(opened):
+    pool = ConnectionPool({}, size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as again:
+        assert again is first
+    assert len(opened) == 1
+
+
+def test_acquire_times_out_when_every_connection_is_borrowed(opened):
+    pool = ConnectionPool({}, size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(OperationalError):
+        pool.acquire()
+    pool.release(held)
+    assert pool.acquire() is held
+
+
+def test_stale_idle_connection_is_replaced(opened):
+    pool = ConnectionPool({}, size=1, health_check_interval=0)
+    with pool.connection() as first:
+        pass
+    first.healthy = False
+    with pool.connection() as second:
+        assert second is not first
+    assert first.closed
+
+
+def test_connection_dropped_on_link_error_is_not_reused(opened):
+    pool = ConnectionPool({}, size=1)
+    with pytest.raises(OperationalError):
+        with pool.connection() as broken:
+            raise OperationalError(msg='Lost connection')
+    assert broken.closed
+    with pool.connection() as fresh:
+        assert fresh is not broken
+
+
+def test_concurrent_borrowers_never_exceed_the_pool_size(opened):
+    pool = ConnectionPool({}, size=3, timeout=5)
+    in_use, peak, lock = set(), [0], threading.Lock()
+
+    def borrow():
+        for _ in range(20):
+            with pool.connection() as connection:
+                with lock:
+                    assert connection not in in_use
+                    in_use.add(connection)
+                    peak[0] = max(peak[0], len(in_use))
+                time.sleep(0.001)
+                with lock:
+                    in_use.discard(connection)
+
+    threads = [threading.Thread(target=borrow) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] <= 3 and len(opened) <= 3
+
+
+def test_query_is_retried_once_on_a_fresh_connection(opened):
+    db = Database()
+    db.pool = ConnectionPool({}, size=1)
+    with db.pool.connection() as first:
+        pass
+    first.fail = True
+
+    assert db.execute_query("UPDATE sensor_data SET mode = %s", (2,)) == 1
+    assert first.closed and opened[-1].queries == [("UPDATE sensor_data SET mode = %s", (2,))]
+
+
+def test_execute_many_chunks_rows_in_one_transaction(opened):
+    db = Database()
+    db.pool = ConnectionPool({}, size=1)
+    rows = [{'device_id': 'cane', 'front_distance': i} for i in range(25)]
+
+    assert db.insert_sensor_data_many(rows) == 25
+    connection = opened[-1]
+    assert [len(params) for _, params in connection.queries] == [25]
+    assert connection.commits == 1
+    assert db.execute_many(Database.INSERT_SENSOR_DATA, [()] * 25, chunk_size=10) == 25
+    assert [len(params) for _, params in connection.queries[1:]] == [10, 10, 5]
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import threading
+
+from push import PushHub
+
+
+def events(frames):
+    parsed = []
+    for frame in frames:
+        lines = dict(line.split(': ', 1) for line in frame.decode().strip().split('\n'))
+        parsed.append((lines['event'], json.loads(lines['data'])))
+    return parsed
+
+
+def test_new_client_starts_from_snapshot_then_deltas():
+    hub = PushHub()
+    hub.publish('a', {'x': 1, 'y': 1})
+    client = hub.subscribe()
+
+    assert events(hub.next_frames(client, 0)) == [('snapshot', {'v': 1, 'states': {'a': {'x': 1, 'y': 1}}})]
+    hub.publish('a', {'x': 2, 'y': 1})
+    assert events(hub.next_frames(client, 0)) == [('delta', {'key': 'a', 'v': 2, 'changes': {'x': 2}})]
+
+
+def test_device_subscription_filters_deltas_and_snapshot():
+    hub = PushHub()
+    hub.publish('a', {'x': 1})
+    hub.publish('b', {'x': 1})
+    client = hub.subscribe('b')
+
+    assert events(hub.next_frames(client, 0))[0][1]['states'] == {'b': {'x': 1}}
+    hub.publish('a', {'x': 2})
+    hub.publish('b', {'x': 2})
+    hub.broadcast('notice', {'text': 'hi'})
+    assert [(name, data.get('key')) for name, data in events(hub.next_frames(client, 0))] == \
+        [('delta', 'b'), ('notice', None)]
+
+
+def test_slow_client_is_resynced():
+    hub = PushHub(max_queue=2)
+    client = hub.subscribe()
+    hub.next_frames(client, 0)
+    for x in range(5):
+        hub.publish('a', {'x': x})
+
+    frames = events(hub.next_frames(client, 0))
+    assert frames == [('snapshot', {'v': 5, 'states': {'a': {'x': 4}}})]
+
+
+def test_astream_wakes_on_publish_from_another_thread():
+    hub = PushHub()
+    client = hub.subscribe('a')
+
+    async def main():
+        stream = hub.astream(client, heartbeat=30)
+        assert await stream.__anext__() == b'retry: 3000\n\n'
+        await stream.__anext__()  # Snapshot
+        timer = threading.Timer(0.05, hub.publish, ('a', {'x': 1}))
+        timer.start()
+        frame = await asyncio.wait_for(stream.__anext__(), 2)
+        await stream.aclose()
+        return frame
+
+    assert events([asyncio.run(main())])[0][0] == 'delta'
+    assert len(hub) == 0
+
+
+def test_astream_sends_heartbeat_when_idle():
+    hub = PushHub()
+    client = hub.subscribe()
+
+    async def main():
+        stream = hub.astream(client, heartbeat=0.05)
+        await stream.__anext__()
+        await stream.__anext__()
+        frame = await asyncio.wait_for(stream.__anext__(), 2)
+        await stream.aclose()
+        return frame
+
+    assert asyncio.run(main()) == b': ping\n\n'
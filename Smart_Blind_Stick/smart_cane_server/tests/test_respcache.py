@@ -0,0 +1,78 @@
+import gzip
+import json
+
+from respcache import ResponseCache
+
+
+def make_cache(**options):
+    return ResponseCache(lambda payload: json.dumps(payload).encode('utf-8'), **options)
+
+
+def test_build_runs_once_per_key():
+    cache = make_cache()
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {'n': len(calls)}
+
+    first = cache.get(('/x', '1'), build)
+    second = cache.get(('/x', '1'), build)
+    assert first is second
+    assert first.body == b'{"n": 1}'
+    assert (cache.hits, cache.misses, len(calls)) == (1, 1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache(max_entries=2)
+    cache.get('a', dict)
+    cache.get('b', dict)
+    cache.get('a', dict)
+    cache.get('c', dict)
+
+    assert len(cache) == 2
+    cache.get('a', dict)
+    assert cache.hits == 2
+    cache.get('b', dict)
+    assert cache.misses == 4
+
+
+def test_gzip_only_above_threshold_and_compressed_once():
+    cache = make_cache(gzip_min_bytes=100)
+    small = cache.get('small', lambda: {'v': 1})
+    large = cache.get('large', lambda: {'v': 'x' * 500})
+
+    assert cache.body(small, accept_gzip=True) == (small.body, None)
+    assert cache.body(large, accept_gzip=False) == (large.body, None)
+    body, encoding = cache.body(large, accept_gzip=True)
+    assert encoding == 'gzip' and gzip.decompress(body) == large.body
+    assert cache.body(large, accept_gzip=True)[0] is body
+
+
+def test_clear_forces_rebuild():
+    cache = make_cache()
+    cache.get('a', dict)
+    cache.clear()
+    cache.get('a', dict)
+    assert cache.misses == 2 and len(cache) == 1
+
+
+def test_system_info_etag_and_304(client):
+    first = client.get('/api/system/info')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+
+    again = client.get('/api/system/info', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+
+
+def test_cached_bodies_carry_no_clock(client, server):
+    first = client.get('/api/system/info')
+    hits = server.response_cache.hits
+    second = client.get('/api/system/info')
+
+    assert 'Date' in first.headers
+    assert 'server_time' not in first.get_json()['system']
+    assert first.data == second.data
+    assert server.response_cache.hits == hits + 1
@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def sql(server):
+    import models
+    import rollups
+    with server.app.app_context():
+        yield server.db, models, rollups
+
+
+def raw_statistics(rows, start):
+    kept = [r for r in rows if r.timestamp >= start]
+    stats = {'count': len(kept)}
+    for name, field in (('front', 'front_distance'), ('ir', 'ir_distance')):
+        values = [getattr(r, field) for r in kept]
+        stats[f'avg_{name}'] = sum(values) / len(values) if values else 0
+        stats[f'min_{name}'] = min(values) if values else None
+        stats[f'max_{name}'] = max(values) if values else None
+    return stats
+
+
+def test_window_statistics_match_raw_rows(sql):
+    db, models, rollups = sql
+    rng = random.Random(3)
+    end = datetime.utcnow().replace(microsecond=0)
+    rows = [models.SensorData(device_id='rollup-cane', timestamp=end - timedelta(seconds=rng.randint(0, 3 * 3600)),
+                              front_distance=rng.uniform(5, 300), left_distance=50, right_distance=50,
+                              ir_distance=rng.uniform(10, 60), mode=1)
+            for _ in range(400)]
+    # Folded in several batches, like the write-behind writer does
+    for i in range(0, len(rows), 75):
+        db.session.add_all(rows[i:i + 75])
+        rollups.update_rollups(rows[i:i + 75])
+        db.session.commit()
+
+    for start in (end - timedelta(hours=2, minutes=17, seconds=41), end - timedelta(minutes=5, seconds=3),
+                  end - timedelta(hours=1), end - timedelta(days=1)):
+        stats = rollups.window_statistics(start, 'rollup-cane')
+        expected = raw_statistics(rows, start)
+        assert stats['count'] == expected['count']
+        for key in ('avg_front', 'min_front', 'max_front', 'avg_ir', 'min_ir', 'max_ir'):
+            assert stats[key] == pytest.approx(expected[key])
+
+
+def test_rollup_rows_are_per_bucket(sql):
+    db, models, rollups = sql
+    hour = datetime(2024, 5, 1, 10)
+    rows = [models.SensorData(device_id='bucket-cane', timestamp=hour + timedelta(seconds=s), front_distance=f,
+                              left_distance=0, right_distance=0, ir_distance=0)
+            for s, f in ((5, 10.0), (50, 30.0), (70, 20.0))]
+    db.session.add_all(rows)
+    rollups.update_rollups(rows)
+    db.session.commit()
+
+    minutes = models.SensorRollupMinute.query.filter_by(device_id='bucket-cane').order_by('bucket').all()
+    assert [(m.bucket.minute, m.count, m.sum_front, m.max_front) for m in minutes] == [(0, 2, 40.0, 30.0),
+                                                                                       (1, 1, 20.0, 20.0)]
+    [hour_row] = models.SensorRollupHour.query.filter_by(device_id='bucket-cane').all()
+    assert (hour_row.bucket, hour_row.count, hour_row.min_front) == (hour, 3, 10.0)
+
+
+def test_statistics_endpoint(sql, client):
+    db, models, rollups = sql
+    now = datetime.utcnow()
+    rows = [models.SensorData(device_id='endpoint-cane', timestamp=now - timedelta(minutes=m), front_distance=f,
+                              left_distance=0, right_distance=0, ir_distance=0)
+            for m, f in ((2, 40.0), (30, 60.0), (90, 500.0))]
+    db.session.add_all(rows)
+    rollups.update_rollups(rows)
+    db.session.commit()
+
+    body = client.get('/api/data/statistics?device=endpoint-cane&hours=1').get_json()
+    assert body['total_readings'] == 2
+    assert body['avg_front'] == pytest.approx(50.0)
+    assert (body['min_front'], body['max_front']) == (40.0, 60.0)
@@ -0,0 +1,170 @@
+import os
+import struct
+import threading
+from multiprocessing import resource_tracker
+
+import pytest
+
+from alerts import LATE
+from devices import DeviceRegistry
+from shared_state import SharedState, SharedStateFull
+
+SETTINGS = {
+    'danger_distance': 25,
+    'warn_distance': 50,
+    'safe_distance': 80,
+    'ir_ground': 20,
+    'ir_hole': 40,
+    'alert_clear_margin': 5,
+    'alert_min_hold': 2,
+    'alert_renotify_interval': 5,
+}
+
+
+@pytest.fixture
+def segment(request):
+    name = f'scss_test_{os.getpid()}_{request.node.name}'[:30]
+    writer = SharedState(name, max_devices=2, history_rows=8, event_rows=4, create=True)
+    reader = attach(name)
+    yield writer, reader
+    reader._shm.close()
+    writer.close()
+
+
+def attach(name):
+    try:
+        return SharedState(name)
+    finally:
+        # Attaching unregisters the segment from this process's tracker; the writer
+        # lives in the same process here and still owns it
+        resource_tracker.register('/' + name, 'shared_memory')
+
+
+def feed(shard, ts, front):
+    values = {'front_distance': front, 'left_distance': 100.0, 'right_distance': 100.0, 'ir_distance': 30.0}
+    shard.history.append_values(ts, front, 100.0, 100.0, 30.0, 1, 0)
+    shard.alerts.update(values, ts, SETTINGS)
+    shard.current.update(values, last_update=f'2024-05-01T10:00:{int(ts) % 60:02d}')
+    shard.version += 1
+
+
+def assert_mirrors(shard, view, rows=8, events=4):
+    expected, got = shard.history.tail(rows), view.history.tail(rows)
+    assert list(expected[0]) == list(got[0])
+    assert {f: list(c) for f, c in expected[1].items()} == {f: list(c) for f, c in got[1].items()}
+    assert list(view.alerts.events) == list(shard.alerts.events)[-events:]
+
+
+def test_reader_sees_written_device(segment):
+    writer, reader = segment
+    shard = DeviceRegistry(100, 100).get('cane-1')
+    for ts in range(3):
+        feed(shard, ts, 10.0 * (ts + 1))
+    writer.write_device(shard, 7)
+
+    snapshot = reader.snapshot('cane-1')
+    assert snapshot.version == shard.version
+    assert snapshot.current['front_distance'] == 30.0
+    assert snapshot.history_count == 3
+    assert reader.state_version() == 7
+    assert_mirrors(shard, reader.view('cane-1'))
+
+
+def test_rings_follow_appends_late_inserts_and_trims(segment):
+    writer, reader = segment
+    shard = DeviceRegistry(100, 100).get('cane-1')
+    ts = 0
+    for step in range(60):
+        ts += 1
+        feed(shard, ts, 10.0 if step % 4 else 90.0)
+        if step % 13 == 5:
+            feed(shard, ts - 3.5, 10.0)  # Late reading inside the ring
+        if step % 17 == 9:
+            shard.history.keep_last(5)
+        writer.write_device(shard, step)
+        assert_mirrors(shard, reader.view('cane-1'))
+    assert any(e.kind == LATE for e in shard.alerts.events)
+
+
+def test_rebuilds_ring_for_new_shard_object(segment):
+    writer, reader = segment
+    registry = DeviceRegistry(100, 100)
+    shard = registry.get('cane-1')
+    for ts in range(10):
+        feed(shard, ts, 100.0)
+    writer.write_device(shard, 1)
+
+    registry.clear()  # e.g. load_data() rebuilding state from the log
+    shard = registry.get('cane-1')
+    feed(shard, 100, 100.0)
+    writer.write_device(shard, 2)
+    assert list(reader.view('cane-1').history.tail(8)[0]) == [100]
+
+
+def test_overflow_raises_instead_of_dropping(segment):
+    writer, reader = segment
+    registry = DeviceRegistry(100, 100)
+    for device_id in ('a', 'b'):
+        writer.write_device(registry.get(device_id), 1)
+
+    with pytest.raises(SharedStateFull):
+        writer.reserve('c')
+    with pytest.raises(SharedStateFull):
+        writer.write_device(registry.get('c'), 2)
+    assert writer.reserve('a') == 0
+    assert sorted(s.device_id for s in reader.snapshots()) == ['a', 'b']
+
+
+def test_device_id_too_long(segment):
+    writer, _ = segment
+    with pytest.raises(ValueError):
+        writer.reserve('x' * 33)
+
+
+def test_reserved_but_unwritten_slot_is_hidden(segment):
+    writer, reader = segment
+    registry = DeviceRegistry(100, 100)
+    writer.reserve('a')
+    writer.write_device(registry.get('b'), 1)
+    assert [s.device_id for s in reader.snapshots()] == ['b']
+
+
+def test_settings_round_trip(segment):
+    writer, reader = segment
+    writer.write_settings({'danger_distance': 30}, 4)
+    assert reader.settings() == ({'danger_distance': 30}, 4)
+
+
+def test_seqlock_readers_never_see_torn_slots(segment):
+    writer, reader = segment
+    shard = DeviceRegistry(100, 100).get('cane-1')
+    feed(shard, 0, 0.0)
+    writer.write_device(shard, 0)
+    stop = threading.Event()
+
+    def write():
+        ts = 0
+        while not stop.is_set():
+            ts += 1
+            # Every field of the current reading carries the same value
+            shard.current.update(front_distance=ts, left_distance=ts, right_distance=ts, ir_distance=ts)
+            shard.version = ts
+            writer.write_device(shard, ts)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(2000):
+            current = reader.snapshot('cane-1').current
+            assert current['front_distance'] == current['left_distance'] \
+                == current['right_distance'] == current['ir_distance']
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_attach_rejects_other_layouts(segment):
+    writer, _ = segment
+    struct.pack_into('<I', writer._buf, 4, 1)  # Layout version 1
+    with pytest.raises(ValueError):
+        attach(writer.name)
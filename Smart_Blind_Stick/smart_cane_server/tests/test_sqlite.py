@@ -0,0 +1,67 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import SQLiteDatabase, create_database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'smart_cane.db'))
+    db.create_tables()
+    yield db
+    db.disconnect()
+
+
+def sensor(device_id='sqlite-cane', front=100.0, **fields):
+    return dict({'device_id': device_id, 'front_distance': front, 'left_distance': 50.0,
+                 'right_distance': 50.0, 'ir_distance': 30.0, 'mode': 1}, **fields)
+
+
+def test_backend_is_selected_by_name(tmp_path):
+    assert isinstance(create_database('sqlite'), SQLiteDatabase)
+
+
+def test_file_runs_in_wal_mode(db):
+    assert db.execute_query("SELECT * FROM pragma_journal_mode")[0]['journal_mode'] == 'wal'
+
+
+def test_bulk_insert_and_reads(db):
+    assert db.insert_sensor_data_many([sensor(front=f) for f in (10.0, 20.0, 30.0)]) == 3
+    assert db.insert_sensor_data(sensor('other-cane')) == 1
+
+    recent = db.get_recent_data(limit=10, device_id='sqlite-cane')
+    assert sorted(row['front_distance'] for row in recent) == [10.0, 20.0, 30.0]
+    assert isinstance(recent[0]['timestamp'], datetime)
+    [stats] = db.get_statistics(hours=1)
+    assert stats['total_readings'] == 4
+    assert stats['avg_front'] == pytest.approx(40.0)
+
+
+def test_time_range_is_streamed_in_batches(db):
+    db.insert_sensor_data_many([sensor(front=float(i)) for i in range(25)])
+    start, end = datetime.utcnow() - timedelta(hours=1), datetime.utcnow() + timedelta(hours=1)
+    rows = db.get_data_by_time_range(start, end, batch_size=10)
+
+    assert not isinstance(rows, list)
+    assert [row['front_distance'] for row in rows] == [float(i) for i in range(25)]
+
+
+def test_failed_bulk_insert_rolls_back(db):
+    rows = [(f'cane-{i}', 1.0, 1.0, 1.0, 1.0, 1, -50) for i in range(3)] + [('too', 'few')]
+    assert db.execute_many(db.INSERT_SENSOR_DATA, rows) is None
+    assert db.get_recent_data() == []
+
+
+def test_writers_on_several_threads(db):
+    def write(n):
+        for _ in range(20):
+            db.insert_sensor_data_many([sensor(f'thread-{n}')] * 5)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.execute_query("SELECT COUNT(*) AS n FROM sensor_data")[0]['n'] == 400
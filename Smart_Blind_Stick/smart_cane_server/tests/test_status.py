@@ -0,0 +1,57 @@
+from status import status_changed
+
+
+def status(battery=80, power=True, wifi=True):
+    return {'battery_level': battery, 'power_status': power, 'wifi_connected': wifi}
+
+
+def test_first_status_is_always_logged():
+    assert status_changed(None, status())
+
+
+def test_flag_flips_are_changes():
+    assert status_changed(status(), status(wifi=False))
+    assert status_changed(status(), status(power=False))
+
+
+def test_battery_jitter_is_not_a_change():
+    assert not status_changed(status(80), status(79))
+    assert not status_changed(status(80), status(84))
+    assert status_changed(status(80), status(75))
+
+
+def test_battery_threshold_crossing_is_a_change():
+    assert status_changed(status(51), status(50))
+    assert status_changed(status(11), status(10))
+    assert not status_changed(status(49), status(46))
+
+
+def test_latest_row_is_upserted_and_history_appended_on_change(tmp_path):
+    from database import SQLiteDatabase
+    db = SQLiteDatabase(str(tmp_path / 'status.db'))
+    db.create_tables()
+
+    levels = [90, 89, 88, 84, 50, 49]
+    changed = [db.update_device_status({'device_id': 'status-cane', 'battery_level': level,
+                                        'power_status': True, 'wifi_connected': True})
+               for level in levels]
+
+    assert changed == [True, False, False, True, True, False]
+    assert db.get_device_status('status-cane')['battery_level'] == 49
+    history = db.execute_query("SELECT battery_level FROM device_status WHERE device_id = %s ORDER BY id",
+                               ('status-cane',))
+    assert [row['battery_level'] for row in history] == [90, 84, 50]
+    db.disconnect()
+
+
+def test_sql_store_keeps_one_latest_row_per_device(server):
+    from datetime import datetime
+    from models import DeviceLatestStatus, DeviceStatus
+    with server.app.app_context():
+        for level in (70, 69, 60):
+            server.routes.record_status(dict(status(level), device_id='orm-cane', last_seen=datetime.utcnow()))
+            server.db.session.commit()
+
+        assert DeviceLatestStatus.query.filter_by(device_id='orm-cane').one().battery_level == 60
+        logged = DeviceStatus.query.filter_by(device_id='orm-cane').order_by(DeviceStatus.id).all()
+        assert [row.battery_level for row in logged] == [70, 60]
@@ -0,0 +1,181 @@
+import os
+
+import pytest
+
+from storage import PartitionedLog, SegmentedLog
+
+
+def record(i, day='2024-05-01'):
+    return {'timestamp': f'{day}T10:00:{i % 60:02d}', 'n': i}
+
+
+def open_log(path, **options):
+    log = SegmentedLog(str(path), **options)
+    log.open()
+    return log
+
+
+def append_each(log, count):
+    # One write per record: a single append_many() rotates at most once
+    for i in range(count):
+        log.append(record(i))
+
+
+def test_rotation_keeps_append_order(tmp_path):
+    log = open_log(tmp_path, segment_max_bytes=200)
+    append_each(log, 20)
+    log.append_many(record(i) for i in range(20, 30))
+
+    assert log.segment_count() > 2
+    assert [r['n'] for r in log.read_all()] == list(range(30))
+
+
+def test_reopen_continues_after_last_segment(tmp_path):
+    log = open_log(tmp_path, segment_max_bytes=200)
+    append_each(log, 10)
+    log.close()
+
+    log = open_log(tmp_path, segment_max_bytes=200)
+    log.append(record(10))
+    assert [r['n'] for r in log.read_all()] == list(range(11))
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    log = open_log(tmp_path)
+    log.append_many([record(0), record(1)])
+    log.close()
+    with open(tmp_path / 'seg-00000001-00000001.ndjson', 'a', encoding='utf-8') as f:
+        f.write('{"timestamp": "2024-05-01T10:00:02", "n"')
+
+    log = open_log(tmp_path)
+    assert [r['n'] for r in log.read_all()] == [0, 1]
+
+
+def test_compact_merges_sealed_segments(tmp_path):
+    log = open_log(tmp_path, segment_max_bytes=100, compact_min_segments=3)
+    append_each(log, 12)
+    sealed = log.segment_count() - 1
+    assert sealed >= 3
+
+    assert log.compact()
+    assert log.segment_count() == 2
+    assert [r['n'] for r in log.read_all()] == list(range(12))
+
+
+def test_compact_leaves_merged_files_alone_until_their_tier_fills(tmp_path):
+    log = open_log(tmp_path, segment_max_bytes=1, compact_min_segments=3)
+    append_each(log, 3)
+    assert log.compact()
+    merged = tmp_path / 'seg-00000001-00000003.ndjson'
+    written = merged.stat().st_mtime_ns
+
+    # Three new segments form a second tier-1 file; the first one is not rewritten
+    log.append_many([record(3)])
+    log.append_many([record(4)])
+    log.append_many([record(5)])
+    assert log.compact()
+    assert merged.stat().st_mtime_ns == written
+    assert (tmp_path / 'seg-00000004-00000006.ndjson').exists()
+    assert not log.compact()
+
+    # A third tier-1 file completes the run: all nine segments merge into tier 2
+    for i in range(6, 9):
+        log.append(record(i))
+    assert log.compact()
+    assert log.segment_count() == 2
+    assert (tmp_path / 'seg-00000001-00000009.ndjson').exists()
+    assert [r['n'] for r in log.read_all()] == list(range(9))
+
+
+def test_open_recovers_from_interrupted_compaction(tmp_path):
+    log = open_log(tmp_path, segment_max_bytes=100)
+    append_each(log, 12)
+    log.close()
+    sealed = sorted(n for n in os.listdir(tmp_path) if n.endswith('.ndjson'))[:-1]
+    # Merged file written, originals not removed yet, plus a stray temp file
+    first, last = sealed[0][4:12], sealed[-1][13:21]
+    lines = b''.join((tmp_path / name).read_bytes() for name in sealed)
+    (tmp_path / f'seg-{first}-{last}.ndjson').write_bytes(lines)
+    (tmp_path / 'seg-00000099-00000099.ndjson.tmp').write_text('partial')
+
+    log = open_log(tmp_path, segment_max_bytes=100)
+    names = os.listdir(tmp_path)
+    assert not any(n.endswith('.tmp') for n in names)
+    assert not any(n in names for n in sealed)
+    assert [r['n'] for r in log.read_all()] == list(range(12))
+
+
+def test_rewrite_replaces_content(tmp_path):
+    log = open_log(tmp_path, segment_max_bytes=100)
+    append_each(log, 12)
+    log.rewrite([record(7), record(8)])
+    log.append(record(9))
+    assert [r['n'] for r in log.read_all()] == [7, 8, 9]
+
+
+def test_partitions_by_day_and_expires_whole_days(tmp_path):
+    log = PartitionedLog(str(tmp_path))
+    log.open()
+    log.append_many([record(0, '2024-05-01'), record(1, '2024-05-02'), record(2, '2024-05-03')])
+
+    assert log.days() == ['2024-05-01', '2024-05-02', '2024-05-03']
+    assert [r['n'] for r in log.read_all(first_day='2024-05-02')] == [1, 2]
+    assert log.expire('2024-05-03') == ['2024-05-01', '2024-05-02']
+    assert not (tmp_path / '2024-05-01').exists()
+    assert [r['n'] for r in log.read_all()] == [2]
+
+
+def test_partitioned_open_migrates_flat_segments(tmp_path):
+    flat = open_log(tmp_path)
+    flat.append_many([record(0, '2024-05-01'), record(1, '2024-05-02')])
+    flat.close()
+
+    log = PartitionedLog(str(tmp_path))
+    log.open()
+    assert log.days() == ['2024-05-01', '2024-05-02']
+    assert [r['n'] for r in log.read_all()] == [0, 1]
+    assert not any(n.endswith('.ndjson') for n in os.listdir(tmp_path))
+
+
+def flat_log(path):
+    flat = open_log(path)
+    flat.append_many([record(0, '2024-05-01'), record(1, '2024-05-02')])
+    flat.close()
+
+
+def test_migration_interrupted_before_commit_is_redone(tmp_path):
+    flat_log(tmp_path)
+    # Crash while staging: a partial copy without the COMPLETE marker
+    (tmp_path / '.migrate' / '2024-05-01').mkdir(parents=True)
+    (tmp_path / '.migrate' / '2024-05-01' / 'seg-00000001-00000001.ndjson').write_text('partial')
+
+    log = PartitionedLog(str(tmp_path))
+    log.open()
+    assert [r['n'] for r in log.read_all()] == [0, 1]
+    assert not (tmp_path / '.migrate').exists()
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize('step', ['remove', 'replace'])
+def test_migration_interrupted_after_commit_does_not_duplicate(tmp_path, monkeypatch, step):
+    flat_log(tmp_path)
+    real = getattr(os, step)
+
+    def crash_on_second_day(path, *rest):
+        if '2024-05-02' in os.fspath(rest[0] if rest else path) or step == 'remove':
+            raise Crash()
+        return real(path, *rest)
+
+    # Crash after the COMPLETE marker: while deleting flat segments or moving days
+    monkeypatch.setattr(os, step, crash_on_second_day)
+    with pytest.raises(Crash):
+        PartitionedLog(str(tmp_path)).open()
+    monkeypatch.undo()
+
+    log = PartitionedLog(str(tmp_path))
+    log.open()
+    assert [r['n'] for r in log.read_all()] == [0, 1]
+    assert not (tmp_path / '.migrate').exists()
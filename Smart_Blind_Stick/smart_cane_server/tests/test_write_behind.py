@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from write_behind import BacklogFull, WriteBehindQueue
+
+
+def make_queue(flush_fn, **options):
+    options.setdefault('flush_interval', 0.01)
+    return WriteBehindQueue(flush_fn, **options).start()
+
+
+def test_items_are_written_in_batches():
+    written = []
+    queue = make_queue(lambda items: written.append(list(items)), batch_size=3)
+    seqs = [queue.put(i) for i in range(7)]
+
+    assert queue.wait_flushed(seqs[-1], timeout=5)
+    queue.close(timeout=5)
+    assert [item for batch in written for item in batch] == list(range(7))
+    assert all(len(batch) <= 3 for batch in written)
+
+
+def test_retry_then_success():
+    calls = []
+
+    def flaky(items):
+        calls.append(list(items))
+        if len(calls) < 3:
+            raise ConnectionError('database restarting')
+
+    queue = make_queue(flaky, retries=2)
+    seq = queue.put('row')
+    assert queue.wait_flushed(seq, timeout=5)
+    queue.close(timeout=5)
+    assert calls == [['row']] * 3
+    assert queue.dropped == 0 and queue.batches == 1
+
+
+def test_batch_dropped_after_retries():
+    def down(items):
+        raise ConnectionError('database down')
+
+    queue = make_queue(down, retries=1)
+    seq = queue.put('row')
+    assert not queue.wait_flushed(seq, timeout=5)
+    queue.close(timeout=5)
+    assert queue.dropped == 1
+
+
+def test_failing_on_flush_does_not_rewrite_batch():
+    calls = []
+
+    def on_flush(seconds, count):
+        raise RuntimeError('metrics broken')
+
+    queue = make_queue(calls.append, on_flush=on_flush, retries=3)
+    seq = queue.put('row')
+    assert queue.wait_flushed(seq, timeout=5)
+    queue.close(timeout=5)
+    assert calls == [['row']]
+    assert queue.dropped == 0
+
+
+def test_on_flush_gets_duration_and_count():
+    seen = []
+    queue = make_queue(lambda items: None, on_flush=lambda seconds, count: seen.append((seconds, count)))
+    seq = [queue.put(i) for i in range(3)][-1]
+    assert queue.wait_flushed(seq, timeout=5)
+    queue.close(timeout=5)
+    assert sum(count for _, count in seen) == 3
+    assert all(seconds >= 0 for seconds, _ in seen)
+
+
+def test_full_backlog_raises():
+    gate = threading.Event()
+    queue = make_queue(lambda items: gate.wait(), max_backlog=1, put_timeout=0.01, batch_size=1)
+    try:
+        queue.put('first')  # Taken by the writer, which then blocks
+        for _ in range(100):
+            if not queue.backlog():
+                break
+            time.sleep(0.01)
+        queue.put('second')
+        with pytest.raises(BacklogFull):
+            queue.put('third')
+    finally:
+        gate.set()
+        queue.close(timeout=5)
+
+
+def test_close_drains_backlog():
+    written = []
+    queue = make_queue(written.extend, flush_interval=10)
+    for i in range(5):
+        queue.put(i)
+    queue.close(timeout=5)
+    assert written == list(range(5))
+    with pytest.raises(BacklogFull):
+        queue.put('late')
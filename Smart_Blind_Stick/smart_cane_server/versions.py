@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class VersionClock:
+    """Monotonically increasing state version with long-poll waiters.
+
+    Every change takes the next version with ``tick(update)``; ``update``
+    stores it on the changed resource before waiters are woken, so a
+    request blocked in ``wait()`` always sees the new version. Coroutines
+    use ``wait_async()``, which suspends instead of holding a thread.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()  # (loop, future) of coroutines in wait_async()
+
+    def _notify(self):
+        """Wake every waiter; called with the lock held"""
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # Loop already closed
+
+    def tick(self, update=None):
+        with self._cond:
+            self.value += 1
+            if update is not None:
+                update(self.value)
+            self._notify()
+            return self.value
+
+    def advance_to(self, value):
+        """Move to ``value`` (a version published by another process) and wake waiters"""
+        with self._cond:
+            if value > self.value:
+                self.value = value
+            self._notify()
+            return self.value
+
+    def wait(self, predicate, timeout):
+        """Block until ``predicate()`` is true or ``timeout`` seconds pass"""
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+    async def wait_async(self, predicate, timeout):
+        """wait() for coroutines: suspend until ``predicate()`` is true or ``timeout`` seconds pass"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._cond:
+                if predicate():
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                waiter = (loop, loop.create_future())
+                self._async_waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
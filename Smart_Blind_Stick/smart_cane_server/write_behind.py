@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class BacklogFull(Exception):
+    """The write-behind backlog is full; the caller should shed load"""
+
+
+class WriteBehindQueue:
+    """Group-commit buffer in front of a slow store.
+
+    Producers ``put()`` items and return immediately. A single writer thread
+    hands them to ``flush_fn(items)`` in batches of up to ``batch_size``,
+    either when a batch is full or ``flush_interval`` seconds after its
+    first item arrived, so one transaction covers many readings.
+
+    The backlog is bounded by ``max_backlog``: ``put()`` waits at most
+    ``put_timeout`` seconds for room and then raises ``BacklogFull``.
+    ``put()`` returns a sequence number; ``wait_flushed(seq)`` blocks until
+    that item's batch has been written (for callers that need the write
+    committed before answering). A batch that still fails after ``retries``
+    attempts is dropped and counted. ``close()`` drains the backlog.
+    """
+
+    def __init__(self, flush_fn, batch_size=500, flush_interval=1.0,
+                 max_backlog=50000, put_timeout=0.5, retries=2, name='write-behind',
+                 on_flush=None):
+        self.flush_fn = flush_fn
+        self.on_flush = on_flush  # on_flush(seconds, items) after each successful batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_backlog)
+        self._seq_lock = threading.Lock()
+        self._flushed = threading.Condition()
+        self._next_seq = 0
+        self._flushed_seq = 0
+        self._dropped_ranges = deque(maxlen=256)
+        self._closed = False
+        self._thread = None
+        self.batches = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def put(self, item):
+        """Queue one item, return its sequence number"""
+        if self._closed:
+            raise BacklogFull(f'{self.name} is closed')
+        with self._seq_lock:
+            # Sequence numbers must follow queue order
+            self._next_seq += 1
+            seq = self._next_seq
+            try:
+                self._queue.put((seq, item), timeout=self.put_timeout)
+            except queue.Full:
+                self._next_seq -= 1
+                raise BacklogFull(f'{self.name} backlog is full ({self._queue.maxsize} items)')
+        return seq
+
+    def wait_flushed(self, seq, timeout=None):
+        """Wait until item ``seq`` is written; False on timeout or if its batch was dropped"""
+        with self._flushed:
+            if not self._flushed.wait_for(lambda: self._flushed_seq >= seq, timeout):
+                return False
+            return not any(first <= seq <= last for first, last in self._dropped_ranges)
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=None):
+        """Stop accepting items and flush what is queued"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((None, None))
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Writer thread
+    # ------------------------------------------------------------------
+    def _collect(self):
+        """Block for the first item, then gather a batch until full or due"""
+        seq, item = self._queue.get()
+        if seq is None:
+            return [], None, None, True
+
+        batch = [item]
+        first_seq = seq
+        last_seq = seq
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                seq, item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 \
+                    else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if seq is None:
+                return batch, first_seq, last_seq, True
+            batch.append(item)
+            last_seq = seq
+        return batch, first_seq, last_seq, False
+
+    def _write(self, batch, first_seq, last_seq):
+        for attempt in range(self.retries + 1):
+            try:
+                started = time.perf_counter()
+                self.flush_fn(batch)
+                seconds = time.perf_counter() - started
+                self.batches += 1
+                break
+            except Exception as e:
+                log.warning("%s: flush of %d items failed (attempt %d): %s",
+                            self.name, len(batch), attempt + 1, e)
+        else:
+            self.dropped += len(batch)
+            with self._flushed:
+                self._dropped_ranges.append((first_seq, last_seq))
+            seconds = None
+
+        # Outside the retry loop: a failing callback must not re-write a committed batch
+        if seconds is not None and self.on_flush is not None:
+            try:
+                self.on_flush(seconds, len(batch))
+            except Exception:
+                log.exception("%s: on_flush callback failed", self.name)
+        with self._flushed:
+            self._flushed_seq = last_seq
+            self._flushed.notify_all()
+
+    def _run(self):
+        while True:
+            batch, first_seq, last_seq, stop = self._collect()
+            if batch:
+                self._write(batch, first_seq, last_seq)
+            if stop:
+                break
+        # Drain anything that raced with close()
+        rest = []
+        while True:
+            try:
+                seq, item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if seq is not None:
+                rest.append((seq, item))
+        for start in range(0, len(rest), self.batch_size):
+            chunk = rest[start:start + self.batch_size]
+            self._write([item for _, item in chunk], chunk[0][0], chunk[-1][0])